@@ -0,0 +1,228 @@
+"""
+    Content-addressed store for large notebook outputs.
+
+    Plots and big html or text outputs are most of the bytes of a
+    notebook, and they rarely change between saves. With a blob store,
+    outputs over a size threshold are written once to a file named by
+    their sha1 and the notebook keeps a reference in the output's
+    metadata instead:
+
+        {"output_type": "pyout", "metadata": {"blobs": {"png": "<sha1>"}}}
+
+    Outputs are put back when a notebook is read. Blobs no notebook
+    refers to anymore are removed by
+
+        python -m ipycli.blobstore gc <notebook dir>
+"""
+import copy
+import hashlib
+import json
+import os
+import os.path
+import sys
+import tempfile
+import time
+
+from .nbcodecs import detect
+
+# the output fields that can get big
+BLOB_KEYS = ('png', 'jpeg', 'svg', 'html', 'text', 'latex', 'javascript', 'json')
+# where DirectoryProject keeps its blobs, hidden so listings skip it
+BLOB_DIR = '.ipynb_blobs'
+# blobs younger than this are never collected, their notebook may still
+# be being written
+GC_GRACE = 3600
+
+class MissingBlob(Exception):
+    pass
+
+class BlobStore(object):
+    def __init__(self, root, fsync=True):
+        self.root = root
+        self.fsync = fsync
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def put(self, data):
+        """
+            Store data, unicode or bytes, and return its digest. Data
+            already in the store isn't written again.
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            try:
+                # referenced again, gc's grace period starts over
+                os.utime(path, None)
+                return digest
+            except OSError:
+                # collected meanwhile, write it again
+                pass
+        dir = os.path.dirname(path)
+        if not os.path.isdir(dir):
+            try:
+                os.makedirs(dir)
+            except OSError:
+                # made by a concurrent put
+                if not os.path.isdir(dir):
+                    raise
+        fd, tmp = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.rename(tmp, path)
+        except:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        return digest
+
+    def get(self, digest):
+        try:
+            with open(self.path(digest), 'rb') as f:
+                return f.read().decode('utf-8')
+        except IOError:
+            raise MissingBlob(digest)
+
+    def digests(self):
+        """
+            (digest, mtime) of every blob in the store
+        """
+        if not os.path.isdir(self.root):
+            return
+        for prefix in os.listdir(self.root):
+            dir = os.path.join(self.root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(dir):
+                continue
+            for name in os.listdir(dir):
+                if name.startswith('.'):
+                    continue
+                yield prefix + name, os.path.getmtime(os.path.join(dir, name))
+
+    def gc(self, referenced, grace=GC_GRACE, dry_run=False):
+        """
+            Remove the blobs not in referenced that are older than grace
+            seconds. Returns the digests removed.
+        """
+        cutoff = time.time() - grace
+        removed = []
+        for digest, mtime in list(self.digests()):
+            if digest in referenced or mtime > cutoff:
+                continue
+            if not dry_run:
+                os.unlink(self.path(digest))
+            removed.append(digest)
+        return removed
+
+def _outputs(nb):
+    for ws in nb.get('worksheets', []):
+        for cell in ws.get('cells', []):
+            for output in cell.get('outputs', []):
+                yield output
+
+def externalize(nb, store, threshold):
+    """
+        Copy of nb with its outputs of at least threshold characters moved
+        into store. Only what leads to a moved output is copied.
+    """
+    nb = copy.copy(nb)
+    worksheets = []
+    for ws in nb.get('worksheets', []):
+        ws = copy.copy(ws)
+        cells = []
+        for cell in ws.get('cells', []):
+            if cell.get('outputs'):
+                cell = copy.copy(cell)
+                cell['outputs'] = [_externalize_output(output, store, threshold)
+                                   for output in cell['outputs']]
+            cells.append(cell)
+        ws['cells'] = cells
+        worksheets.append(ws)
+    nb['worksheets'] = worksheets
+    return nb
+
+def _externalize_output(output, store, threshold):
+    blobs = {}
+    for key in BLOB_KEYS:
+        value = output.get(key)
+        if isinstance(value, basestring) and len(value) >= threshold:
+            blobs[key] = store.put(value)
+    if not blobs:
+        return output
+    output = copy.copy(output)
+    for key in blobs:
+        del output[key]
+    metadata = dict(output.get('metadata') or {})
+    metadata['blobs'] = dict(metadata.get('blobs') or {}, **blobs)
+    output['metadata'] = metadata
+    return output
+
+def rehydrate(nb, store):
+    """
+        Put the outputs of nb that are in store back, in place
+    """
+    for ws in nb.get('worksheets', []):
+        rehydrate_cells(ws.get('cells', []), store)
+
+def rehydrate_cells(cells, store):
+    for cell in cells:
+        for output in cell.get('outputs', []):
+            metadata = output.get('metadata') or {}
+            blobs = metadata.pop('blobs', None)
+            if not blobs:
+                continue
+            for key, digest in blobs.items():
+                output[key] = store.get(digest)
+
+def references(nb):
+    """
+        The blob digests nb refers to
+    """
+    found = set()
+    for output in _outputs(nb):
+        metadata = output.get('metadata') or {}
+        found.update((metadata.get('blobs') or {}).values())
+    return found
+
+def collect(dir, ext='.ipynb', grace=GC_GRACE, dry_run=False):
+    """
+        Remove the unreferenced blobs of the notebooks under dir. Every
+        notebook in the tree counts, so blobs are kept for recursive and
+        plain projects alike.
+    """
+    from .folder_backend import TreeWalk
+    store = BlobStore(os.path.join(dir, BLOB_DIR))
+    walk = TreeWalk(dir, ext, max_depth=sys.maxint, max_entries=sys.maxint)
+    files, _ = walk.walk()
+    referenced = set()
+    for path, _ in files:
+        # compressed notebooks too
+        with open(path, 'rb') as f:
+            referenced.update(references(json.load(detect(path).wrap(f, 'rb'))))
+    return store.gc(referenced, grace=grace, dry_run=dry_run)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Notebook output blob store")
+    parser.add_argument('action', choices=['gc'])
+    parser.add_argument('dir')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--grace', type=int, default=GC_GRACE,
+                        help="keep blobs younger than this many seconds")
+    args = parser.parse_args(argv)
+
+    removed = collect(os.path.abspath(args.dir), grace=args.grace,
+                      dry_run=args.dry_run)
+    verb = 'would remove' if args.dry_run else 'removed'
+    print "%s %d blobs" % (verb, len(removed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+    Watch notebook directories for changes.
+
+    The watchers call callback(dir, event, path) on the IOLoop for every
+    notebook created, modified or deleted in a watched dir, so listings
+    can be kept up to date without rescanning. Renames come through as a
+    delete and a create. inotify is used through pyinotify when it is
+    installed, otherwise the dirs are polled. Recursive watches cover the
+    tree under a dir, minus the dirs recursive projects ignore.
+"""
+import os
+import os.path
+import threading
+import time
+
+from zmq.eventloop import ioloop
+
+from .folder_backend import (list_files, is_ignored, getmtime, TreeWalk,
+                             RACY_WINDOW)
+from .nbcodecs import is_notebook
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+CREATE = 'create'
+MODIFY = 'modify'
+DELETE = 'delete'
+
+def make_watcher(callback, ext, interval=5, io_loop=None):
+    if pyinotify is not None:
+        return InotifyWatcher(callback, ext, io_loop=io_loop)
+    return PollingWatcher(callback, ext, interval=interval, io_loop=io_loop)
+
+class PollingWatcher(object):
+    """
+        Polls the watched dirs off the IOLoop, one poll at a time, and
+        delivers the events on it. A dir whose tree hasn't changed only
+        has its notebooks stat'ed again, the full listing is redone when
+        the mtime of one of its dirs moves.
+    """
+    def __init__(self, callback, ext, interval=5, io_loop=None):
+        self.callback = callback
+        self.ext = ext
+        self.io_loop = io_loop or ioloop.IOLoop.instance()
+        # dir -> ({path: mtime}, {dir: mtime}, started) as of the last poll
+        self.snapshots = {}
+        # dirs watched recursively
+        self.recursive = set()
+        self.lock = threading.Lock()
+        self.polling = False
+        self.timer = ioloop.PeriodicCallback(self.poll, interval * 1000,
+                                             io_loop=self.io_loop)
+        self.timer.start()
+
+    def watch(self, dir, recursive=False):
+        if dir not in self.snapshots:
+            if recursive:
+                self.recursive.add(dir)
+            snapshot = self._snapshot(dir)
+            with self.lock:
+                self.snapshots[dir] = snapshot
+
+    def unwatch(self, dir):
+        with self.lock:
+            self.snapshots.pop(dir, None)
+            self.recursive.discard(dir)
+
+    def _snapshot(self, dir):
+        started = time.time()
+        if dir in self.recursive:
+            files, dirs = TreeWalk(dir, self.ext).walk()
+            return dict(files), dirs, started
+        try:
+            dirs = {dir: os.stat(dir).st_mtime}
+            return dict(list_files(dir, self.ext)), dirs, started
+        except OSError:
+            return {}, {}, started
+
+    def _restat(self, snapshot):
+        """
+            The snapshot with its notebooks stat'ed again, or None if
+            its dirs changed and it needs listing again
+        """
+        files, dirs, started = snapshot
+        if not dirs or max(dirs.values()) >= started - RACY_WINDOW:
+            return None
+        try:
+            for dir, mtime in dirs.items():
+                if os.stat(dir).st_mtime != mtime:
+                    return None
+            files = dict((path, getmtime(path)) for path in files)
+        except OSError:
+            return None
+        return files, dirs, started
+
+    def changes(self):
+        """
+            Poll the watched dirs, returns [(dir, event, path)]
+        """
+        with self.lock:
+            snapshots = self.snapshots.items()
+        events = []
+        for dir, old in snapshots:
+            new = self._restat(old) or self._snapshot(dir)
+            with self.lock:
+                if dir not in self.snapshots:
+                    continue
+                self.snapshots[dir] = new
+            old, new = old[0], new[0]
+            for path in set(old) - set(new):
+                events.append((dir, DELETE, path))
+            for path, mtime in new.items():
+                if path not in old:
+                    events.append((dir, CREATE, path))
+                elif old[path] != mtime:
+                    events.append((dir, MODIFY, path))
+        return events
+
+    def poll(self):
+        if self.polling:
+            return
+        self.polling = True
+        def poll():
+            events = []
+            try:
+                events = self.changes()
+            finally:
+                self.io_loop.add_callback(lambda: self._deliver(events))
+        t = threading.Thread(target=poll, name='dir-poll')
+        t.daemon = True
+        t.start()
+
+    def _deliver(self, events):
+        self.polling = False
+        for event in events:
+            self.callback(*event)
+
+    def stop(self):
+        self.timer.stop()
+
+if pyinotify is not None:
+    EVENTS = {
+        pyinotify.IN_CREATE: CREATE,
+        pyinotify.IN_MOVED_TO: CREATE,
+        pyinotify.IN_CLOSE_WRITE: MODIFY,
+        pyinotify.IN_DELETE: DELETE,
+        pyinotify.IN_MOVED_FROM: DELETE,
+    }
+    MASK = reduce(lambda a, b: a | b, EVENTS)
+
+    class _EventHandler(pyinotify.ProcessEvent):
+        def my_init(self, watcher=None):
+            self.watcher = watcher
+
+        def process_default(self, event):
+            self.watcher._handle(event)
+
+class InotifyWatcher(object):
+    def __init__(self, callback, ext, io_loop=None):
+        self.callback = callback
+        self.ext = ext
+        self.io_loop = io_loop or ioloop.IOLoop.instance()
+        self.wm = pyinotify.WatchManager()
+        # dir -> watch descriptor
+        self.watches = {}
+        self.notifier = pyinotify.TornadoAsyncNotifier(
+            self.wm, self.io_loop,
+            default_proc_fun=_EventHandler(watcher=self))
+
+    def watch(self, dir, recursive=False):
+        if dir in self.watches:
+            return
+        if not recursive:
+            wdd = self.wm.add_watch(dir, MASK)
+        else:
+            # subdirs created later are picked up through auto_add
+            wdd = self.wm.add_watch(dir, MASK, rec=True, auto_add=True,
+                                    exclude_filter=self._exclude(dir))
+        self.watches[dir] = wdd.get(dir)
+
+    def _exclude(self, root):
+        def exclude(path):
+            if path == root:
+                return False
+            return is_ignored(os.path.basename(path))
+        return exclude
+
+    def unwatch(self, dir):
+        wd = self.watches.pop(dir, None)
+        if wd is not None and wd > 0:
+            # takes the watches on subdirs along
+            self.wm.rm_watch(wd, rec=True)
+
+    def _handle(self, event):
+        if event.dir or not is_notebook(event.name, self.ext):
+            return
+        for mask, kind in EVENTS.items():
+            if event.mask & mask:
+                self.callback(event.path, kind, event.pathname)
+                return
+
+    def stop(self):
+        self.notifier.stop()
@@ -1,21 +1,266 @@
-import glob
-import io
+import os
 import os.path
 import datetime
+import fnmatch
+import stat
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 
 from tornado import web
 
 from IPython.nbformat import current
 
+from .blobstore import (BlobStore, MissingBlob, BLOB_DIR, externalize,
+                        rehydrate, rehydrate_cells)
+from .nbcache import NotebookCache
+from .nbcodecs import (is_notebook, notebook_name, for_path, get_codec,
+                       suffixes, detect, read_notebook)
+from .nbpaging import FilePages, UnsupportedNotebook
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# a dir modified this close to a scan may have changed in the same mtime
+# tick, so it is scanned again next time
+RACY_WINDOW = 2
+
+# when saves fsync: never, the file before it's renamed into place, or
+# the dir as well so the rename itself survives a crash
+FSYNC_POLICIES = ('never', 'file', 'always')
+
+# mode for new files, mkstemp would make them 0600
+_umask = os.umask(0)
+os.umask(_umask)
+NEW_FILE_MODE = 0666 & ~_umask
+
 def getmtime(file):
     timestamp = os.path.getmtime(file)
     return datetime.datetime.fromtimestamp(timestamp)
 
+def atomic_write(path, data, fsync='file'):
+    """
+        Write data to a hidden temp file next to path and rename it over
+        path, so a crash leaves the old or the new file, never a partial
+        one. data can also be a function writing to the open temp file.
+        Returns the time taken by each step, in seconds.
+    """
+    if fsync not in FSYNC_POLICIES:
+        raise ValueError("fsync must be one of %s" % (FSYNC_POLICIES,))
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    # write through symlinks instead of replacing them
+    path = os.path.realpath(path)
+    dir, name = os.path.split(path)
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        mode = NEW_FILE_MODE
+
+    timings = {'fsync': 0.0}
+    start = time.time()
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % name, suffix='.tmp', dir=dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if callable(data):
+                data(f)
+            else:
+                f.write(data)
+            f.flush()
+            timings['bytes'] = f.tell()
+            timings['write'] = time.time() - start
+            if fsync != 'never':
+                start = time.time()
+                os.fsync(f.fileno())
+                timings['fsync'] += time.time() - start
+        os.chmod(tmp, mode)
+        start = time.time()
+        os.rename(tmp, path)
+        timings['rename'] = time.time() - start
+    except:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+    if fsync == 'always':
+        start = time.time()
+        dir_fd = os.open(dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        timings['fsync'] += time.time() - start
+    return timings
+
+def list_files(dir, ext):
+    """
+        (path, mtime) for the non hidden files in dir ending with ext.
+        One pass over the dir with scandir when it's available.
+    """
+    files = []
+    if scandir is not None:
+        for entry in scandir(dir):
+            if not is_notebook(entry.name, ext):
+                continue
+            try:
+                timestamp = entry.stat().st_mtime
+            except OSError:
+                # removed since we listed it
+                continue
+            files.append((entry.path, datetime.datetime.fromtimestamp(timestamp)))
+        return files
+
+    for name in os.listdir(dir):
+        if not is_notebook(name, ext):
+            continue
+        path = os.path.join(dir, name)
+        try:
+            files.append((path, getmtime(path)))
+        except OSError:
+            continue
+    return files
+
+# dirs recursive projects don't walk into. Hidden dirs cover .git,
+# .ipynb_checkpoints, .tox and friends
+IGNORE_DIRS = ['.*', 'node_modules', '__pycache__', '*.egg-info',
+               'site-packages', 'venv', 'env', 'virtualenv']
+# a dir holding this is a virtualenv
+VENV_MARKER = 'pyvenv.cfg'
+
+def is_ignored(name, ignore=IGNORE_DIRS):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in ignore)
+
+def _entries(dir):
+    """
+        (name, path, is_dir, mtime) for the entries of dir. Symlinked
+        dirs aren't followed.
+    """
+    if scandir is not None:
+        for entry in scandir(dir):
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            yield entry.name, entry.path, is_dir, mtime
+        return
+
+    for name in os.listdir(dir):
+        path = os.path.join(dir, name)
+        try:
+            info = os.lstat(path)
+        except OSError:
+            continue
+        yield name, path, stat.S_ISDIR(info.st_mode), info.st_mtime
+
+class TreeWalk(object):
+    """
+        Walk a tree for notebooks, pruning ignored dirs and stopping at
+        max_depth and after max_entries entries. The subtrees under the
+        root are walked in parallel.
+    """
+    def __init__(self, root, ext, ignore=IGNORE_DIRS, max_depth=8,
+                 max_entries=50000, workers=4):
+        self.root = root
+        self.ext = ext
+        self.ignore = ignore
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        self.workers = workers
+        self.entries = 0
+        self.truncated = False
+        self.lock = threading.Lock()
+
+    def walk(self):
+        """
+            Returns (files, dirs). files is [(path, mtime)] for the
+            notebooks, dirs is {dir: mtime} for every dir walked.
+        """
+        files, dirs, subdirs = [], {}, []
+        self._walk_dir(self.root, 0, files, dirs, subdirs)
+        if not subdirs:
+            return files, dirs
+
+        pool = ThreadPool(min(self.workers, len(subdirs)))
+        try:
+            results = pool.map(self._walk_subtree, subdirs)
+        finally:
+            pool.close()
+        for sub_files, sub_dirs in results:
+            files.extend(sub_files)
+            dirs.update(sub_dirs)
+        return files, dirs
+
+    def _walk_subtree(self, start):
+        files, dirs = [], {}
+        stack = [start]
+        while stack:
+            dir, depth = stack.pop()
+            self._walk_dir(dir, depth, files, dirs, stack)
+        return files, dirs
+
+    def _walk_dir(self, dir, depth, files, dirs, subdirs):
+        try:
+            dirs[dir] = os.stat(dir).st_mtime
+            entries = list(_entries(dir))
+        except OSError:
+            return
+        with self.lock:
+            if self.entries + len(entries) > self.max_entries:
+                self.truncated = True
+                return
+            self.entries += len(entries)
+
+        if depth and any(name == VENV_MARKER for name, _, _, _ in entries):
+            return
+        for name, path, is_dir, mtime in entries:
+            if is_dir:
+                if depth < self.max_depth and not is_ignored(name, self.ignore):
+                    subdirs.append((path, depth + 1))
+            elif is_notebook(name, self.ext):
+                files.append((path, datetime.datetime.fromtimestamp(mtime)))
+
 class DirectoryProject(object):
-    def __init__(self, dir, filename_ext):
+    def __init__(self, dir, filename_ext, recursive=False, max_depth=8,
+                 max_entries=50000, log=None):
         self.dir = dir
+        self.log = log
         self.filename_ext = filename_ext
         self.save_script = False
+        # see FSYNC_POLICIES
+        self.fsync = 'file'
+        # see nbcodecs. Existing compressed notebooks keep their codec
+        self.codec = 'json'
+        # NotebookCache of parsed notebooks, None to parse every read
+        self.nbcache = None
+        # outputs at least this long are saved to the blob store, None
+        # keeps them inline
+        self.blob_threshold = None
+        self.blobs = BlobStore(os.path.join(dir, BLOB_DIR))
+        # walk the whole tree under dir
+        self.recursive = recursive
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        # the last walk stopped at max_entries, the listing is incomplete
+        self.truncated = False
+        # path -> NBObject, see notebooks()
+        self._index = {}
+        self._sorted = None
+        # dir -> mtime of every dir scanned
+        self._dir_mtimes = {}
+        self._racy = True
+        # kept up to date by a dir watcher through apply_event
+        self.watched = False
+        # listing restored by seed, served until apply_listing
+        self.seeded = False
 
     @property  
     def path(self):
@@ -27,12 +272,137 @@ class DirectoryProject(object):
 
 
     def notebooks(self):
-        names = glob.glob(os.path.join(self.dir,
-                                       '*' + self.filename_ext))
-        files = [(name, getmtime(name)) for name in names]
-        nbs = [NBObject(backend=self, path=name, mtime=date) for name, date in files]
-        sorted_nbs = sorted(nbs, key=lambda x: x.mtime, reverse=True)
-        return sorted_nbs
+        """
+            Notebooks in the dir, newest first. The listing is kept and
+            only rescanned when the mtime of a scanned dir changes, and the same
+            NBObjects are handed back while nothing changed. Saves made
+            through the project update their notebook's mtime. A watched
+            or seeded project's listing is served as is.
+        """
+        if (self.watched or self.seeded) and self._sorted is not None:
+            return list(self._sorted)
+        if self._sorted is None or self._racy or self._changed():
+            self._scan()
+        return list(self._sorted)
+
+    def _changed(self):
+        for dir, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(dir).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def list_files(self):
+        """
+            Returns (files, dirs), see TreeWalk.walk
+        """
+        if self.recursive:
+            walk = TreeWalk(self.dir, self.filename_ext,
+                            max_depth=self.max_depth,
+                            max_entries=self.max_entries)
+            files, dirs = walk.walk()
+            if walk.truncated and not self.truncated and self.log:
+                self.log.warn("Stopped listing %s after %d entries, "
+                              "notebooks past them aren't listed",
+                              self.dir, self.max_entries)
+            self.truncated = walk.truncated
+            return files, dirs
+        try:
+            dirs = {self.dir: os.stat(self.dir).st_mtime}
+            files = list_files(self.dir, self.filename_ext)
+        except OSError:
+            return [], {}
+        return files, dirs
+
+    def _scan(self):
+        now = time.time()
+        files, dirs = self.list_files()
+        self.apply_listing(files, dirs, now)
+
+    def seed(self, files):
+        """
+            Serve the listing files, [(path, mtime)], without scanning,
+            until a scan is applied with apply_listing. Returns False if
+            the project was already listed.
+        """
+        if self._sorted is not None:
+            return False
+        index = {}
+        for path, mtime in files:
+            nbo = self._new_nbobject(path)
+            nbo.mtime = mtime
+            index[path] = nbo
+        self._index = index
+        self.seeded = True
+        self._sort()
+        return True
+
+    def apply_listing(self, files, dirs, started):
+        """
+            Replace the listing with the result of list_files, which
+            was called at time started
+        """
+        index = {}
+        for path, mtime in files:
+            nbo = self._index.get(path)
+            if nbo is None:
+                nbo = self._new_nbobject(path)
+            nbo.mtime = mtime
+            index[path] = nbo
+        self._index = index
+        self._dir_mtimes = dirs
+        self._racy = not dirs or max(dirs.values()) >= started - RACY_WINDOW
+        self.seeded = False
+        self._sort()
+
+    def _new_nbobject(self, path):
+        name = None
+        if self.recursive:
+            # notebooks in different subdirs can share a filename
+            name = os.path.relpath(path, self.dir)
+        return NBObject(backend=self, path=path, name=name)
+
+    def _sort(self):
+        self._sorted = sorted(self._index.values(), key=lambda x: x.mtime,
+                              reverse=True)
+
+    def _touch(self, path):
+        nbo = self._index.get(path)
+        if nbo is None or self._sorted is None:
+            return
+        nbo.mtime = getmtime(path)
+        self._sort()
+
+    def invalidate(self):
+        self._sorted = None
+
+    def apply_event(self, event, path):
+        """
+            Apply a dir watcher event for path to the index. Returns the
+            NBObject for path, or None when it's gone.
+        """
+        if self._sorted is None:
+            self.notebooks()
+            return self._index.get(path)
+        mtime = None
+        if event != 'delete':
+            try:
+                mtime = getmtime(path)
+            except OSError:
+                pass
+        if mtime is None:
+            self._index.pop(path, None)
+            self._sort()
+            return None
+        nbo = self._index.get(path)
+        if nbo is None:
+            nbo = self._new_nbobject(path)
+            self._index[path] = nbo
+        nbo.mtime = mtime
+        self._sort()
+        return nbo
 
     def __hash__(self):
         return hash(self.dir)
@@ -55,41 +425,93 @@ class DirectoryProject(object):
             raise web.HTTPError(404, u'Notebook does not exist')
         info = os.stat(path)
         last_modified = datetime.datetime.utcfromtimestamp(info.st_mtime)
-        with open(path,'r') as f:
-            s = f.read()
-            try:
-                # v1 and v2 and json in the .ipynb files.
-                nb = current.reads(s, u'json')
-            except:
-                raise web.HTTPError(500, u'Unreadable JSON notebook.')
+        if self.nbcache is None:
+            nb = self._read_notebook(path)
+        else:
+            # saves replace the file, so its inode changes too
+            key = (path, info.st_ino, info.st_mtime, info.st_size)
+            nb = self.nbcache.get(key, info.st_size,
+                                  lambda: self._read_notebook(path))
         # Always use the filename as the notebook name.
-        nb.metadata.name = os.path.splitext(os.path.basename(path))[0]
+        nb.metadata.name = notebook_name(path, self.filename_ext)
         return last_modified, nb
 
+    def notebook_pages(self, path):
+        """
+            Returns (last_modified, FilePages) for paged reads of path
+        """
+        if not os.path.isfile(path):
+            raise web.HTTPError(404, u'Notebook does not exist')
+        if detect(path).suffix:
+            # compressed, can't seek to cells
+            raise UnsupportedNotebook(path)
+        info = os.stat(path)
+        last_modified = datetime.datetime.utcfromtimestamp(info.st_mtime)
+        load = lambda: FilePages(path, resolve=self._rehydrate_cells)
+        if self.nbcache is None:
+            return last_modified, load()
+        key = ('pages', path, info.st_ino, info.st_mtime, info.st_size)
+        pages = self.nbcache.get(key, info.st_size, load)
+        return last_modified, pages
+
+    def _rehydrate_cells(self, cells):
+        try:
+            rehydrate_cells(cells, self.blobs)
+        except MissingBlob as e:
+            raise web.HTTPError(500, u'Missing output blob %s' % e)
+
+    def _read_notebook(self, path):
+        try:
+            # v1 and v2 and json in the .ipynb files, through any codec
+            nb = read_notebook(path)
+        except:
+            raise web.HTTPError(500, u'Unreadable JSON notebook.')
+        try:
+            rehydrate(nb, self.blobs)
+        except MissingBlob as e:
+            raise web.HTTPError(500, u'Missing output blob %s' % e)
+        return nb
+
     def notebook_exists(self, path):
         """Does a notebook exist?"""
         return os.path.isfile(path)
 
-    def new_notebook_object(self, path, public=False):
+    def new_notebook_object(self, path, public=False, nb=None):
+        if nb is not None:
+            self.save_notebook_object(nb, path)
         return NBObject(self, path)
 
     def save_notebook_object(self, nb, path):
+        """
+            Returns the timings of the save, see atomic_write
+        """
         try:
-            with open(path,'w') as f:
-                current.write(nb, f, u'json')
+            start = time.time()
+            stored = nb
+            if self.blob_threshold is not None:
+                stored = externalize(nb, self.blobs, self.blob_threshold)
+            serialize = time.time() - start
+            # the json is streamed through the codec, so encoding it
+            # counts as writing
+            codec = for_path(path, self.codec)
+            timings = atomic_write(path, lambda f: codec.dump(stored, f),
+                                   fsync=self.fsync)
         except Exception as e:
             raise web.HTTPError(400, u'Unexpected error while saving notebook: %s' % e)
+        timings['serialize'] = serialize
+        self._touch(path)
         # save .py script as well
         if self.save_script:
-            pypath = os.path.splitext(path)[0] + '.py'
+            pypath = os.path.join(os.path.dirname(path),
+                                  notebook_name(path, self.filename_ext) + '.py')
             try:
-                with io.open(pypath,'w', encoding='utf-8') as f:
-                    current.write(nb, f, u'py')
+                atomic_write(pypath, current.writes(nb, u'py'), fsync=self.fsync)
             except Exception as e:
                 raise web.HTTPError(400, u'Unexpected error while saving notebook as script: %s' % e)
+        return timings
 
     def autosave_notebook(self, nb, nbo, client_id):
-        self.save_notebook_object(nb, path=nbo.path)
+        return self.save_notebook_object(nb, path=nbo.path)
 
     def delete_notebook(self, path):
         if not os.path.isfile(path):
@@ -107,20 +529,31 @@ class DirectoryProject(object):
         # normalize to name without file ext
         basename = basename.replace(self.filename_ext, '')
         ndir = self.dir
+        suffix = get_codec(self.codec).suffix
         i = 0
         while True:
             if basename != 'Untitled' and i == 0:
                 name = basename
             else:
                 name = u'%s%i' % (basename,i)
-            name = name + self.filename_ext
-            path = os.path.join(ndir, name)
-            if not os.path.isfile(path):
+            if not self._name_taken(name):
                 break
             else:
                 i = i+1
+        name = name + self.filename_ext + suffix
+        path = os.path.join(ndir, name)
         return path, name
 
+    def _name_taken(self, name):
+        """
+            Is there a notebook called name, in any codec
+        """
+        filename = name + self.filename_ext
+        for other in [filename] + [filename + s for s in suffixes()]:
+            if os.path.isfile(os.path.join(self.dir, other)):
+                return True
+        return False
+
 class NBObject(object):
     def __init__(self, backend, path, name=None, mtime=None):
         self.backend = backend
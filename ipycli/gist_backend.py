@@ -1,55 +1,53 @@
 import os.path
-import itertools
+import base64
+import threading
+import traceback
+import urlparse
 from StringIO import StringIO
 
 import github
+from zmq.eventloop import ioloop
 from IPython.nbformat import current
 from ipycli.folder_backend import NBObject
+from ipycli.gist_queue import GistSaveQueue
+from ipycli.gist_cache import GistCache
+from ipycli.gist_mirror import GistMirror, MirrorGist, CircuitBreaker
+from ipycli.gist_transport import Transport, ResponseTooLarge
+from ipycli.gist_files import (needs_stream, check_complete, STREAM_THRESHOLD,
+                               MAX_SIZE)
+from ipycli.gist_prefetch import GistPrefetcher
+from ipycli.gist_journal import SaveJournal
+from ipycli.gist_scheduler import (RequestScheduler, RateLimited, SAVE,
+                                   BACKGROUND)
+from ipycli.tag_index import TagIndex, parse_tags
 from collections import OrderedDict
 
-def get_notebook_project_gists(gists, show_all=False):
-    """
-        Get gists as project-dir
-    """
-    nb_gists = []
-    for gist in gists:
-        desc = gist.description
-        if not desc:
-            continue
-        tags = get_gist_tags(desc)
-        if "#notebook-project" not in tags:
-            continue
-        active = "#inactive" not in tags
-        if active or show_all:
-            nb_gists.append(gist)
-
-    return nb_gists
-
-def get_notebook_single_gists(gists, show_all=False):
-    """
-        Get tagged gists
-    """
-    tagged = {}
-    for gist in gists:
-        desc = gist.description
-        if not desc:
-            continue
-
-        tags = get_gist_tags(desc)
-        if "#notebook" not in tags:
-            continue
+USER_AGENT = "ipycli"
+# seconds a request waits for a queued push of its notebook. Pushes held
+# back by the rate limit can wait for the quota to reset.
+SAVE_WAIT = 2
 
-        active = "#inactive" not in tags
-        if not active and not show_all:
-            continue
-
-        for tag in tags:
-            nb_list = tagged.setdefault(tag, [])
-            nb_list.append(gist)
+def is_notebook_gist(gist):
+    tags = parse_tags(gist.description)
+    return "#notebook" in tags or "#notebook-project" in tags
 
+def gist_placement(id, tags, show_all=True):
+    """
+        The projects a gist belongs to. ('project', id) for a
+        #notebook-project gist and ('tag', tag) for each tag of a
+        #notebook gist.
+    """
+    placement = set()
+    active = "#inactive" not in tags
+    if not active and not show_all:
+        return placement
+
+    if "#notebook-project" in tags:
+        placement.add(('project', id))
+    if "#notebook" in tags:
         # ignore system tag
-        del tagged['#notebook']
-    return tagged
+        placement.update(('tag', tag) for tag in tags if tag != "#notebook")
+    return placement
 
 def get_gist_tags(desc):
     tags = [tag for tag in desc.split(" ") if tag.startswith("#")]
@@ -66,10 +64,11 @@ def change_gist_name(gist, name):
     new_name = name + " " + " ".join(tags)
     return new_name
 
-def new_notebook_files(name='default.ipynb'):
+def new_notebook_files(name='default.ipynb', nb=None):
     # make a new file  ugh
-    metadata = current.new_metadata(name=name)
-    nb = current.new_notebook(metadata=metadata)
+    if nb is None:
+        metadata = current.new_metadata(name=name)
+        nb = current.new_notebook(metadata=metadata)
     content = current.writes(nb, format=u'json')
     file = github.InputFileContent(content)
     files = {name: file}
@@ -91,14 +90,20 @@ class GistProject(object):
     filename_ext = '.ipynb'
 
     def __init__(self, gist, hub):
-        words = [w for w in gist.description.split() if not w.startswith("#")]
-        self._name = " ".join(words)
         self.hub = hub
-        self.gists = {gist.id:gist}
         self.id = gist.id
         self.path = gist.html_url
+        self.set_gist(gist)
+
+    def set_gist(self, gist):
+        words = [w for w in gist.description.split() if not w.startswith("#")]
+        self._name = " ".join(words)
+        self.gists = {gist.id:gist}
         self.tags = get_gist_tags(gist.description)
 
+    def remove_gist(self, id):
+        self.gists.pop(id, None)
+
     def __repr__(self):
         cn = self.__class__.__name__
         return "{0}: {1}".format(cn, self.name)
@@ -113,21 +118,19 @@ class GistProject(object):
 
 
     def refresh_gist(self, id=None):
+        """
+            Fetch the gist again. Errors, GistUnavailable while offline,
+            are raised and the gist we have is kept.
+        """
         if id is None:
             id = self.gist.id
-
-        try:
-            gist = self.hub.get_gist(id)
-        except:
-            gist = None
-
-        self.gists[id] = gist
+        gist = self.hub.get_gist(id)
+        self.set_gist(gist)
         return gist
 
     def get_notebook(self, filename):
         gist = self.refresh_gist()
-        file = gist.files[filename]
-        return file.content
+        return self.hub.file_content(gist, filename)
 
     def get_notebooks(self):
         files = self.gist.files
@@ -144,14 +147,15 @@ class GistProject(object):
         return notebooks
 
     def get_notebook_object(self, path):
-        last_modified = self.gist.updated_at
+        # make sure we don't read back a version older than a queued save
+        self.hub.wait_for_push(path, journaled=True)
         filename = os.path.basename(path)
-        content = self.get_notebook(filename)
-        try:
+        gist = self.refresh_gist()
+        last_modified = gist.updated_at
+        nb = self.hub.journaled_notebook(path)
+        if nb is None:
             # v1 and v2 and json in the .ipynb files.
-            nb = current.reads(content, u'json')
-        except:
-            raise
+            nb = self.hub.read_notebook(gist, filename)
         # Always use the filename as the notebook name.
         nb.metadata.name = filename
         return last_modified, nb
@@ -161,8 +165,14 @@ class GistProject(object):
         filename = os.path.basename(path)
         return filename in self.gist.files
 
-    def new_notebook_object(self, path):
-        return GistObject(self, path)
+    def gist_for_path(self, path):
+        return self.gist
+
+    def new_notebook_object(self, path, public=False, nb=None):
+        nbo = GistObject(self, path)
+        if nb is not None:
+            self.save_notebook_object(nb, path)
+        return nbo
 
     def increment_filename(self, basename):
         """
@@ -182,17 +192,23 @@ class GistProject(object):
 
     def save_notebook_object(self, nb, path):
         filename = os.path.basename(path)
-        content = current.writes(nb, format=u'json')
-        file = github.InputFileContent(content)
-        files = {filename: file}
-        self.edit_gist(self.gist, files=files)
+        self.hub.save_notebook(path, self.gist, filename, nb)
+
+    def save_status(self, path):
+        return self.hub.save_status(path)
+
+    def flush_notebook(self, path):
+        self.hub.flush(path)
 
     def autosave_notebook(self, nb, nbo, client_id):
         path = nbo.path
-        self.save_notebook_object(nb, path=path)
+        filename = os.path.basename(path)
+        self.hub.save_notebook(path, self.gist, filename, nb, autosave=True)
         print 'autosave notebook {0}'.format(path)
 
     def delete_notebook(self, path):
+        self.hub.flush(path)
+        self.hub.wait_for_push(path)
         filename = os.path.basename(path)
         files = {filename: github.InputFileContent(None)}
         self.edit_gist(self.gist, files=files)
@@ -200,7 +216,7 @@ class GistProject(object):
     def edit_gist(self, gist, desc=None, files=None):
         if desc is None:
             desc = gist.description
-        gist.edit(desc, files)
+        self.hub.edit_gist(gist, desc, files)
 
     def __hash__(self):
         return hash(self.path)
@@ -223,12 +239,14 @@ class TaggedGistProject(GistProject):
         self.hub = hub
 
         self.gists = {}
+        # html_url -> gist id
+        self._url_index = {}
+        # also match by gisttag:#tag/filename -> gist id
+        self.path_mapping = {}
         for gist in gists:
-            self.gists[gist.id] = gist
+            self.set_gist(gist)
 
         self.path = "gisttag:/{0}".format(tag)
-        # also match by gisttag:#tag/filename
-        self.path_mapping = {}
         self.tag = tag
 
 
@@ -236,6 +254,20 @@ class TaggedGistProject(GistProject):
     def name(self):
         return self._name
 
+    def set_gist(self, gist):
+        old = self.gists.get(gist.id)
+        if old is not None and old.html_url != gist.html_url:
+            self._url_index.pop(old.html_url, None)
+        self.gists[gist.id] = gist
+        self._url_index[gist.html_url] = gist.id
+
+    def remove_gist(self, id):
+        gist = self.gists.pop(id, None)
+        if gist is not None:
+            self._url_index.pop(gist.html_url, None)
+        for path in [p for p, gid in self.path_mapping.items() if gid == id]:
+            del self.path_mapping[path]
+
     def _gist_name(self, gist):
         name =  get_gist_name(gist)
         if gist.public and gist.id not in name.split():
@@ -246,30 +278,42 @@ class TaggedGistProject(GistProject):
         gists = sorted(self.gists.values(), key=lambda x: x.updated_at)
         return [(gist.html_url, self._gist_name(gist), gist) for gist in gists]
 
-    def notebooks(self):
+    def notebooks(self, ids=None):
+        """
+            ids limits the notebooks to those gist ids
+        """
         notebooks = self.get_notebooks()
         notebooks = [GistObject(self, path, name, tags=get_gist_tags(gist.description), mtime=gist.updated_at) \
-                     for path, name, gist in notebooks]
+                     for path, name, gist in notebooks
+                     if ids is None or gist.id in ids]
         return notebooks
 
     def _get_gist_by_path(self, path):
-        for gist in self.gists.values():
-            if gist.html_url == path:
-                return gist
-        # this only exists on first creation. Afterwards path normalizes
-        # to the gist html_url
-        gist = self.path_mapping.setdefault(path, None)
-        return gist
+        id = self._url_index.get(path)
+        if id is None:
+            # this only exists on first creation. Afterwards path normalizes
+            # to the gist html_url
+            id = self.path_mapping.get(path)
+        return self.gists.get(id)
+
+    def gist_for_path(self, path):
+        return self._get_gist_by_path(path)
 
     def get_notebook_object(self, path):
+        self.hub.wait_for_push(path, journaled=True)
         gist = self._get_gist_by_path(path)
+        gist = self.refresh_gist(gist.id)
+        file = self.get_gist_file(gist)
+        if file is None:
+            # gist was seeded without a notebook file. edit updates the
+            # gist in place so the new file shows up right away
+            self.edit_gist(gist, files=new_notebook_files())
+            file = self.get_gist_file(gist)
         last_modified = gist.updated_at
-        content = self.get_notebook(gist)
-        try:
+        nb = self.hub.journaled_notebook(path)
+        if nb is None:
             # v1 and v2 and json in the .ipynb files.
-            nb = current.reads(content, u'json')
-        except:
-            raise
+            nb = self.hub.read_notebook(gist, file.filename)
         # Always use the filename as the notebook name.
         name = self._gist_name(gist)
         nb.metadata.name = name
@@ -278,14 +322,11 @@ class TaggedGistProject(GistProject):
     def get_notebook(self, gist):
         gist = self.refresh_gist(gist.id)
         file = self.get_gist_file(gist)
-        if file:
-            return file.content
-
-        # make a new file  ugh
-        files = new_notebook_files()
-        self.edit_gist(gist, files=files)
-        # hold to your butts, recursion!
-        return self.get_notebook(gist)
+        if file is None:
+            # make a new file  ugh. edit updates the gist in place
+            self.edit_gist(gist, files=new_notebook_files())
+            file = self.get_gist_file(gist)
+        return self.hub.file_content(gist, file.filename)
 
     def get_gist_file(self, gist):
         """
@@ -297,58 +338,564 @@ class TaggedGistProject(GistProject):
 
     def autosave_notebook(self, nb, nbo, client_id):
         path = nbo.path
-        self.save_notebook_object(nb, path=path)
+        self._save_notebook(nb, path, autosave=True)
         print 'autosave notebook {0}'.format(path)
 
-    def new_notebook_object(self, path, public=False):
-        # we create gist here because we are using gist.html_url as path
-        # this creates a redundancy with save_notebook_object
+    def new_notebook_object(self, path, public=False, nb=None):
+        # we create gist here because we are using gist.html_url as path.
+        # when given nb the gist is created with its final content and
+        # name, so there is nothing left to save
         _, tag, filename = path.split('/')
-        files = new_notebook_files(filename)
-        desc = "IPython Notebook #notebook {0}".format(tag)
-        gist = self.hub.get_user().create_gist(public, files, desc)
-        self.gists[gist.id] = gist
-        self.path_mapping[path] = gist
+        files = new_notebook_files(filename, nb=nb)
+        name = "IPython Notebook"
+        if nb is not None:
+            name = nb.metadata.name
+        desc = "{0} #notebook {1}".format(name, tag)
+        gist = self.hub.create_gist(public, files, desc)
+        self.set_gist(gist)
+        self.path_mapping[path] = gist.id
 
         return GistObject(self, gist.html_url, filename)
 
     def save_notebook_object(self, nb, path):
+        self._save_notebook(nb, path)
+
+    def _save_notebook(self, nb, path, autosave=False):
         gist = self._get_gist_by_path(path)
         gfile = self.get_gist_file(gist)
-        content = current.writes(nb, format=u'json')
-        file = github.InputFileContent(content)
-        files = {gfile.filename: file}
         # name and desc are synched for gist-notebooks
-        desc = change_gist_name(gist, nb.metadata.name)
-        self.edit_gist(gist, files=files, desc=desc)
+        self.hub.save_notebook(path, gist, gfile.filename, nb,
+                               name=nb.metadata.name, autosave=autosave)
 
     def rename_notebook(self, nb, old_path):
         # no need to delete, just change desc
         self.save_notebook_object(nb, old_path)
 
     def delete_notebook(self, path):
+        self.hub.flush(path)
+        self.hub.wait_for_push(path)
         gist = self._get_gist_by_path(path)
         desc = gist.description + " #inactive"
         self.edit_gist(gist, desc=desc, files={})
 
 class GistHub(object):
-    def __init__(self, hub):
+    """
+        Entry point for every GitHub call made by the gist projects.
+    """
+    def __init__(self, hub, save_workers=2, log=None, auth=None,
+                 base_url=github.MainClass.DEFAULT_BASE_URL, mirror_dir=None,
+                 transport=None, stream_threshold=STREAM_THRESHOLD,
+                 max_file_size=MAX_SIZE, prefetch=0, prefetch_workers=4,
+                 journal=None, push_interval=300, nbcache=None):
         self.hub = hub
         self.user = hub.get_user()
+        self.log = log
+        self.base_url = base_url
+        self.auth_header = None
+        if auth is not None:
+            self.auth_header = "Basic " + base64.b64encode("%s:%s" % auth)
+        if transport is None:
+            transport = Transport()
+        self.transport = transport
+        self.stream_threshold = stream_threshold
+        self.max_file_size = max_file_size
+        self.prefetcher = None
+        if prefetch:
+            self.prefetcher = GistPrefetcher(self.warm_gist, depth=prefetch,
+                                             workers=prefetch_workers, log=log)
+        self.scheduler = RequestScheduler(log=log)
+        transport.observers.append(self.scheduler.update_quota)
+        self.save_queue = None
+        if save_workers:
+            self.save_queue = GistSaveQueue(workers=save_workers, log=log)
+        self.cache = GistCache(self._fetch_gist, self._make_gist,
+                               nbcache=nbcache)
+        self.breaker = CircuitBreaker()
+        self.mirror = None
+        if mirror_dir:
+            self.mirror = GistMirror(mirror_dir)
+        self._revalidating = set()
+        self._lock = threading.Lock()
+
+        # every gist we have listed, id -> gist
+        self.gists = {}
+        self.tag_index = TagIndex()
+        self.show_all = True
+        # newest updated_at seen in a listing
+        self.watermark = None
+        # the gist projects, patched in place as gists change
+        self.projects = []
+        # project key (see gist_placement) -> project
+        self._projects = {}
+        # gist id -> project keys
+        self._placement = {}
+        # project path -> project
+        self._by_path = {}
+
+        self.journal = None
+        self.push_interval = push_interval
+        if journal:
+            self.journal = SaveJournal(journal)
+            self._stop = threading.Event()
+            t = threading.Thread(target=self._flush_loop, name='gist-journal')
+            t.daemon = True
+            t.start()
+            # saves that didn't make it to github before the last shutdown
+            for path in self.journal.pending():
+                self.flush(path)
+
+    def get_gist(self, id):
+        """
+            Get a gist. A mirrored copy is returned right away and
+            revalidated in the background, otherwise we go to github.
+        """
+        if self.mirror is not None:
+            gist = self.mirror.get(id)
+            if gist is not None and gist.has_content():
+                self._revalidate(id)
+                return gist
+        return self._get_gist(id)
+
+    def _get_gist(self, id):
+        """
+            Get a gist from github, revalidating our cached copy with its
+            ETag. Fresh gists are written to the mirror.
+        """
+        gist = self._call(self.cache.get_gist, id)
+        if self.mirror is not None:
+            self.mirror.store(gist)
+        return gist
+
+    def _revalidate(self, id):
+        if not self.breaker.allow():
+            return
+        if not self.scheduler.can_run(BACKGROUND):
+            # keep the quota for interactive reads, the mirror will do
+            return
+        with self._lock:
+            if id in self._revalidating:
+                return
+            self._revalidating.add(id)
+        t = threading.Thread(target=self._do_revalidate, args=(id,))
+        t.daemon = True
+        t.start()
+
+    def _do_revalidate(self, id):
+        try:
+            # the mirror updates the MirrorGist we handed out in place
+            with self.scheduler.priority(BACKGROUND):
+                self._get_gist(id)
+        except Exception as e:
+            if self.log:
+                self.log.warn("Could not revalidate gist %s: %s", id, e)
+        finally:
+            with self._lock:
+                self._revalidating.discard(id)
+
+    def _call(self, func, *args):
+        """
+            Call github through the circuit breaker
+        """
+        if not self.breaker.allow():
+            raise GistUnavailable("github is unavailable, retrying in %ss"
+                                  % self.breaker.reset_timeout)
+        try:
+            ret = self.scheduler.run(func, *args)
+        except RateLimited as e:
+            raise GistUnavailable(str(e))
+        except github.GithubException as e:
+            # 4xx is a problem with our request, not with github
+            if e.status >= 500:
+                self.breaker.failure()
+            raise
+        except ResponseTooLarge:
+            raise
+        except Exception:
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        return ret
+
+    def read_notebook(self, gist, filename):
+        """
+            Parsed notebook for a file in gist. Parsing is cached per gist
+            version for gists that came through get_gist.
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.record_open(gist.id)
+        return self._read_notebook(gist, filename)
+
+    def _read_notebook(self, gist, filename):
+        load = lambda: current.reads(self.file_content(gist, filename), u'json')
+        return self.cache.get_notebook(gist, filename, load)
+
+    def prefetch(self, gists):
+        """
+            Warm the cache for the most recently updated of gists
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.prefetch(gists)
+
+    def warm_gist(self, id):
+        """
+            Fetch a gist and parse its notebooks into the cache
+        """
+        with self.scheduler.priority(BACKGROUND):
+            gist = self._get_gist(id)
+            for filename in gist.files:
+                if filename.endswith('.ipynb'):
+                    self._read_notebook(gist, filename)
+        return gist
+
+    def file_content(self, gist, filename):
+        """
+            Content of a gist file. Big and truncated files are streamed
+            from their raw_url.
+        """
+        file = gist.files[filename]
+        if not needs_stream(file, self.stream_threshold):
+            return file.content
+        data = self._call(self.fetch_raw, file.raw_url)
+        check_complete(file, data)
+        content = data.decode('utf-8')
+        if self.mirror is not None:
+            self.mirror.store_content(gist, filename, content)
+        return content
+
+    def fetch_raw(self, url, redirects=3):
+        """
+            GET a raw file url into a buffer of at most max_file_size
+        """
+        o = urlparse.urlparse(url)
+        pool = self.transport.get_pool(o.scheme, o.hostname, o.port)
+        path = o.path
+        if o.query:
+            path += '?' + o.query
+        headers = {'User-Agent': USER_AGENT}
+        status, resp_headers, body = pool.request('GET', path, None, headers,
+                                                  max_size=self.max_file_size)
+        resp_headers = dict(resp_headers)
+        if status in (301, 302, 307) and redirects:
+            return self.fetch_raw(resp_headers['location'], redirects - 1)
+        if status >= 400:
+            raise github.GithubException(status, body)
+        return body
+
+    def edit_gist(self, gist, desc, files):
+        old_desc = gist.description
+        if isinstance(gist, MirrorGist):
+            # edit only needs the api url, so skip fetching the gist
+            real = self._make_gist({'id': gist.id, 'url': gist.url})
+            self._call(real.edit, desc, files)
+            gist = real
+        else:
+            self._call(gist.edit, desc, files)
+        self.cache.invalidate(gist.id)
+        if self.mirror is not None:
+            self.mirror.store(gist)
+        if gist.description != old_desc:
+            # renames and deletes move the gist between tags
+            self._place_later(gist)
+
+    def request(self, verb, url, headers=None):
+        """
+            Raw api request for what PyGithub can't do, like conditional
+            requests. Returns (status, headers, body).
+        """
+        o = urlparse.urlparse(self.base_url)
+        headers = dict(headers or {})
+        headers['User-Agent'] = USER_AGENT
+        if self.auth_header:
+            headers['Authorization'] = self.auth_header
+        pool = self.transport.get_pool(o.scheme, o.hostname, o.port)
+        status, resp_headers, body = pool.request(verb, o.path + url, None, headers)
+        return status, dict(resp_headers), body
+
+    def _fetch_gist(self, id, headers):
+        return self.request('GET', '/gists/' + id, headers)
+
+    def _make_gist(self, data):
+        return self.hub.create_from_raw_data(github.Gist.Gist, data)
+
+    def create_gist(self, public, files, desc):
+        gist = self._call(self.user.create_gist, public, files, desc)
+        if self.mirror is not None:
+            self.mirror.store(gist)
+        self._place_later(gist)
+        return gist
+
+    def push(self, path, func, *args):
+        """
+            Push a notebook save to github. With a save queue this
+            returns immediately and the save happens in the background.
+        """
+        if self.save_queue is None:
+            return self._run_at(SAVE, func, *args)
+        self.save_queue.enqueue(path, self._run_at, SAVE, func, *args)
+
+    def save_notebook(self, path, gist, filename, nb, name=None,
+                      autosave=False):
+        """
+            Save a notebook file to a gist. With a journal the save is
+            journaled first, and autosaves are left there to be pushed
+            every push_interval. name also renames the gist.
+        """
+        content = current.writes(nb, format=u'json')
+        if self.journal is None:
+            return self.push(path, self.push_file, gist, filename, content, name)
+
+        self.journal.append(path, {'gist': gist.id, 'filename': filename,
+                                   'name': name, 'content': content})
+        if not autosave:
+            self.flush(path)
 
-    def get_gist_projects(self, show_all=True):
-        gists = self.user.get_gists()
+    def push_file(self, gist, filename, content, name=None):
+        desc = gist.description
+        if name is not None:
+            desc = change_gist_name(gist, name)
+        files = {filename: github.InputFileContent(content)}
+        self.edit_gist(gist, desc, files)
+
+    def flush(self, path=None):
+        """
+            Push the journaled save for path, or for every notebook
+        """
+        if self.journal is None:
+            return
+        if path is None:
+            for path in self.journal.pending():
+                self.flush(path)
+            return
+        if self.journal.get(path) is None:
+            return
+        self.push(path, self._push_journaled, path)
+
+    def _push_journaled(self, path):
+        # always the latest save, whenever the push was queued
+        entry = self.journal.get(path)
+        if entry is None:
+            return
+        seq, payload = entry
+        gist = self.gists.get(payload['gist'])
+        if gist is None:
+            gist = self.get_gist(payload['gist'])
+        self.push_file(gist, payload['filename'], payload['content'],
+                       payload['name'])
+        self.journal.mark_pushed(path, seq)
+
+    def _flush_loop(self):
+        while not self._stop.wait(min(self.push_interval, 5)):
+            try:
+                for path in self.journal.due(self.push_interval):
+                    self.flush(path)
+            except Exception:
+                if self.log:
+                    self.log.error("journal flush failed\n%s",
+                                   traceback.format_exc())
+
+    def journaled_notebook(self, path):
+        """
+            The notebook journaled for path and not pushed yet, or None
+        """
+        if self.journal is None:
+            return None
+        entry = self.journal.get(path)
+        if entry is None:
+            return None
+        return current.reads(entry[1]['content'], u'json')
+
+    def _run_at(self, priority, func, *args):
+        with self.scheduler.priority(priority):
+            return func(*args)
+
+    def wait_for_save(self, path=None, timeout=None):
+        if self.save_queue is None:
+            return True
+        return self.save_queue.wait(path, timeout=timeout)
+
+    def wait_for_push(self, path, journaled=False):
+        """
+            Wait up to SAVE_WAIT for a queued push of path, for requests
+            on the IOLoop. If it is still queued, reads (journaled) go
+            ahead when the journal has the latest content, anything else
+            raises GistUnavailable.
+        """
+        if self.wait_for_save(path, timeout=SAVE_WAIT):
+            return
+        if journaled and self.journaled_notebook(path) is not None:
+            return
+        raise GistUnavailable("a save of %s is still waiting to be pushed" % path)
+
+    def api_stats(self):
+        stats = {'scheduler': self.scheduler.stats(),
+                 'transport': self.transport.stats()}
+        if self.prefetcher is not None:
+            stats['prefetch'] = self.prefetcher.stats()
+        return stats
+
+    def save_status(self, path):
+        if self.save_queue is None:
+            return None
+        return self.save_queue.get_status(path)
+
+    def all_save_status(self):
+        if self.save_queue is None:
+            return {}
+        return self.save_queue.all_status()
+
+    def list_gists(self, since=None, priority=BACKGROUND):
+        """
+            List the user's gists, only those updated at or after since
+            when given. Lists from the mirror while github is down or
+            the rate limit is too low for a refresh.
+        """
+        def _list():
+            if since is None:
+                return list(self.user.get_gists())
+            params = {'since': since.strftime("%Y-%m-%dT%H:%M:%SZ")}
+            # AuthenticatedUser.get_gists doesn't take since
+            gists = github.PaginatedList.PaginatedList(
+                github.Gist.Gist, self.user._requester, "/gists", params)
+            return list(gists)
+
+        try:
+            gists = self._run_at(priority, self._call, _list)
+        except Exception:
+            if self.mirror is None:
+                raise
+            if self.log:
+                self.log.warn("Listing gists from the local mirror")
+            return self.mirror.gists()
+
+        for gist in gists:
+            if self.watermark is None or gist.updated_at > self.watermark:
+                self.watermark = gist.updated_at
+
+        if self.mirror is not None:
+            nb_gists = [gist for gist in gists if is_notebook_gist(gist)]
+            if since is None:
+                self.mirror.store_listing(nb_gists)
+            else:
+                for gist in nb_gists:
+                    self.mirror.store(gist)
+        return gists
+
+    def get_gist_projects(self, show_all=True, cached=False, full=False):
+        """
+            Gist projects. After the first listing only gists updated
+            since the watermark are fetched and the existing projects are
+            patched in place, so the same list is returned every time.
 
-        project_gists = get_notebook_project_gists(gists, show_all=show_all)
-        projects = [GistProject(gist, self.hub) for gist in project_gists]
+            cached=True builds the projects from the mirror only.
+            full=True relists everything, which is the only way to notice
+            gists deleted on github.
+        """
+        self.show_all = show_all
+        if cached:
+            if self.mirror is None:
+                return []
+            return self.apply_gists(self.mirror.gists(), show_all=show_all)
 
-        single_gists = get_notebook_single_gists(gists, show_all=show_all)
-        singles = [TaggedGistProject(tag, tgists, self.hub) for tag, tgists
-                   in single_gists.items()]
+        since = None if full else self.watermark
+        gists = self.list_gists(since=since)
+        return self.apply_gists(gists, show_all=show_all, full=since is None)
 
-        gprojects = list(itertools.chain(projects, singles))
-        return gprojects
+    def apply_gists(self, gists, show_all=True, full=False):
+        """
+            Patch the projects with a gist listing. With full=True gists
+            missing from the listing are dropped.
+        """
+        seen = set()
+        for gist in gists:
+            seen.add(gist.id)
+            self._place_gist(gist, show_all)
+        if full:
+            for id in set(self.gists) - seen:
+                self._remove_gist(id)
+        return self.projects
+
+    def project_by_path(self, path):
+        return self._by_path.get(path)
+
+    def tag_project(self, tag):
+        """
+            The TaggedGistProject for tag, or None
+        """
+        return self._projects.get(('tag', tag))
 
-def gist_hub(user, password):
-    g = github.Github(user, password, user_agent="ipycli")
-    return GistHub(g)
+    def tagged_gist_ids(self, *tags):
+        """
+            Ids of the notebook gists that have every one of tags
+        """
+        return self.tag_index.query("#notebook", *tags)
+
+    def _place_gist(self, gist, show_all):
+        old = self._placement.get(gist.id, set())
+        _, tags = self.tag_index.update(gist.id, gist.description)
+        new = gist_placement(gist.id, tags, show_all)
+        known = self.gists.get(gist.id)
+        if old == new and known is not None \
+                and known.updated_at == gist.updated_at:
+            # keep the gist we have, it might be a fully fetched one
+            return
+
+        self.gists[gist.id] = gist
+        self._placement[gist.id] = new
+        for key in old - new:
+            self._drop_from_project(key, gist.id)
+        for key in new:
+            project = self._projects.get(key)
+            if project is None:
+                self._new_project(key, gist)
+            else:
+                project.set_gist(gist)
+
+    def _place_later(self, gist):
+        """
+            Place gist on the IOLoop. Edits finish on save-queue threads
+            while the projects are read on the IOLoop, so they are only
+            patched there.
+        """
+        loop = ioloop.IOLoop.instance()
+        loop.add_callback(lambda: self._place_gist(gist, self.show_all))
+
+    def _remove_gist(self, id):
+        for key in self._placement.pop(id, set()):
+            self._drop_from_project(key, id)
+        self.tag_index.remove(id)
+        self.gists.pop(id, None)
+
+    def _new_project(self, key, gist):
+        kind, name = key
+        if kind == 'project':
+            project = GistProject(gist, self)
+        else:
+            project = TaggedGistProject(name, [gist], self)
+        self._projects[key] = project
+        self._by_path[project.path] = project
+        self.projects.append(project)
+        return project
+
+    def _drop_from_project(self, key, id):
+        project = self._projects[key]
+        project.remove_gist(id)
+        if not project.gists:
+            del self._projects[key]
+            self._by_path.pop(project.path, None)
+            self.projects.remove(project)
+
+class GistUnavailable(Exception):
+    pass
+
+def gist_hub(user, password, save_workers=2, log=None, mirror_dir=None,
+             pool_size=4, prefetch=0, journal=None, push_interval=300,
+             nbcache=None):
+    # keep-alive connections shared by PyGithub and our raw requests
+    transport = Transport(size=pool_size)
+    transport.install()
+    # fewer pages when listing
+    g = github.Github(user, password, user_agent=USER_AGENT, per_page=100)
+    return GistHub(g, save_workers=save_workers, log=log, auth=(user, password),
+                   mirror_dir=mirror_dir, transport=transport, prefetch=prefetch,
+                   journal=journal, push_interval=push_interval,
+                   nbcache=nbcache)
@@ -0,0 +1,97 @@
+"""
+    Conditional-request cache for gist reads.
+
+    Every notebook open used to download and parse the whole gist. GitHub
+    hands out an ETag with each gist, so we keep the last gist we saw and
+    revalidate it with If-None-Match. A 304 costs a cheap round trip and
+    we serve the cached gist and its already parsed notebooks, which live
+    in the NotebookCache shared with the directory projects.
+"""
+import json
+import threading
+
+import github
+
+from .nbcache import NotebookCache
+
+class GistEntry(object):
+    def __init__(self, etag, gist):
+        self.etag = etag
+        self.gist = gist
+        self.updated_at = gist.updated_at
+
+class GistCache(object):
+    def __init__(self, fetch, make_gist, nbcache=None):
+        """
+            fetch(id, headers) -> (status, headers, body) for GET /gists/:id
+            make_gist(data) -> github.Gist.Gist
+        """
+        self.fetch = fetch
+        self.make_gist = make_gist
+        if nbcache is None:
+            nbcache = NotebookCache()
+        self.nbcache = nbcache
+        self.entries = {}
+        self.lock = threading.Lock()
+        # validated by a 304
+        self.hits = 0
+        # full download
+        self.misses = 0
+
+    def get_gist(self, id):
+        with self.lock:
+            entry = self.entries.get(id)
+
+        headers = {}
+        if entry is not None and entry.etag:
+            headers['If-None-Match'] = entry.etag
+
+        status, resp_headers, body = self.fetch(id, headers)
+
+        if status == 304 and entry is not None:
+            with self.lock:
+                self.hits += 1
+            return entry.gist
+
+        data = None
+        if body:
+            data = json.loads(body)
+        if status >= 400:
+            raise github.GithubException(status, data)
+
+        gist = self.make_gist(data)
+        etag = _get_header(resp_headers, 'etag')
+        with self.lock:
+            self.misses += 1
+            self.entries[id] = GistEntry(etag, gist)
+        return gist
+
+    def get_notebook(self, gist, filename, load):
+        """
+            Return the parsed notebook for gist/filename, calling load()
+            to read and parse it at most once per gist version. See
+            NotebookCache.get for what callers may change.
+        """
+        with self.lock:
+            entry = self.entries.get(gist.id)
+        if entry is None or entry.updated_at != gist.updated_at:
+            # not a gist version we fetched, nothing to cache against
+            return load()
+
+        key = ('gist', gist.id, gist.updated_at, filename)
+        file = gist.files.get(filename)
+        size = getattr(file, 'size', None)
+        return self.nbcache.get(key, size, load)
+
+    def invalidate(self, id):
+        with self.lock:
+            self.entries.pop(id, None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self.entries)}
+
+def _get_header(headers, name):
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
@@ -0,0 +1,48 @@
+"""
+    Reading gist file contents.
+
+    The gist json carries file contents inline, but GitHub truncates them
+    past a size limit and a multi-file gist drags every file along. Files
+    over a size threshold, or whose inline content was truncated, are
+    streamed from their raw_url into a bounded buffer instead.
+"""
+
+# files at least this big are read from raw_url
+STREAM_THRESHOLD = 512 * 1024
+# refuse to read files bigger than this
+MAX_SIZE = 100 * 1024 * 1024
+
+class IncompleteFile(Exception):
+    pass
+
+def is_truncated(file):
+    """
+        True when the inline content of a gist file is cut short
+    """
+    truncated = getattr(file, 'truncated', None)
+    if truncated is None:
+        raw = getattr(file, '_rawData', None) or {}
+        truncated = raw.get('truncated', False)
+    if truncated:
+        return True
+    content = file.content
+    if content is None or file.size is None:
+        return False
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    return len(content) < file.size
+
+def needs_stream(file, threshold=STREAM_THRESHOLD):
+    if file.raw_url is None:
+        return False
+    if file.content is None or is_truncated(file):
+        return True
+    return file.size is not None and file.size >= threshold
+
+def check_complete(file, data):
+    """
+        Make sure data streamed from raw_url is the whole file
+    """
+    if file.size is not None and len(data) != file.size:
+        raise IncompleteFile("%s: got %d of %d bytes" % (file.filename,
+                                                         len(data), file.size))
@@ -0,0 +1,137 @@
+"""
+    Local write-ahead journal for gist notebook saves.
+
+    Every save to github makes a new gist revision, so autosaves land in
+    an append-only journal file first, fsynced so a crash doesn't lose
+    them. Only the latest unpushed save per notebook is kept. GistHub
+    pushes journaled saves at a lower cadence, on explicit saves and on
+    shutdown. Saves still in the journal when the server starts are
+    replayed.
+
+    Each line of the journal is a json record, either a save
+
+        {"key": path, "seq": n, "time": t, "payload": {...}}
+
+    or a marker that the save with seq n was pushed
+
+        {"key": path, "pushed": n}
+"""
+import json
+import os
+import threading
+import time
+
+class SaveJournal(object):
+    def __init__(self, path, compact_every=100):
+        self.path = path
+        self.compact_every = compact_every
+        self.lock = threading.Lock()
+        self.seq = 0
+        # key -> (seq, payload, since). since is when the oldest save not
+        # yet pushed was journaled
+        self.entries = {}
+        # records in the journal file
+        self.records = 0
+        self._file = None
+        self._replay()
+
+    def _replay(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # torn write at the tail from a crash
+                        break
+                    self._apply(record)
+        # rewrite without pushed saves and any torn tail
+        self._compact()
+
+    def _apply(self, record):
+        key = record['key']
+        if 'pushed' in record:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= record['pushed']:
+                del self.entries[key]
+            return
+        seq = record['seq']
+        self.seq = max(self.seq, seq)
+        since = record['time']
+        entry = self.entries.get(key)
+        if entry is not None:
+            since = entry[2]
+        self.entries[key] = (seq, record['payload'], since)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.records += 1
+
+    def _compact(self):
+        if self._file is not None:
+            self._file.close()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for key, (seq, payload, since) in self.entries.items():
+                record = {'key': key, 'seq': seq, 'time': since,
+                          'payload': payload}
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.path)
+        self.records = len(self.entries)
+        self._file = open(self.path, 'a')
+
+    def append(self, key, payload):
+        """
+            Journal a save. Returns its seq.
+        """
+        with self.lock:
+            self.seq += 1
+            record = {'key': key, 'seq': self.seq, 'time': time.time(),
+                      'payload': payload}
+            self._write(record)
+            self._apply(record)
+            return self.seq
+
+    def mark_pushed(self, key, seq):
+        """
+            The save with seq, and any before it, reached github
+        """
+        with self.lock:
+            self._write({'key': key, 'pushed': seq})
+            self._apply({'key': key, 'pushed': seq})
+            if (self.records >= self.compact_every
+                    and self.records > 2 * len(self.entries)):
+                self._compact()
+
+    def get(self, key):
+        """
+            (seq, payload) of the latest unpushed save for key, or None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return entry[0], entry[1]
+
+    def pending(self):
+        with self.lock:
+            return self.entries.keys()
+
+    def due(self, age):
+        """
+            Keys with saves waiting to be pushed for at least age seconds
+        """
+        cutoff = time.time() - age
+        with self.lock:
+            return [key for key, entry in self.entries.items()
+                    if entry[2] <= cutoff]
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,237 @@
+"""
+    Local on-disk mirror of notebook gists.
+
+    Each mirrored gist is a json file holding what the gist projects need:
+    description, urls, updated_at and the file contents. GistHub serves
+    gists from the mirror first and revalidates against github in the
+    background, and falls back to the mirror completely while github is
+    failing.
+"""
+import datetime
+import json
+import os
+import threading
+import time
+
+from ipycli.gist_files import is_truncated
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+class MirrorFile(object):
+    def __init__(self, filename, content=None, raw_url=None, size=None):
+        self.filename = filename
+        self.content = content
+        self.raw_url = raw_url
+        self.size = size
+
+class MirrorGist(object):
+    """
+        Stand-in for github.Gist.Gist built from the mirror. Only carries
+        the attributes the gist projects read.
+    """
+    def __init__(self, data):
+        self.update_data(data)
+
+    def update_data(self, data):
+        self.id = data['id']
+        self.url = data['url']
+        self.html_url = data['html_url']
+        self.description = data['description']
+        self.public = data['public']
+        self.updated_at = None
+        if data['updated_at']:
+            self.updated_at = datetime.datetime.strptime(data['updated_at'],
+                                                         DATE_FORMAT)
+        files = {}
+        for name, f in data['files'].items():
+            files[name] = MirrorFile(name, f['content'], f.get('raw_url'),
+                                     f.get('size'))
+        self.files = files
+
+    def has_content(self):
+        return all(f.content is not None for f in self.files.values())
+
+    def __repr__(self):
+        return 'MirrorGist(id="{0}")'.format(self.id)
+
+def gist_data(gist, old=None):
+    """
+        Mirror record for a github gist. Contents missing from gist (like
+        in the gist listing, or truncated by github) are kept from old if
+        the gist didn't change.
+    """
+    updated_at = None
+    if gist.updated_at:
+        updated_at = gist.updated_at.strftime(DATE_FORMAT)
+    unchanged = old is not None and old['updated_at'] == updated_at
+
+    files = {}
+    for name, f in gist.files.items():
+        content = f.content
+        if content is not None and is_truncated(f):
+            content = None
+        if content is None and unchanged and name in old['files']:
+            content = old['files'][name]['content']
+        files[name] = {'content': content, 'raw_url': f.raw_url,
+                       'size': f.size}
+
+    return {'id': gist.id, 'url': gist.url, 'html_url': gist.html_url,
+            'description': gist.description, 'public': gist.public,
+            'updated_at': updated_at, 'files': files}
+
+class GistMirror(object):
+    def __init__(self, dir):
+        self.dir = dir
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+        self.lock = threading.Lock()
+        # id -> data dict, loaded lazily
+        self._data = None
+        # id -> live MirrorGist handed out to the projects
+        self._gists = {}
+
+    def _load(self):
+        if self._data is not None:
+            return
+        data = {}
+        for name in os.listdir(self.dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.dir, name)
+            try:
+                with open(path) as f:
+                    record = json.load(f)
+            except (IOError, ValueError):
+                # a broken mirror file only costs us a refetch
+                continue
+            data[record['id']] = record
+        self._data = data
+
+    def _path(self, id):
+        return os.path.join(self.dir, id + '.json')
+
+    def _write(self, record):
+        path = self._path(record['id'])
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(record, f)
+        os.rename(tmp, path)
+
+    def get(self, id):
+        with self.lock:
+            self._load()
+            record = self._data.get(id)
+            if record is None:
+                return None
+            gist = self._gists.get(id)
+            if gist is None:
+                gist = MirrorGist(record)
+                self._gists[id] = gist
+            return gist
+
+    def gists(self):
+        with self.lock:
+            self._load()
+            ids = self._data.keys()
+        return [self.get(id) for id in ids]
+
+    def store(self, gist):
+        """
+            Mirror a github gist. MirrorGists already handed out are
+            updated in place.
+        """
+        with self.lock:
+            self._load()
+            record = gist_data(gist, self._data.get(gist.id))
+            if record == self._data.get(gist.id):
+                return
+            self._data[gist.id] = record
+            self._write(record)
+            live = self._gists.get(gist.id)
+            if live is not None:
+                live.update_data(record)
+
+    def store_content(self, gist, filename, content):
+        """
+            Mirror the full content of a file fetched on its own
+        """
+        updated_at = None
+        if gist.updated_at:
+            updated_at = gist.updated_at.strftime(DATE_FORMAT)
+        with self.lock:
+            self._load()
+            record = self._data.get(gist.id)
+            if record is None or record['updated_at'] != updated_at:
+                return
+            file = record['files'].get(filename)
+            if file is None or file['content'] == content:
+                return
+            file['content'] = content
+            self._write(record)
+            live = self._gists.get(gist.id)
+            if live is not None:
+                live.update_data(record)
+
+    def store_listing(self, gists):
+        """
+            Mirror a full gist listing. Gists missing from the listing
+            are dropped from the mirror.
+        """
+        ids = set()
+        for gist in gists:
+            ids.add(gist.id)
+            self.store(gist)
+        with self.lock:
+            self._load()
+            for id in set(self._data) - ids:
+                self._remove(id)
+
+    def remove(self, id):
+        with self.lock:
+            self._load()
+            self._remove(id)
+
+    def _remove(self, id):
+        self._data.pop(id, None)
+        self._gists.pop(id, None)
+        try:
+            os.unlink(self._path(id))
+        except OSError:
+            pass
+
+class CircuitBreaker(object):
+    """
+        Stop calling github after repeated failures. After reset_timeout
+        seconds one call is let through to probe whether it is back.
+    """
+    def __init__(self, max_failures=3, reset_timeout=60):
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_timeout:
+                # half open. let this call probe, hold the rest back
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                self.opened_at = time.time()
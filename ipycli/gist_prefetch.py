@@ -0,0 +1,80 @@
+"""
+    Prefetch gist notebooks before they are opened.
+
+    When a tag or project listing is served, the most recently updated
+    notebooks in it are likely to be opened next. GistPrefetcher warms
+    the gist cache for them on a small thread pool, so the open is served
+    from the cache instead of a cold fetch. Opens are counted as hits or
+    misses to tune how many notebooks are worth prefetching.
+"""
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
+
+class GistPrefetcher(object):
+    def __init__(self, warm, depth=10, workers=4, log=None):
+        """
+            warm(id) fetches and parses a gist's notebooks into the cache
+        """
+        self.warm = warm
+        self.depth = depth
+        self.log = log
+        self.pool = ThreadPool(workers)
+        self.lock = threading.Lock()
+        self._pending = set()
+        # id -> updated_at of prefetched gists not opened yet
+        self._warm = {}
+        self.prefetched = 0
+        self.errors = 0
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, gists):
+        """
+            Warm the depth most recently updated of gists
+        """
+        gists = [gist for gist in gists if gist is not None]
+        gists.sort(key=lambda gist: gist.updated_at, reverse=True)
+        for gist in gists[:self.depth]:
+            with self.lock:
+                if gist.id in self._pending:
+                    continue
+                if self._warm.get(gist.id) == gist.updated_at:
+                    continue
+                self._pending.add(gist.id)
+            self.pool.apply_async(self._prefetch, (gist.id,))
+
+    def _prefetch(self, id):
+        try:
+            gist = self.warm(id)
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            if self.log:
+                self.log.debug("prefetch of gist %s failed\n%s", id,
+                               traceback.format_exc())
+            return
+        finally:
+            with self.lock:
+                self._pending.discard(id)
+        with self.lock:
+            self.prefetched += 1
+            self._warm[id] = gist.updated_at
+
+    def record_open(self, id):
+        with self.lock:
+            if self._warm.pop(id, None) is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self.lock:
+            opens = self.hits + self.misses
+            hit_rate = None
+            if opens:
+                hit_rate = float(self.hits) / opens
+            return {'depth': self.depth, 'prefetched': self.prefetched,
+                    'errors': self.errors, 'pending': len(self._pending),
+                    'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': hit_rate}
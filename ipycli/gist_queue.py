@@ -0,0 +1,146 @@
+"""
+    Write-behind queue for gist saves.
+
+    Saving to a gist is a full GitHub round trip. Running it inside the
+    tornado request blocks the IOLoop (and with it every kernel websocket)
+    until GitHub answers. Instead, saves are handed to a small pool of
+    worker threads and the request returns right away.
+
+    Saves are keyed by notebook path. Only the latest queued save for a
+    path is pushed, and a path is never pushed by two workers at once.
+"""
+import datetime
+import threading
+import time
+import traceback
+from Queue import Queue
+
+PENDING = 'pending'
+IN_FLIGHT = 'in-flight'
+FAILED = 'failed'
+SAVED = 'saved'
+
+class SaveStatus(object):
+    def __init__(self):
+        self.state = SAVED
+        # revision counts the saves handed to the queue
+        self.revision = 0
+        self.pushed_revision = 0
+        self.last_pushed = None
+        self.error = None
+
+    def to_dict(self):
+        last_pushed = None
+        if self.last_pushed:
+            last_pushed = self.last_pushed.isoformat()
+        return {'state': self.state, 'revision': self.revision,
+                'pushed_revision': self.pushed_revision,
+                'last_pushed': last_pushed, 'error': self.error}
+
+class GistSaveQueue(object):
+    def __init__(self, workers=2, log=None):
+        self.workers = workers
+        self.log = log
+        self.status = {}
+        # key -> (revision, func, args)
+        self._jobs = {}
+        self._in_flight = set()
+        self._queue = Queue()
+        self._cond = threading.Condition()
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name='gist-save-%d' % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def enqueue(self, key, func, *args):
+        """
+            Queue func(*args) as the latest save for key. An older save
+            for the same key that has not started yet is dropped.
+        """
+        with self._cond:
+            status = self.status.setdefault(key, SaveStatus())
+            status.revision += 1
+            queued = key in self._jobs
+            self._jobs[key] = (status.revision, func, args)
+            if key not in self._in_flight:
+                status.state = PENDING
+            if not queued and key not in self._in_flight:
+                self._queue.put(key)
+            return status.revision
+
+    def is_pending(self, key):
+        with self._cond:
+            return key in self._jobs or key in self._in_flight
+
+    def wait(self, key=None, timeout=None):
+        """
+            Block until key (or every key when None) has been pushed.
+            Returns False if the timeout ran out first.
+        """
+        def done():
+            if key is None:
+                return not self._jobs and not self._in_flight
+            return key not in self._jobs and key not in self._in_flight
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._cond:
+            while not done():
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+        return True
+
+    def get_status(self, key):
+        with self._cond:
+            status = self.status.get(key)
+            if status is None:
+                return None
+            return status.to_dict()
+
+    def all_status(self):
+        with self._cond:
+            return dict((key, status.to_dict()) for key, status in self.status.items())
+
+    def _worker(self):
+        while True:
+            key = self._queue.get()
+            with self._cond:
+                job = self._jobs.pop(key, None)
+                if job is None:
+                    continue
+                self._in_flight.add(key)
+                status = self.status[key]
+                status.state = IN_FLIGHT
+
+            revision, func, args = job
+            error = None
+            try:
+                func(*args)
+            except Exception as e:
+                error = '{0}: {1}'.format(e.__class__.__name__, e)
+                if self.log:
+                    self.log.error("gist save failed for %s\n%s", key,
+                                   traceback.format_exc())
+
+            with self._cond:
+                self._in_flight.discard(key)
+                if error is None:
+                    status.pushed_revision = revision
+                    status.last_pushed = datetime.datetime.now()
+                    status.error = None
+                    status.state = SAVED
+                else:
+                    status.error = error
+                    status.state = FAILED
+                # a newer save came in while we were pushing
+                if key in self._jobs:
+                    status.state = PENDING
+                    self._queue.put(key)
+                self._cond.notify_all()
@@ -0,0 +1,180 @@
+"""
+    Rate limit aware scheduling of github api calls.
+
+    Every call the gist backend makes goes through RequestScheduler.run.
+    Calls take one of a few slots, handed out by priority: interactive
+    reads first, then gist saves, then background work like listing
+    refreshes and revalidation. The remaining quota is read off every
+    response's X-RateLimit headers. When it gets low, background work is
+    refused and saves wait for the quota to reset, keeping what is left
+    for interactive reads. 403s and 5xx back everything off
+    exponentially.
+"""
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+INTERACTIVE = 0
+SAVE = 1
+BACKGROUND = 2
+
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', SAVE: 'save',
+                  BACKGROUND: 'background'}
+
+class RateLimited(Exception):
+    pass
+
+class RequestScheduler(object):
+    def __init__(self, concurrency=4, save_reserve=100, background_reserve=500,
+                 base_backoff=1, max_backoff=300, log=None):
+        self.concurrency = concurrency
+        # calls left when saves/background work stop going out
+        self.reserves = {INTERACTIVE: 0, SAVE: save_reserve,
+                         BACKGROUND: background_reserve}
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.log = log
+
+        self.remaining = None
+        self.limit = None
+        # epoch seconds the quota resets at
+        self.reset = None
+        self.failures = 0
+        self.backoff_until = 0
+
+        self.running = 0
+        # heap of (priority, seq) waiting for a slot
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+        self.calls = dict((p, 0) for p in PRIORITY_NAMES)
+        self.deferred = dict((p, 0) for p in PRIORITY_NAMES)
+
+    @contextmanager
+    def priority(self, priority):
+        """
+            Calls made from this thread inside the block run at priority
+        """
+        old = self.current_priority()
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = old
+
+    def current_priority(self):
+        return getattr(self._local, 'priority', INTERACTIVE)
+
+    def update_quota(self, status, headers):
+        """
+            Response observer, picks the quota out of X-RateLimit headers
+        """
+        headers = dict((k.lower(), v) for k, v in headers)
+        remaining = headers.get('x-ratelimit-remaining')
+        if remaining is None:
+            return
+        with self._cond:
+            self.remaining = int(remaining)
+            if 'x-ratelimit-limit' in headers:
+                self.limit = int(headers['x-ratelimit-limit'])
+            if 'x-ratelimit-reset' in headers:
+                self.reset = int(headers['x-ratelimit-reset'])
+            self._cond.notify_all()
+
+    def blocked_until(self, priority, now=None):
+        """
+            Time before which priority can't go out, 0 if it can now
+        """
+        if now is None:
+            now = time.time()
+        until = self.backoff_until
+        if (self.remaining is not None and self.reset is not None
+                and self.reset > now
+                and self.remaining <= self.reserves[priority]):
+            until = max(until, self.reset)
+        if until > now:
+            return until
+        return 0
+
+    def can_run(self, priority):
+        with self._cond:
+            return not self.blocked_until(priority)
+
+    def run(self, func, *args):
+        """
+            Call func at the current thread's priority. Interactive and
+            background calls that can't go out raise RateLimited, saves
+            wait until they can.
+        """
+        priority = self.current_priority()
+        self._acquire(priority)
+        status = None
+        try:
+            ret = func(*args)
+            status = 200
+            return ret
+        except Exception as e:
+            status = getattr(e, 'status', None)
+            raise
+        finally:
+            self._release(status)
+
+    def _acquire(self, priority):
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    now = time.time()
+                    until = self.blocked_until(priority, now)
+                    if until and priority != SAVE:
+                        self.deferred[priority] += 1
+                        raise RateLimited("github rate limited, %s calls deferred"
+                                          " for %ds" % (PRIORITY_NAMES[priority],
+                                                        until - now))
+                    if until:
+                        self._cond.wait(min(until - now, 60))
+                        continue
+                    if self.running < self.concurrency and self._waiting[0] == entry:
+                        break
+                    self._cond.wait(1)
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+            self.running += 1
+            self.calls[priority] += 1
+
+    def _release(self, status):
+        with self._cond:
+            self.running -= 1
+            if status == 403 or (status is not None and status >= 500):
+                self.failures += 1
+                delay = min(self.base_backoff * 2 ** (self.failures - 1),
+                            self.max_backoff)
+                self.backoff_until = time.time() + delay
+                if self.log:
+                    self.log.warn("github returned %s, backing off %ss",
+                                  status, delay)
+            elif status is not None and status < 400:
+                self.failures = 0
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            now = time.time()
+            return {
+                'remaining': self.remaining,
+                'limit': self.limit,
+                'reset': self.reset,
+                'backoff': max(self.backoff_until - now, 0),
+                'running': self.running,
+                'waiting': len(self._waiting),
+                'calls': dict((PRIORITY_NAMES[p], n) for p, n in self.calls.items()),
+                'deferred': dict((PRIORITY_NAMES[p], n)
+                                 for p, n in self.deferred.items()),
+            }
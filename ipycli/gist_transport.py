@@ -0,0 +1,238 @@
+"""
+    Pooled keep-alive HTTP transport for the GitHub api.
+
+    PyGithub opens a new connection, and a new TLS handshake, for every
+    call. Transport keeps idle connections per host and hands them back
+    out, so a call costs one request round trip. It is installed into
+    PyGithub as its connection classes and also serves GistHub's raw
+    requests. Point the Github client and GistHub at a local http server
+    to test against a stand-in.
+"""
+import errno
+import httplib
+import socket
+import threading
+
+import github
+
+CHUNK_SIZE = 64 * 1024
+# safe to send again when we can't tell whether the server got them
+IDEMPOTENT = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+def _stale(error):
+    """
+        Is error what a keep-alive connection the server closed gives us
+    """
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    if isinstance(error, socket.error):
+        return error.errno in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+    return False
+
+class ResponseTooLarge(Exception):
+    pass
+
+class ConnectionPool(object):
+    def __init__(self, scheme, host, port=None, size=4, timeout=10,
+                 observers=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        # called with (status, headers) for every response
+        self.observers = observers if observers is not None else []
+        self._idle = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.requests = 0
+        self.retries = 0
+
+    def _new(self):
+        if self.scheme == 'https':
+            cls = httplib.HTTPSConnection
+        else:
+            cls = httplib.HTTPConnection
+        with self._lock:
+            self.created += 1
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        """
+            Returns (connection, reused)
+        """
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop(), True
+        return self._new(), False
+
+    def release(self, cnx):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(cnx)
+                return
+        cnx.close()
+
+    def request(self, verb, url, body=None, headers=None, max_size=None):
+        """
+            Returns (status, headers, body). A reused connection the
+            server has since closed is retried once on a new one, if the
+            request can't have reached the server or is idempotent.
+            Timeouts are never retried, a POST the server is still
+            working on would be made twice. Bodies over max_size bytes
+            raise ResponseTooLarge.
+        """
+        headers = headers or {}
+        with self._lock:
+            self.requests += 1
+        cnx, reused = self.acquire()
+        while True:
+            sent = False
+            try:
+                cnx.request(verb, url, body, headers)
+                sent = True
+                response = cnx.getresponse()
+                data = self._read(response, max_size)
+            except ResponseTooLarge:
+                cnx.close()
+                raise
+            except (httplib.HTTPException, socket.error) as e:
+                cnx.close()
+                if not reused or not _stale(e):
+                    raise
+                if sent and verb.upper() not in IDEMPOTENT:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                cnx, reused = self._new(), False
+                continue
+
+            if response.will_close:
+                cnx.close()
+            else:
+                self.release(cnx)
+            resp_headers = response.getheaders()
+            for observer in self.observers:
+                observer(response.status, resp_headers)
+            return response.status, resp_headers, data
+
+    def _read(self, response, max_size):
+        if max_size is None:
+            return response.read()
+        length = response.getheader('content-length')
+        if length is not None and int(length) > max_size:
+            raise ResponseTooLarge("%s bytes over the %s limit" % (length, max_size))
+        chunks = []
+        size = 0
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise ResponseTooLarge("over the %s byte limit" % max_size)
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for cnx in idle:
+            cnx.close()
+
+    def stats(self):
+        with self._lock:
+            return {'created': self.created, 'reused': self.reused,
+                    'requests': self.requests, 'retries': self.retries,
+                    'idle': len(self._idle)}
+
+class PooledResponse(object):
+    """
+        The bits of httplib.HTTPResponse that PyGithub reads
+    """
+    def __init__(self, status, headers, body):
+        self.status = status
+        self._headers = headers
+        self._body = body
+
+    def getheaders(self):
+        return self._headers
+
+    def read(self):
+        return self._body
+
+class PooledConnection(object):
+    """
+        Stands in for httplib's connections inside PyGithub. The round
+        trip happens in getresponse() on a pooled connection. Subclasses
+        made by Transport.connection_class fill in transport and scheme.
+    """
+    transport = None
+    scheme = None
+
+    def __init__(self, host, port=None, strict=None, timeout=None):
+        self.pool = self.transport.get_pool(self.scheme, host, port)
+        self._request = None
+
+    def request(self, verb, url, body=None, headers=None):
+        self._request = (verb, url, body, headers)
+
+    def getresponse(self):
+        status, headers, body = self.pool.request(*self._request)
+        return PooledResponse(status, headers, body)
+
+    def close(self):
+        pass
+
+class Transport(object):
+    def __init__(self, size=4, timeout=10):
+        self.size = size
+        self.timeout = timeout
+        # (scheme, host, port) -> ConnectionPool
+        self.pools = {}
+        # see ConnectionPool.observers
+        self.observers = []
+        self._lock = threading.Lock()
+
+    def get_pool(self, scheme, host, port=None):
+        key = (scheme, host, port)
+        with self._lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(scheme, host, port, size=self.size,
+                                      timeout=self.timeout,
+                                      observers=self.observers)
+                self.pools[key] = pool
+            return pool
+
+    def connection_class(self, scheme):
+        name = 'Pooled%sConnection' % scheme.upper()
+        return type(name, (PooledConnection,),
+                    {'transport': self, 'scheme': scheme})
+
+    def install(self):
+        """
+            Make Github clients created from now on use this transport.
+            PyGithub picks its connection class when a client is made.
+        """
+        github.Requester.Requester.injectConnectionClasses(
+            self.connection_class('http'), self.connection_class('https'))
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+
+    def stats(self):
+        with self._lock:
+            pools = self.pools.items()
+        data = {}
+        for (scheme, host, port), pool in pools:
+            name = '%s://%s' % (scheme, host)
+            if port:
+                name += ':%s' % port
+            data[name] = pool.stats()
+        return data
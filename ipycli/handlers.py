@@ -656,6 +656,7 @@ class NotebookRootHandler(IPythonHandler):
 
         data = {'files': files, 'projects': backends}
         self.finish(jsonapi.dumps(data))
+        nbm.prefetch_notebooks([f['notebook_id'] for f in files])
 
     @web.authenticated
     def post(self):
@@ -729,11 +730,13 @@ class NotebookTagHandler(IPythonHandler):
 
         # all these should be from the same backend, for now
         backends = []
-        b = {'name': backend.name, 'path': backend.path}
-        backends.append(b)
+        if backend is not None:
+            b = {'name': backend.name, 'path': backend.path}
+            backends.append(b)
 
         data = {'files': files, 'projects': backends}
         self.finish(jsonapi.dumps(data))
+        nbm.prefetch_notebooks([f['notebook_id'] for f in files])
 
 class NotebookDirHandler(IPythonHandler):
 
@@ -757,7 +760,17 @@ class NotebookDirHandler(IPythonHandler):
         data = {'files': files, 'projects': backends}
         self.finish(jsonapi.dumps(data))
 
-class NotebookHandler(IPythonHandler):
+class SaveHandlerMixin(object):
+
+    def _on_save_done(self, error):
+        if error is None:
+            self.set_status(204)
+            self.finish()
+            return
+        status = getattr(error, 'status_code', 500)
+        self.send_error(status)
+
+class NotebookHandler(SaveHandlerMixin, IPythonHandler):
 
     SUPPORTED_METHODS = ('GET', 'PUT', 'DELETE')
 
@@ -765,7 +778,11 @@ class NotebookHandler(IPythonHandler):
     def get(self, notebook_id):
         nbm = self.application.notebook_manager
         format = self.get_argument('format', default='json')
-        last_mod, name, data = nbm.get_notebook(notebook_id, format)
+        if format == u'json' and self.get_argument('paged', default=None):
+            # outputs are stubbed, see NotebookCellsHandler
+            last_mod, name, data = nbm.get_notebook_skeleton(notebook_id)
+        else:
+            last_mod, name, data = nbm.get_notebook(notebook_id, format)
 
         if format == u'json':
             self.set_header('Content-Type', 'application/json')
@@ -777,13 +794,13 @@ class NotebookHandler(IPythonHandler):
         self.finish(data)
 
     @web.authenticated
+    @web.asynchronous
     def put(self, notebook_id):
         nbm = self.application.notebook_manager
         format = self.get_argument('format', default='json')
         name = self.get_argument('name', default=None)
-        nbm.save_notebook(notebook_id, self.request.body, name=name, format=format)
-        self.set_status(204)
-        self.finish()
+        nbm.save_notebook(notebook_id, self.request.body, name=name, format=format,
+                          callback=self._on_save_done)
 
     @web.authenticated
     def delete(self, notebook_id):
@@ -792,18 +809,87 @@ class NotebookHandler(IPythonHandler):
         self.set_status(204)
         self.finish()
 
-class AutosaveNotebookHandler(IPythonHandler):
+class NotebookCellsHandler(IPythonHandler):
+    """
+        Ranges of full cells for notebooks opened paged
+    """
+    max_cells = 200
+
+    @authenticate_unless_readonly
+    def get(self, notebook_id):
+        nbm = self.application.notebook_manager
+        try:
+            start = int(self.get_argument('start', default=0))
+            stop = int(self.get_argument('stop', default=start + 50))
+        except ValueError:
+            raise web.HTTPError(400, u'Invalid cell range')
+        if start < 0 or stop < start:
+            raise web.HTTPError(400, u'Invalid cell range')
+        stop = min(stop, start + self.max_cells)
+        last_mod, data = nbm.get_notebook_cells(notebook_id, start, stop)
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Last-Modified', last_mod)
+        self.finish(data)
+
+class AutosaveNotebookHandler(SaveHandlerMixin, IPythonHandler):
 
     SUPPORTED_METHODS = ('PUT')
 
     @web.authenticated
+    @web.asynchronous
     def put(self, notebook_id, client_id):
         nbm = self.application.notebook_manager
         format = self.get_argument('format', default='json')
         name = self.get_argument('name', default=None)
-        nbm.autosave_notebook(notebook_id, self.request.body, name=name, client_id=client_id, format=format)
-        self.set_status(204)
-        self.finish()
+        nbm.autosave_notebook(notebook_id, self.request.body, name=name, client_id=client_id,
+                              format=format, callback=self._on_save_done)
+
+class SaveStatusHandler(IPythonHandler):
+
+    @authenticate_unless_readonly
+    def get(self, notebook_id=None):
+        nbm = self.application.notebook_manager
+        if notebook_id is None:
+            data = nbm.all_save_status()
+        else:
+            data = nbm.save_status(notebook_id)
+        self.finish(jsonapi.dumps(data))
+
+class SaveStatsHandler(IPythonHandler):
+
+    @authenticate_unless_readonly
+    def get(self):
+        nbm = self.application.notebook_manager
+        self.finish(jsonapi.dumps(nbm.save_stats()))
+
+class GithubStatsHandler(IPythonHandler):
+
+    @authenticate_unless_readonly
+    def get(self):
+        nbm = self.application.notebook_manager
+        self.finish(jsonapi.dumps(nbm.github_stats()))
+
+class SearchHandler(IPythonHandler):
+    """
+        Full-text search over notebook names, tags, markdown and code
+    """
+    max_limit = 100
+
+    @authenticate_unless_readonly
+    def get(self):
+        nbm = self.application.notebook_manager
+        q = self.get_argument('q', default=u'')
+        try:
+            offset = int(self.get_argument('offset', default=0))
+            limit = int(self.get_argument('limit', default=20))
+        except ValueError:
+            raise web.HTTPError(400, u'Invalid offset or limit')
+        if offset < 0 or limit < 1:
+            raise web.HTTPError(400, u'Invalid offset or limit')
+        limit = min(limit, self.max_limit)
+        data = nbm.search_notebooks(q, offset=offset, limit=limit)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(jsonapi.dumps(data))
 
 class RenameNotebookHandler(IPythonHandler):
 
@@ -841,6 +927,7 @@ class NotebookCopyHandler(IPythonHandler):
         )
 
 class AddNotebookDirHandler(IPythonHandler):
+    recursive = False
 
     @web.authenticated
     def get(self, path):
@@ -848,8 +935,10 @@ class AddNotebookDirHandler(IPythonHandler):
         if not os.path.isdir(path):
             raise web.HTTPError(503, u'Not valid Directory')
 
-        nbm.add_notebook_dir(path)
+        nbm.add_notebook_dir(path, recursive=self.recursive)
 
+class AddNotebookTreeHandler(AddNotebookDirHandler):
+    recursive = True
 
 #-----------------------------------------------------------------------------
 # Cluster handlers
@@ -0,0 +1,102 @@
+"""
+    LRU cache of parsed notebooks.
+
+    Opening, printing or downloading a notebook reads and parses its json
+    every time. NotebookCache keeps the parsed NotebookNodes of the most
+    recently used notebooks, bounded by entry count and by the size of
+    the files they were parsed from. Keys include the version of what was
+    parsed (mtime and size on disk, updated_at for gists), so a changed
+    notebook is simply a miss and the stale entry ages out. One cache is
+    shared by the directory projects and the gist cache.
+
+    Entries are handed out as views: a new top level, metadata and cell
+    lists over the cached cells. Callers may change the name and add,
+    drop or replace cells, but must not change a cell or its outputs in
+    place. A deepcopy of a big notebook costs more than parsing it again.
+"""
+import copy
+import threading
+from collections import OrderedDict
+
+def notebook_view(nb):
+    """
+        Copy of nb sharing only its cells. The top level, metadata,
+        worksheets and cell lists are its own.
+    """
+    view = type(nb)(nb)
+    if isinstance(view.get('metadata'), dict):
+        view['metadata'] = type(view['metadata'])(view['metadata'])
+    if isinstance(view.get('worksheets'), list):
+        worksheets = []
+        for ws in view['worksheets']:
+            ws = type(ws)(ws)
+            if isinstance(ws.get('cells'), list):
+                ws['cells'] = list(ws['cells'])
+            worksheets.append(ws)
+        view['worksheets'] = worksheets
+    return view
+
+def _view(value):
+    if isinstance(value, dict):
+        return notebook_view(value)
+    # see FilePages.__copy__
+    return copy.copy(value)
+
+class NotebookCache(object):
+    def __init__(self, max_entries=128, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (nb, size), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, size, load):
+        """
+            Parsed notebook for key, calling load() on a miss. size is
+            what the entry counts against max_bytes. A view is returned,
+            see notebook_view: callers may change its metadata and cell
+            lists, but the cells and their outputs are the cached ones
+            and must not be changed in place.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                self.hits += 1
+                return _view(entry[0])
+            self.misses += 1
+
+        nb = load()
+        self.put(key, size, nb)
+        return _view(nb)
+
+    def put(self, key, size, nb):
+        size = size or 0
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (nb, size)
+            self.bytes += size
+            while (len(self._entries) > self.max_entries
+                   or self.bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
@@ -0,0 +1,306 @@
+"""
+    Storage codecs for notebook files.
+
+    Notebooks are written as indented json by default. A directory can
+    pick another codec instead:
+
+        json     indented json, what IPython writes
+        compact  json without the indentation
+        gzip     compact json, gzipped, saved as .ipynb.gz
+        xz       compact json, xz compressed, saved as .ipynb.xz. Needs
+                 lzma (backports.lzma on python 2)
+
+    Reads detect the codec from the file itself, so every directory
+    reads every codec. Writes stream the json through the codec instead
+    of building the whole string first. Reads don't: the json module
+    has no incremental decoder, so a read decompresses the whole file
+    into one string and parses that.
+
+        python -m ipycli.nbcodecs bench <notebook>...
+
+    compares the size and speed of the codecs on real notebooks.
+"""
+import copy
+import gzip
+import json
+import os.path
+import time
+
+from IPython.nbformat import current, v1, v2, v3
+from IPython.nbformat.v3.nbjson import BytesEncoder
+from IPython.nbformat.v3.nbbase import from_dict as node_from_dict
+from IPython.nbformat.v3.rwbase import split_lines
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# json.dump writes many tiny pieces, they are passed on in chunks this big
+CHUNK_SIZE = 64 * 1024
+
+class ChunkWriter(object):
+    def __init__(self, f, size=CHUNK_SIZE):
+        self.f = f
+        self.size = size
+        self.chunks = []
+        self.buffered = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.size:
+            self.flush()
+
+    def flush(self):
+        self.f.write(''.join(self.chunks))
+        self.chunks = []
+        self.buffered = 0
+
+class Codec(object):
+    """
+        Indented json with sorted keys, the same bytes current.writes
+        makes
+    """
+    name = 'json'
+    # added after the notebook extension
+    suffix = ''
+    # read the first bytes of a file to detect the codec
+    magic = None
+
+    def wrap(self, f, mode):
+        """
+            File object reading or writing through the codec on top of
+            the open file f
+        """
+        return f
+
+    def dump(self, nb, f):
+        """
+            Write nb to the open file f
+        """
+        out = self.wrap(f, 'wb')
+        self.write(nb, out)
+        if out is not f:
+            # ends the compressed stream, f stays open
+            out.close()
+
+    def write(self, nb, f):
+        """
+            Stream the json of nb into f
+        """
+        out = ChunkWriter(f)
+        nb = split_lines(copy.deepcopy(nb))
+        json.dump(nb, out, cls=BytesEncoder, indent=1, sort_keys=True,
+                  separators=(',', ': '))
+        out.flush()
+
+    def read(self, f):
+        """
+            Parse the notebook in f. Not streamed, the whole decoded
+            json is read into memory first.
+        """
+        return from_dict(json.load(f))
+
+class CompactCodec(Codec):
+    """
+        json without whitespace. Written a cell at a time with the C
+        encoder, which can't sort keys.
+    """
+    name = 'compact'
+
+    def _dumps(self, obj):
+        return json.dumps(obj, cls=BytesEncoder, separators=(',', ':'))
+
+    def _write_object(self, obj, out, write_value):
+        out.write('{')
+        for i, (key, value) in enumerate(obj.items()):
+            if i:
+                out.write(',')
+            out.write(self._dumps(key) + ':')
+            write_value(key, value)
+        out.write('}')
+
+    def write(self, nb, f):
+        out = ChunkWriter(f)
+        def write_cells(cells):
+            out.write('[')
+            for i, cell in enumerate(cells):
+                if i:
+                    out.write(',')
+                # from_dict copies, so lines are split on the copy
+                wrapped = node_from_dict({'worksheets': [{'cells': [cell]}]})
+                out.write(self._dumps(split_lines(wrapped).worksheets[0].cells[0]))
+            out.write(']')
+        def write_worksheets(worksheets):
+            out.write('[')
+            for i, ws in enumerate(worksheets):
+                if i:
+                    out.write(',')
+                self._write_object(ws, out, write_ws_value)
+            out.write(']')
+        def write_ws_value(key, value):
+            if key == 'cells':
+                write_cells(value)
+            else:
+                out.write(self._dumps(value))
+        def write_nb_value(key, value):
+            if key == 'worksheets':
+                write_worksheets(value)
+            else:
+                out.write(self._dumps(value))
+        self._write_object(nb, out, write_nb_value)
+        out.flush()
+
+class GzipCodec(CompactCodec):
+    name = 'gzip'
+    suffix = '.gz'
+    magic = '\x1f\x8b'
+
+    def wrap(self, f, mode):
+        # level 6 is most of the size of 9 for much less time
+        return gzip.GzipFile(fileobj=f, mode=mode, compresslevel=6)
+
+class XzCodec(CompactCodec):
+    name = 'xz'
+    suffix = '.xz'
+    magic = '\xfd7zXZ\x00'
+
+    def wrap(self, f, mode):
+        return lzma.LZMAFile(f, mode)
+
+CODECS = dict((codec.name, codec) for codec in [Codec(), CompactCodec(),
+                                                GzipCodec(), XzCodec()])
+if lzma is None:
+    del CODECS['xz']
+
+def from_dict(d):
+    """
+        NotebookNode of the current nbformat from parsed json, see
+        current.reads_json
+    """
+    nbf = d.get('nbformat', 1)
+    minor = d.get('nbformat_minor', 0)
+    if nbf == 1:
+        nb = v1.to_notebook_json(d)
+        return v3.convert_to_this_nbformat(nb, orig_version=1)
+    elif nbf == 2:
+        nb = v2.to_notebook_json(d)
+        return v3.convert_to_this_nbformat(nb, orig_version=2)
+    elif nbf == 3:
+        nb = v3.to_notebook_json(d)
+        return v3.convert_to_this_nbformat(nb, orig_version=3, orig_minor=minor)
+    raise current.NBFormatError('Unsupported JSON nbformat version %s' % nbf)
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError("Unknown notebook codec %r, have %s" % (name, sorted(CODECS)))
+
+def suffixes():
+    return sorted(codec.suffix for codec in CODECS.values() if codec.suffix)
+
+def is_notebook(name, ext):
+    if name.startswith('.'):
+        return False
+    if name.endswith(ext):
+        return True
+    return any(name.endswith(ext + suffix) for suffix in suffixes())
+
+def notebook_name(path, ext):
+    """
+        Name of a notebook from its path, without the extension and any
+        codec suffix
+    """
+    name = os.path.basename(path)
+    for suffix in suffixes():
+        if name.endswith(ext + suffix):
+            return name[:-len(ext + suffix)]
+    return os.path.splitext(name)[0]
+
+def for_path(path, default='json'):
+    """
+        The codec to write path with. Compressed files keep their codec,
+        plain ones get default unless it compresses.
+    """
+    for codec in CODECS.values():
+        if codec.suffix and path.endswith(codec.suffix):
+            return codec
+    codec = get_codec(default)
+    if codec.suffix:
+        return CODECS['json']
+    return codec
+
+def detect(path):
+    """
+        The codec a file was written with
+    """
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for codec in CODECS.values():
+        if codec.magic and head.startswith(codec.magic):
+            return codec
+    return CODECS['json']
+
+def read_notebook(path):
+    codec = detect(path)
+    with open(path, 'rb') as f:
+        return codec.read(codec.wrap(f, 'rb'))
+
+def benchmark(paths, repeat=3):
+    """
+        Returns {codec: {'bytes', 'write', 'read'}} summed over the
+        notebooks at paths, times are the best of repeat runs.
+    """
+    import tempfile
+    notebooks = []
+    for path in paths:
+        notebooks.append(read_notebook(path))
+
+    results = {}
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, codec in sorted(CODECS.items()):
+            target = os.path.join(tmpdir, 'bench.ipynb' + codec.suffix)
+            total = {'bytes': 0, 'write': 0.0, 'read': 0.0}
+            for nb in notebooks:
+                writes, reads = [], []
+                for i in range(repeat):
+                    start = time.time()
+                    with open(target, 'wb') as f:
+                        codec.dump(nb, f)
+                    writes.append(time.time() - start)
+                    start = time.time()
+                    read_notebook(target)
+                    reads.append(time.time() - start)
+                total['bytes'] += os.path.getsize(target)
+                total['write'] += min(writes)
+                total['read'] += min(reads)
+            results[name] = total
+    finally:
+        for name in os.listdir(tmpdir):
+            os.unlink(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+    return results
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Notebook storage codecs")
+    parser.add_argument('action', choices=['bench'])
+    parser.add_argument('notebooks', nargs='+')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.notebooks, repeat=args.repeat)
+    print "%-8s %12s %10s %10s" % ('codec', 'bytes', 'write ms', 'read ms')
+    for name, total in sorted(results.items(), key=lambda item: item[1]['bytes']):
+        print "%-8s %12d %10.1f %10.1f" % (name, total['bytes'],
+                                           total['write'] * 1000,
+                                           total['read'] * 1000)
+
+if __name__ == '__main__':
+    main()
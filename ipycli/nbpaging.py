@@ -0,0 +1,177 @@
+"""
+    Paged reads of large notebooks.
+
+    A notebook with thousands of cells or megabytes of outputs is slow to
+    ship in one response. The paged api serves a skeleton instead, with
+    the metadata and every cell's input but each output swapped for a
+    stub, and the full cells are fetched in ranges as they are needed.
+
+    For notebooks on disk the file is scanned once for the byte offsets of
+    its cells, and ranges are read by seeking to them, so only the cells
+    asked for are parsed. Other notebooks are paged from the parsed
+    notebook.
+"""
+import json
+import re
+
+from IPython.nbformat import current
+from IPython.nbformat.v3.nbbase import from_dict
+from IPython.nbformat.v3.rwbase import rejoin_lines
+
+from .nbcache import notebook_view
+
+# strings, so brackets inside them are skipped, and structural tokens
+_TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{},:]', re.DOTALL)
+_decoder = json.JSONDecoder()
+
+class UnsupportedNotebook(Exception):
+    pass
+
+def output_stub(output):
+    """
+        Placeholder for an output in the skeleton
+    """
+    return {'output_type': output.get('output_type'), 'stub': True,
+            'size': len(json.dumps(output, default=str))}
+
+def stub_cell(cell):
+    cell = dict(cell)
+    if 'outputs' in cell:
+        cell['outputs'] = [output_stub(output) for output in cell['outputs']]
+    return cell
+
+def _rejoin_cells(cells):
+    nb = from_dict({'worksheets': [{'cells': cells}]})
+    return rejoin_lines(nb).worksheets[0].cells
+
+def scan_cells(data, visit=None):
+    """
+        Byte offsets of the cells of each worksheet in the json text of a
+        notebook. Returns ([(start, end)] of each worksheet's cells array,
+        [[(start, end)] of its cells] for each worksheet). Cells are parsed
+        as they are found and visit(cell) is called with each.
+    """
+    arrays = []
+    cells = []
+    # frames of [kind, key or index, expecting a key]
+    stack = []
+    pos = 0
+    while True:
+        match = _TOKENS.search(data, pos)
+        if match is None:
+            break
+        token = match.group()
+        pos = match.end()
+        top = stack[-1] if stack else None
+        if token[0] == '"':
+            if top is not None and top[0] == '{' and top[2]:
+                top[1] = token[1:-1]
+        elif token == ':':
+            top[2] = False
+        elif token == ',':
+            if top[0] == '{':
+                top[2] = True
+            else:
+                top[1] += 1
+        elif token == '{':
+            if _at_cells(stack):
+                # the whole cell at once, in C
+                cell, pos = _decoder.raw_decode(data, match.start())
+                cells[-1].append((match.start(), pos))
+                if visit is not None:
+                    visit(cell)
+                continue
+            stack.append([token, None, True])
+        elif token == '[':
+            stack.append([token, 0, False])
+            if _at_cells(stack):
+                arrays.append([match.end(), None])
+                cells.append([])
+        else:
+            if token == ']' and _at_cells(stack):
+                arrays[-1][1] = match.start()
+            stack.pop()
+    return [tuple(span) for span in arrays], cells
+
+def _at_cells(stack):
+    """
+        Is the innermost container root.worksheets[i].cells
+    """
+    return (len(stack) == 4 and stack[0][1] == 'worksheets'
+            and stack[1][0] == '[' and stack[2][1] == 'cells'
+            and stack[3][0] == '[')
+
+class FilePages(object):
+    """
+        Pages of a v3 notebook file, read through an index of its cells
+    """
+    def __init__(self, path, resolve=None):
+        """
+            resolve(cells) fills in whatever the cells read from the file
+            only refer to, see blobstore
+        """
+        self.path = path
+        self.resolve = resolve
+        with open(path, 'rb') as f:
+            data = f.read()
+        stubs = []
+        def visit(cell):
+            cell = _rejoin_cells([cell])[0]
+            stubs.append(stub_cell(cell))
+        arrays, cells = scan_cells(data, visit)
+
+        # everything but the cells is small, parse it on its own
+        parts = []
+        pos = 0
+        for start, end in arrays:
+            parts.append(data[pos:start])
+            pos = end
+        parts.append(data[pos:])
+        nb = json.loads(''.join(parts))
+        if nb.get('nbformat') != current.nbformat or not arrays:
+            raise UnsupportedNotebook(path)
+
+        self.offsets = []
+        for worksheet, spans in zip(nb['worksheets'], cells):
+            worksheet['cells'] = stubs[len(self.offsets):len(self.offsets) + len(spans)]
+            self.offsets.extend(spans)
+        self.skeleton = from_dict(nb)
+
+    def __copy__(self):
+        # only the top of the skeleton is changed by page_info
+        pages = FilePages.__new__(FilePages)
+        pages.__dict__.update(self.__dict__)
+        pages.skeleton = notebook_view(self.skeleton)
+        return pages
+
+    def cells(self, start, stop):
+        found = []
+        with open(self.path, 'rb') as f:
+            for begin, end in self.offsets[start:stop]:
+                f.seek(begin)
+                found.append(json.loads(f.read(end - begin)))
+        cells = _rejoin_cells(found)
+        if self.resolve is not None:
+            self.resolve(cells)
+        return cells
+
+class NotebookPages(object):
+    """
+        Pages of an already parsed notebook
+    """
+    def __init__(self, nb):
+        self.all_cells = [cell for ws in nb.worksheets for cell in ws.cells]
+        worksheets = [dict(ws, cells=[stub_cell(cell) for cell in ws.cells])
+                      for ws in nb.worksheets]
+        self.skeleton = from_dict(dict(nb, worksheets=worksheets))
+
+    def cells(self, start, stop):
+        return self.all_cells[start:stop]
+
+def page_info(pages):
+    """
+        The skeleton as sent to clients, with the cell count
+    """
+    skeleton = pages.skeleton
+    skeleton['paged'] = {'cells': sum(len(ws.cells) for ws in skeleton.worksheets)}
+    return skeleton
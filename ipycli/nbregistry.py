@@ -0,0 +1,244 @@
+"""
+    Registry of the notebook ids handed out by NotebookManager.
+
+    Every notebook listed gets an id, and the manager looks notebooks up
+    by id, by path and by name. NotebookRegistry keeps one record per id
+    with an index for each, so the three can't drift apart, and entries
+    whose files disappear are evicted instead of holding on to their
+    NBObjects. mapping, path_mapping and rev_mapping are read-only views
+    of it for the code that still uses the old dicts.
+
+    RegistryStore persists the registry in sqlite, so a restarted server
+    knows its notebooks before it has listed a single project.
+"""
+import collections
+import sqlite3
+import threading
+
+class NotebookRecord(object):
+    __slots__ = ('notebook_id', 'path', 'name', 'project', 'nbo')
+
+    def __init__(self, notebook_id, nbo):
+        self.notebook_id = notebook_id
+        self.path = nbo.path
+        self.name = nbo.name
+        # the project path, unique to each project
+        self.project = getattr(nbo.backend, 'path', None)
+        self.nbo = nbo
+
+class NotebookRegistry(object):
+    def __init__(self):
+        self._by_id = {}
+        self._by_path = {}
+        # name -> set of ids, names aren't unique
+        self._by_name = {}
+        # project path -> set of ids
+        self._by_project = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        # notebook_id -> record, or None once removed, since the last
+        # take_changes. Only kept when persisting.
+        self.track_changes = False
+        self._changes = {}
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, notebook_id):
+        return notebook_id in self._by_id
+
+    def add(self, notebook_id, nbo):
+        """
+            Register nbo under notebook_id. An id already registered moves
+            to the new path, and a path can only have one id.
+        """
+        record = NotebookRecord(notebook_id, nbo)
+        with self._lock:
+            old = self._by_id.get(notebook_id)
+            if old is not None:
+                self._unlink(old)
+            other = self._by_path.get(record.path)
+            if other is not None:
+                self._unlink(other)
+            self._by_id[notebook_id] = record
+            self._by_path[record.path] = record
+            self._by_name.setdefault(record.name, set()).add(notebook_id)
+            self._by_project.setdefault(record.project, set()).add(notebook_id)
+            if self.track_changes:
+                self._changes[notebook_id] = record
+        return record
+
+    def remove(self, notebook_id):
+        """
+            Drop notebook_id, returns its record or None
+        """
+        with self._lock:
+            record = self._by_id.get(notebook_id)
+            if record is not None:
+                self._unlink(record)
+        return record
+
+    def _unlink(self, record):
+        del self._by_id[record.notebook_id]
+        if self.track_changes:
+            self._changes[record.notebook_id] = None
+        if self._by_path.get(record.path) is record:
+            del self._by_path[record.path]
+        for index, key in ((self._by_name, record.name),
+                           (self._by_project, record.project)):
+            ids = index.get(key)
+            ids.discard(record.notebook_id)
+            if not ids:
+                del index[key]
+
+    def get(self, notebook_id):
+        return self._by_id.get(notebook_id)
+
+    def by_path(self, path):
+        return self._by_path.get(path)
+
+    def by_name(self, name):
+        """
+            Records of the notebooks called name
+        """
+        ids = self._by_name.get(name, ())
+        return [self._by_id[notebook_id] for notebook_id in list(ids)
+                if notebook_id in self._by_id]
+
+    def evict_missing(self, project, paths):
+        """
+            Drop the entries of the project at project path whose paths
+            aren't in paths anymore. Returns their records.
+        """
+        evicted = []
+        with self._lock:
+            for notebook_id in list(self._by_project.get(project, ())):
+                record = self._by_id[notebook_id]
+                if record.path not in paths:
+                    self._unlink(record)
+                    evicted.append(record)
+            self.evictions += len(evicted)
+        return evicted
+
+    def records(self):
+        return self._by_id.values()
+
+    def take_changes(self):
+        """
+            Returns ({notebook_id: record}, [removed notebook_id]) since
+            the last call
+        """
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        changed = dict((notebook_id, record) for notebook_id, record in changes.items()
+                       if record is not None)
+        removed = [notebook_id for notebook_id, record in changes.items()
+                   if record is None]
+        return changed, removed
+
+class RegistryStore(object):
+    """
+        sqlite file of notebook ids, the projects they came from and the
+        pathed notebooks
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            # kind is 'dir' or 'gist', mtime a timestamp
+            self.db.execute("CREATE TABLE IF NOT EXISTS notebooks ("
+                            "notebook_id TEXT PRIMARY KEY, path TEXT, "
+                            "project TEXT, kind TEXT, mtime REAL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS projects ("
+                            "dir TEXT PRIMARY KEY, recursive INTEGER)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS pathed ("
+                            "notebook_id TEXT PRIMARY KEY, path TEXT)")
+
+    def notebooks(self):
+        """
+            [(notebook_id, path, project, kind, mtime)]
+        """
+        with self.lock:
+            return self.db.execute("SELECT notebook_id, path, project, kind, mtime "
+                                   "FROM notebooks").fetchall()
+
+    def projects(self):
+        """
+            [(dir, recursive)]
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT dir, recursive FROM projects").fetchall()
+        return [(dir, bool(recursive)) for dir, recursive in rows]
+
+    def pathed(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT notebook_id, path FROM pathed"))
+
+    def write(self, rows, removed, projects=None, pathed=None):
+        """
+            Store the notebook rows and drop the removed ids in one
+            transaction. projects and pathed replace what was stored
+            unless they are None.
+        """
+        with self.lock:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO notebooks "
+                                    "VALUES (?, ?, ?, ?, ?)", rows)
+                self.db.executemany("DELETE FROM notebooks WHERE notebook_id = ?",
+                                    [(notebook_id,) for notebook_id in removed])
+                if projects is not None:
+                    self.db.execute("DELETE FROM projects")
+                    self.db.executemany("INSERT INTO projects VALUES (?, ?)",
+                                        [(dir, int(recursive)) for dir, recursive in projects])
+                if pathed is not None:
+                    self.db.execute("DELETE FROM pathed")
+                    self.db.executemany("INSERT INTO pathed VALUES (?, ?)",
+                                        pathed.items())
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class _View(collections.Mapping):
+    """
+        Read-only dict view of a registry index
+    """
+    def __init__(self, index, value):
+        self._index = index
+        self._value = value
+
+    def __getitem__(self, key):
+        return self._value(self._index[key])
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __repr__(self):
+        return repr(dict(self))
+
+def id_view(registry):
+    """
+        notebook_id -> NBObject, the old mapping
+    """
+    return _View(registry._by_id, lambda record: record.nbo)
+
+def path_view(registry):
+    """
+        notebook_id -> path, the old path_mapping
+    """
+    return _View(registry._by_id, lambda record: record.path)
+
+def rev_view(registry):
+    """
+        path -> notebook_id, the old rev_mapping
+    """
+    return _View(registry._by_path, lambda record: record.notebook_id)
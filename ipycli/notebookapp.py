@@ -62,9 +62,11 @@ from .handlers import (LoginHandler, LogoutHandler,
     ShellHandler, NotebookRootHandler, NotebookHandler, NotebookCopyHandler,
     RSTHandler, AuthenticatedFileHandler, PrintNotebookHandler,
     MainClusterHandler, ClusterProfileHandler, ClusterActionHandler,
-    PathedNotebookHandler, AddNotebookDirHandler, RenameNotebookHandler,
+    PathedNotebookHandler, AddNotebookDirHandler, AddNotebookTreeHandler,
+    RenameNotebookHandler,
     AutosaveNotebookHandler, NotebookTagHandler, AllNotebookRootHandler,
-    ActiveNotebooksHandler, NotebookDirHandler
+    ActiveNotebooksHandler, NotebookDirHandler, SaveStatusHandler,
+    SaveStatsHandler, GithubStatsHandler, NotebookCellsHandler, SearchHandler
 )
 
 from .cell_func import CellFuncHandler
@@ -164,8 +166,14 @@ class NotebookWebApplication(web.Application):
             (r"/tag/(.*)", NotebookTagHandler),
             (r"/dir_notebooks/(.*)", NotebookDirHandler),
             (r"/notebooks/%s" % _notebook_id_regex, NotebookHandler),
+            (r"/notebooks/%s/cells" % _notebook_id_regex, NotebookCellsHandler),
             (r"/autosave/%s/(?P<client_id>.*)" % _notebook_id_regex, AutosaveNotebookHandler),
             (r"/rename/%s" % _notebook_id_regex, RenameNotebookHandler),
+            (r"/save_status", SaveStatusHandler),
+            (r"/save_status/%s" % _notebook_id_regex, SaveStatusHandler),
+            (r"/save_stats", SaveStatsHandler),
+            (r"/github_stats", GithubStatsHandler),
+            (r"/search", SearchHandler),
             (r"/rstservice/render", RSTHandler),
             (r"/files/(.*)", AuthenticatedFileHandler, {'path' : notebook_manager.notebook_dir}),
             (r"/clusters", MainClusterHandler),
@@ -174,6 +182,7 @@ class NotebookWebApplication(web.Application):
 
             (r"/n/(.*)", PathedNotebookHandler),
             (r"/add_dir/(.*)", AddNotebookDirHandler),
+            (r"/add_tree/(.*)", AddNotebookTreeHandler),
             (r"/ndir/(.*)", ProjectDashboardHandler),
 
             (r"/cell_func/(.*)/(.*)", CellFuncHandler),
@@ -383,6 +392,57 @@ class NotebookApp(BaseIPythonApplication):
         help="""Github password to use for GIST backend"""
     )
 
+    gist_save_workers = Integer(2, config=True,
+        help="""Number of background threads pushing gist saves to github.
+        0 saves synchronously inside the request."""
+    )
+
+    gist_pool_size = Integer(4, config=True,
+        help="""Number of idle keep-alive connections kept open to the
+        github api."""
+    )
+
+    gist_push_interval = Integer(300, config=True,
+        help="""Seconds autosaves of gist notebooks are kept in a local
+        journal before being pushed to github. Explicit saves and shutdown
+        push right away. 0 pushes every autosave without a journal."""
+    )
+
+    gist_journal = Unicode(u'', config=True,
+        help="""Journal file for gist autosaves. Defaults to
+        gist_journal in the profile dir."""
+    )
+    def _gist_journal_default(self):
+        return os.path.join(self.profile_dir.location, 'gist_journal')
+
+    gist_prefetch = Integer(0, config=True,
+        help="""Number of the most recently updated gist notebooks to
+        prefetch when a tag or project listing is served. 0 disables
+        prefetching."""
+    )
+
+    gist_mirror_dir = Unicode(u'', config=True,
+        help="""Directory for the local mirror of notebook gists. Defaults
+        to gist_mirror in the profile dir."""
+    )
+    def _gist_mirror_dir_default(self):
+        return os.path.join(self.profile_dir.location, 'gist_mirror')
+
+    search_db = Unicode(u'', config=True,
+        help="""sqlite file of the notebook search index. Defaults to
+        search.sqlite in the profile dir. 'none' disables search."""
+    )
+    def _search_db_default(self):
+        return os.path.join(self.profile_dir.location, 'search.sqlite')
+
+    registry_db = Unicode(u'', config=True,
+        help="""sqlite file the notebook ids, added dirs and pathed
+        notebooks are kept in across restarts. Defaults to notebooks.sqlite
+        in the profile dir. 'none' disables it."""
+    )
+    def _registry_db_default(self):
+        return os.path.join(self.profile_dir.location, 'notebooks.sqlite')
+
     keyfile = Unicode(u'', config=True,
         help="""The full path to a private key file for usage with SSL/TLS."""
     )
@@ -685,13 +745,31 @@ class NotebookApp(BaseIPythonApplication):
              (proto, ip, self.port,self.base_project_url) )
         info("Use Control-C to stop this server and shut down all kernels.")
 
+        if self.registry_db != 'none':
+            self.notebook_manager.load_registry(self.registry_db)
+
         if self.github_user and self.github_pw:
             from .gist_backend import gist_hub
-            ghub = gist_hub(self.github_user, self.github_pw)
+            journal = None
+            if self.gist_push_interval:
+                journal = self.gist_journal
+            ghub = gist_hub(self.github_user, self.github_pw,
+                            save_workers=self.gist_save_workers, log=self.log,
+                            mirror_dir=self.gist_mirror_dir,
+                            pool_size=self.gist_pool_size,
+                            prefetch=self.gist_prefetch,
+                            journal=journal,
+                            push_interval=self.gist_push_interval,
+                            nbcache=self.notebook_manager.nbcache)
             # hack
             self.notebook_manager.ghub = ghub
             # initial load
-            self.notebook_manager.refresh_notebooks(skip_github=False)
+            self.notebook_manager.load_gist_projects()
+
+        self.notebook_manager.start_watching()
+
+        if self.search_db != 'none':
+            self.notebook_manager.start_search(self.search_db)
 
         if self.open_browser or self.file_to_run:
             ip = self.ip or '127.0.0.1'
@@ -721,6 +799,18 @@ class NotebookApp(BaseIPythonApplication):
             info("Interrupted...")
         finally:
             self.cleanup_kernels()
+            self.flush_gist_saves()
+            self.notebook_manager.flush_registry()
+
+    def flush_gist_saves(self):
+        """give queued gist saves a chance to reach github before exiting"""
+        ghub = self.notebook_manager.ghub
+        if ghub is None:
+            return
+        self.log.info('Waiting for queued gist saves')
+        ghub.flush()
+        if not ghub.wait_for_save(timeout=60):
+            self.log.error('Gave up on queued gist saves: %s', ghub.all_save_status())
 
 
 #-----------------------------------------------------------------------------
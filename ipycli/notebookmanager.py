@@ -30,22 +30,47 @@ Authors:
 # Imports
 #-----------------------------------------------------------------------------
 
+import copy
 import datetime
+import hashlib
 import io
+import json
 import os
 import uuid
 import glob
 import itertools
 import os.path
+import threading
+import time
+import traceback
 import cPickle as pickle
+from multiprocessing.pool import ThreadPool
 
 from tornado import web
+from zmq.eventloop import ioloop
 
 from IPython.config.configurable import LoggingConfigurable
 from IPython.nbformat import current
-from IPython.utils.traitlets import Unicode, List, Dict, Bool, TraitError
+from IPython.nbformat.v3.nbjson import BytesEncoder
+from IPython.utils.traitlets import Unicode, List, Dict, Bool, Integer, Enum, TraitError
 
 from .folder_backend import *
+from .save_coordinator import SaveCoordinator
+from .nbcache import NotebookCache, notebook_view
+from .nbregistry import (NotebookRegistry, RegistryStore, id_view, path_view,
+                         rev_view)
+from .nbcodecs import CODECS, for_path, notebook_name, read_notebook
+from .nbpaging import NotebookPages, UnsupportedNotebook, page_info
+from .search import SearchIndex, notebook_text
+
+try:
+    from .gist_backend import GistUnavailable
+except ImportError:
+    # no PyGithub, no gists
+    GistUnavailable = None
+
+# seconds between writes of new notebook ids to the registry store
+REGISTRY_FLUSH_INTERVAL = 5
 
 def unique_everseen(iterable, key=None):
     from itertools import ifilterfalse
@@ -65,6 +90,29 @@ def unique_everseen(iterable, key=None):
                 seen_add(k)
                 yield element
 
+def _canonical(obj):
+    # dicts as their sorted items, so the C encoder can write them. The
+    # markers keep a dict from hashing like a list.
+    if isinstance(obj, dict):
+        items = ['{']
+        for key in sorted(obj):
+            items.append(key)
+            items.append(_canonical(obj[key]))
+        return items
+    if isinstance(obj, list):
+        return ['['] + [_canonical(value) for value in obj]
+    return obj
+
+def notebook_hash(nb):
+    """
+        Hash of a notebook's canonical json. Keys are sorted so equal
+        notebooks hash the same however they were built.
+    """
+    data = json.dumps(_canonical(nb), cls=BytesEncoder, separators=(',', ':'))
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
 
 #-----------------------------------------------------------------------------
 # Classes
@@ -95,16 +143,58 @@ class NotebookManager(LoggingConfigurable):
         """
     )
     
+    save_workers = Integer(2, config=True,
+        help="""Number of threads writing notebook saves. Saves of the same
+        notebook run one at a time and queued saves collapse to the latest."""
+    )
+
+    save_fsync = Enum(FSYNC_POLICIES, 'file', config=True,
+        help="""When notebook saves to disk are fsynced: 'never', 'file' (the
+        written file, before it replaces the old one) or 'always' (the dir
+        too, so the replace itself is durable)."""
+    )
+
+    blob_threshold = Integer(0, config=True,
+        help="""Save outputs of at least this many characters once, to a blob
+        store in a .ipynb_blobs dir in the notebook dir, and refer to them
+        from the notebook. 0 keeps all outputs inline. Unreferenced blobs
+        are removed by `python -m ipycli.blobstore gc <dir>`."""
+    )
+
+    notebook_codec = Enum(sorted(CODECS), 'json', config=True,
+        help="""How notebooks are stored: 'json' (indented), 'compact', or
+        compressed 'gzip' (.ipynb.gz) and 'xz' (.ipynb.xz, needs lzma). New
+        notebooks get the codec, existing ones keep their compression.
+        Every codec is read in any dir."""
+    )
+
+    dir_codecs = Dict(config=True,
+        help="""notebook_codec for particular notebook dirs, by path."""
+    )
+
+    notebook_cache_entries = Integer(128, config=True,
+        help="""Number of parsed notebooks kept in memory for reads."""
+    )
+
+    notebook_cache_bytes = Integer(64 * 1024 * 1024, config=True,
+        help="""Limit on the total file size of the parsed notebooks kept in
+        memory for reads."""
+    )
+
+    watch_dirs = Bool(True, config=True,
+        help="""Watch notebook dirs for changes (inotify, or polling when
+        pyinotify isn't installed) instead of rescanning them on every
+        listing."""
+    )
+
+    watch_interval = Integer(5, config=True,
+        help="""Seconds between polls of the notebook dirs when watching
+        without inotify."""
+    )
+
     filename_ext = Unicode(u'.ipynb')
     allowed_formats = List([u'json',u'py'])
 
-    # Map notebook_ids to notebook names
-    mapping = Dict()
-    # Map notebook names to notebook_ids
-    rev_mapping = Dict()
-    # path mapping
-    path_mapping = Dict()
-
     # all_mapping is a dict of lists. key being the dir
     all_mapping = Dict()
     # pathed notebooks
@@ -115,37 +205,409 @@ class NotebookManager(LoggingConfigurable):
         super(NotebookManager, self).__init__(*args, **kwargs)
 
         self.ghub = None
+        self.save_coordinator = SaveCoordinator(workers=self.save_workers,
+                                                log=self.log)
+        # notebook_id -> (path, hash) of the last version persisted
+        self.saved_hashes = {}
+        self.hash_lock = threading.Lock()
+        self.writes_performed = 0
+        self.writes_skipped = 0
+        # notebook_id -> timings of its last disk save
+        self.save_timings = {}
+        # shared with the gist cache
+        self.nbcache = NotebookCache(max_entries=self.notebook_cache_entries,
+                                     max_bytes=self.notebook_cache_bytes)
+        # every notebook_id handed out, see nbregistry
+        self.registry = NotebookRegistry()
+        # see load_registry
+        self.registry_store = None
+        self._stored_projects = None
+        # (project path, kind) -> stored ids whose project isn't loaded yet
+        self._unrestored = {}
         self.notebook_dirs = {}
         self.gist_projects = []
+        self.watcher = None
+        # see start_search
+        self.search_index = None
+        self.search_pool = None
         self.add_notebook_dir(self.notebook_dir)
 
-    def add_notebook_dir(self, dir):
+    @property
+    def mapping(self):
+        """notebook_id -> NBObject"""
+        return id_view(self.registry)
+
+    @property
+    def path_mapping(self):
+        """notebook_id -> path"""
+        return path_view(self.registry)
+
+    @property
+    def rev_mapping(self):
+        """path -> notebook_id"""
+        return rev_view(self.registry)
+
+    def add_notebook_dir(self, dir, recursive=False):
+        """
+            recursive projects list the notebooks in the whole tree
+            under dir
+        """
         dir = os.path.abspath(dir)
         project = self.notebook_dirs.get(dir, None)
         if project is None:
-            project = DirectoryProject(dir, self.filename_ext)
+            project = DirectoryProject(dir, self.filename_ext,
+                                       recursive=recursive, log=self.log)
+            project.fsync = self.save_fsync
+            project.nbcache = self.nbcache
+            project.codec = self._dir_codec(dir)
+            if self.blob_threshold:
+                project.blob_threshold = self.blob_threshold
+            project.blobs.fsync = self.save_fsync != 'never'
             self.notebook_dirs[dir] = project
+            if self.watcher is not None:
+                self._watch(project)
+            self._search_async(self._reindex_project, project)
+        return project
+
+    def _dir_codec(self, dir):
+        for path, codec in self.dir_codecs.items():
+            path = os.path.abspath(os.path.expanduser(path))
+            if path == dir:
+                if codec not in CODECS:
+                    raise TraitError("Unknown notebook codec %r for %s" % (codec, dir))
+                return codec
+        return self.notebook_codec
+
+    def load_registry(self, db):
+        """
+            Restore the notebook ids, projects and pathed notebooks kept
+            in the sqlite file db by an earlier run, and keep it up to
+            date from now on. Dir projects serve the restored listing
+            until they are rescanned in the background. Gist ids are
+            restored once load_gist_projects has the gist projects.
+        """
+        if self.registry_store is not None:
+            return
+        store = RegistryStore(db)
+        for dir, recursive in store.projects():
+            if os.path.isdir(dir):
+                self.add_notebook_dir(dir, recursive=recursive)
+        self.pathed_notebooks.update(store.pathed())
+
+        for notebook_id, path, project_path, kind, mtime in store.notebooks():
+            entries = self._unrestored.setdefault((project_path, kind), [])
+            entries.append((notebook_id, path, mtime))
+        restored = self._restore_ids()
+        self.log.info("Restored %d notebook ids from %s", restored, db)
+
+        self.registry_store = store
+        self.registry.track_changes = True
+        self._reconcile_projects()
+        ioloop.PeriodicCallback(self.flush_registry, REGISTRY_FLUSH_INTERVAL * 1000).start()
+
+    def _restore_ids(self):
+        """
+            Register the stored ids of the projects that are loaded now,
+            returns how many were
+        """
+        restored = 0
+        for (project_path, kind), entries in self._unrestored.items():
+            project = self.backend_by_path(project_path)
+            if project is None:
+                continue
+            del self._unrestored[(project_path, kind)]
+            if kind == 'dir':
+                files = [(path, datetime.datetime.fromtimestamp(mtime or 0))
+                         for _, path, mtime in entries]
+                if not project.seed(files):
+                    # already listed, the listing is newer
+                    continue
+            nbos = dict((nbo.path, nbo) for nbo in project.notebooks())
+            for notebook_id, path, _ in entries:
+                if path in nbos and self.registry.by_path(path) is None:
+                    self.set_notebook_path(notebook_id, nbos[path])
+                    restored += 1
+        return restored
+
+    def _reconcile_projects(self):
+        """
+            Rescan the seeded dir projects in the background
+        """
+        projects = [project for project in self.notebook_dirs.values()
+                    if project.seeded]
+        if not projects:
+            return
+        loop = ioloop.IOLoop.instance()
+        def rescan():
+            # only the listing happens off the IOLoop, like the gist relist
+            for project in projects:
+                started = time.time()
+                try:
+                    files, dirs = project.list_files()
+                except Exception:
+                    self.log.error("Could not rescan %s\n%s", project.dir,
+                                   traceback.format_exc())
+                    # drop the restored listing, the next one scans
+                    loop.add_callback(lambda project=project:
+                                      self._drop_seeded(project))
+                    continue
+                loop.add_callback(lambda project=project, files=files, dirs=dirs:
+                                  self._apply_rescan(project, files, dirs, started))
+        t = threading.Thread(target=rescan)
+        t.daemon = True
+        t.start()
+
+    def _drop_seeded(self, project):
+        if project.seeded:
+            project.seeded = False
+            project.invalidate()
+
+    def _apply_rescan(self, project, files, dirs, started):
+        project.apply_listing(files, dirs, started)
+        self._evict_missing(project, project.notebooks())
+        self._search_async(self._reindex_project, project)
+
+    def flush_registry(self):
+        """
+            Write the ids handed out or dropped since the last flush to
+            the registry store. Ids are derived from paths, so losing the
+            last few to a crash only costs a rescan.
+        """
+        if self.registry_store is None:
+            return
+        changed, removed = self.registry.take_changes()
+        rows = [self._registry_row(record) for record in changed.values()]
+        projects = sorted((project.dir, project.recursive)
+                          for project in self.notebook_dirs.values())
+        pathed = dict(self.pathed_notebooks)
+        if (projects, pathed) == self._stored_projects:
+            if not rows and not removed:
+                return
+            self.registry_store.write(rows, removed)
+        else:
+            self.registry_store.write(rows, removed, projects, pathed)
+            self._stored_projects = (projects, pathed)
+
+    def _registry_row(self, record):
+        mtime = None
+        kind = 'gist'
+        if isinstance(record.nbo.backend, DirectoryProject):
+            kind = 'dir'
+            if record.nbo.mtime is not None:
+                # to the microsecond, search versions are the exact mtime
+                mtime = (time.mktime(record.nbo.mtime.timetuple())
+                         + record.nbo.mtime.microsecond / 1e6)
+        return (record.notebook_id, record.path, record.project, kind, mtime)
+
+    def start_watching(self):
+        """
+            Keep the dir listings up to date from a watcher. Needs the
+            IOLoop the watcher delivers events on.
+        """
+        if not self.watch_dirs or self.watcher is not None:
+            return
+        from .dir_watcher import make_watcher
+        self.watcher = make_watcher(self._on_dir_event, self.filename_ext,
+                                    interval=self.watch_interval)
+        for project in self.notebook_dirs.values():
+            self._watch(project)
+
+    def _watch(self, project):
+        self.watcher.watch(project.dir, recursive=project.recursive)
+        # prime the index, events are applied to it from now on
+        project.notebooks()
+        project.watched = True
+
+    def tree_project(self, dir):
+        """
+            The project listing dir, either its own or a recursive
+            project above it
+        """
+        project = self.notebook_dirs.get(dir)
+        while project is None:
+            parent = os.path.dirname(dir)
+            if parent == dir:
+                return None
+            dir = parent
+            project = self.notebook_dirs.get(dir)
+            if project is not None and not project.recursive:
+                return None
         return project
 
+    def _on_dir_event(self, dir, event, path):
+        # events from recursive watches come from the subdir
+        project = self.tree_project(dir)
+        if project is None:
+            return
+        nbo = project.apply_event(event, path)
+        # a notebook renamed through us has already moved on to its new path
+        record = self.registry.by_path(path)
+        if nbo is not None:
+            if record is None:
+                self.new_notebook_id(nbo, backend=project)
+            self._search_async(self._index_file, nbo)
+            return
+        self._search_async(self._unindex, path)
+        if record is not None:
+            self.delete_notebook_id(record.notebook_id)
+
+    def start_search(self, db=':memory:'):
+        """
+            Keep a full-text index of the notebooks in the sqlite file db,
+            see search_notebooks. Notebooks changed since they were last
+            indexed are read in the background.
+        """
+        if self.search_index is not None:
+            return
+        self.search_index = SearchIndex(db)
+        # one thread, so updates to the index land in order
+        self.search_pool = ThreadPool(1)
+        for project in list(self.notebook_projects):
+            self._search_async(self._reindex_project, project)
+
+    def _search_async(self, func, *args):
+        if self.search_index is None:
+            return
+        def run():
+            try:
+                func(*args)
+            except Exception:
+                self.log.error("Search index update failed\n%s",
+                               traceback.format_exc())
+        self.search_pool.apply_async(run)
+
+    def _index_notebook(self, nbo, nb, version):
+        self.search_index.update(nbo.path, nbo.backend.path, nbo.name,
+                                 nbo.tags, version, notebook_text(nb))
+
+    def _index_file(self, nbo):
+        version = unicode(nbo.mtime)
+        if self.search_index.version(nbo.path) == version:
+            return
+        # straight from disk, indexing shouldn't churn the notebook cache
+        self._index_notebook(nbo, read_notebook(nbo.path), version)
+
+    def _unindex(self, path):
+        self.search_index.remove(path)
+
+    def _reindex_project(self, project):
+        indexed = self.search_index.paths(project.path)
+        listed = set()
+        for nbo in project.notebooks():
+            listed.add(nbo.path)
+            if isinstance(project, DirectoryProject):
+                self._index_file(nbo)
+            elif nbo.path not in indexed:
+                # reading every gist costs an api call each, their
+                # content is indexed as they are read or saved
+                self.search_index.update(nbo.path, project.path, nbo.name,
+                                         nbo.tags, None)
+        if isinstance(project, DirectoryProject):
+            for path in indexed - listed:
+                self.search_index.remove(path)
+
+    def _index_saved(self, notebook_id, nb):
+        """
+            Index a notebook just written, on the thread that wrote it
+        """
+        if self.search_index is None:
+            return
+        # the id can be gone by the time the write finished
+        record = self.registry.get(notebook_id)
+        if record is None:
+            return
+        nbo = record.nbo
+        version = None
+        if isinstance(nbo.backend, DirectoryProject):
+            version = unicode(nbo.mtime)
+        try:
+            self._index_notebook(nbo, nb, version)
+        except Exception:
+            self.log.error("Search index update failed\n%s",
+                           traceback.format_exc())
+
+    def _index_read(self, nbo, nb, last_modified):
+        if self.search_index is None:
+            return
+        version = unicode(last_modified)
+        if self.search_index.version(nbo.path) == version:
+            return
+        # the caller is free to change nb once we return
+        self._search_async(self._index_notebook, nbo, copy.deepcopy(nb), version)
+
+    def search_notebooks(self, q, offset=0, limit=20):
+        """
+            Notebooks matching every word of q, best match first
+        """
+        if self.search_index is None:
+            raise web.HTTPError(503, u'Search is not enabled')
+        total, rows = self.search_index.search(q, offset=offset, limit=limit)
+        results = []
+        for path, project_path, name, snippet in rows:
+            notebook_id = self._search_result_id(path, project_path)
+            if notebook_id is None:
+                continue
+            results.append({'notebook_id': notebook_id, 'name': name,
+                            'path': path, 'project': project_path,
+                            'snippet': snippet})
+        return {'query': q, 'total': total, 'offset': offset,
+                'results': results}
+
+    def _search_result_id(self, path, project_path):
+        notebook_id = self.rev_mapping.get(path)
+        if notebook_id is not None:
+            return notebook_id
+        project = self.backend_by_path(project_path)
+        if project is not None:
+            for nbo in project.notebooks():
+                if nbo.path == path:
+                    return self.new_notebook_id(nbo, backend=project)
+        if project is None or isinstance(project, DirectoryProject):
+            # gone since it was indexed
+            self._search_async(self._unindex, path)
+        return None
+
     @property
     def notebook_projects(self):
         return itertools.chain(self.notebook_dirs.values(), self.gist_projects)
 
     def tagged_notebooks(self, tag):
         """
-            List all notebooks in a dict
+            List the notebooks for a tag. Tags joined with + list the
+            notebooks that have all of them, e.g. quant+test
         """
-        self.refresh_notebooks()
+        if not self.ghub:
+            return []
+
+        tags = ['#' + t for t in tag.split('+') if t]
+        if not tags:
+            return []
+        backend = self.ghub.tag_project(tags[0])
+        if backend is None:
+            return []
+
+        ids = None
+        if len(tags) > 1:
+            ids = self.ghub.tagged_gist_ids(*tags)
+        notebooks = backend.notebooks(ids=ids)
+        return self.output_notebooks(notebooks, sort=False)
 
-        notebooks = []
-        tag = '#' + tag
-        for backend in self.gist_projects:
-            if not hasattr(backend, 'tag'):
+    def prefetch_notebooks(self, notebook_ids):
+        """
+            Warm the gist cache for the most recently updated gist
+            notebooks among notebook_ids
+        """
+        if not self.ghub:
+            return
+        gists = []
+        for notebook_id in notebook_ids:
+            nbo = self.mapping.get(notebook_id)
+            if nbo is None:
                 continue
-            if backend.tag == tag:
-                notebooks = backend.notebooks()
-
-        return self.output_notebooks(notebooks, sort=False)
+            gist_for_path = getattr(nbo.backend, 'gist_for_path', None)
+            if gist_for_path is not None:
+                gists.append(gist_for_path(nbo.path))
+        self.ghub.prefetch(gists)
 
     def dir_notebooks(self, dir):
         """
@@ -154,12 +616,21 @@ class NotebookManager(LoggingConfigurable):
         self.refresh_notebooks(skip_github=True)
 
         backend_matches = []
+        tree = None
         for backend in self.notebook_dirs.values():
             # add all subdirs as well
             if backend.path.startswith(dir):
                 backend_matches.append(backend)
+            elif backend.recursive and dir.startswith(backend.path + os.sep):
+                tree = backend
 
         notebooks = itertools.chain(*[backend.notebooks() for backend in backend_matches])
+        if tree is not None:
+            # the part of a recursive project under dir
+            prefix = dir.rstrip(os.sep) + os.sep
+            inside = [nbo for nbo in tree.notebooks()
+                      if nbo.path.startswith(prefix)]
+            notebooks = itertools.chain(notebooks, inside)
         return self.output_notebooks(notebooks, sort=False)
 
     def list_notebooks(self):
@@ -173,6 +644,7 @@ class NotebookManager(LoggingConfigurable):
 
         for backend in self.notebook_projects:
             nbs = backend.notebooks()
+            self._evict_missing(backend, nbs)
             if hasattr(backend, 'tag') and backend.tag == '#transient':
                 transients = nbs
             else:
@@ -217,10 +689,11 @@ class NotebookManager(LoggingConfigurable):
     def output_notebooks(self, notebooks, sort=True):
         data = []
         for nb in notebooks:
-            if nb not in self.rev_mapping:
+            record = self.registry.by_path(nb.path)
+            if record is None:
                 notebook_id = self.new_notebook_id(nb)
             else:
-                notebook_id = self.rev_mapping[nb]
+                notebook_id = record.notebook_id
             nbdict = dict(notebook_id=notebook_id,path=nb.path, name=nb.name)
             nbdict['mtime'] = ''
             if nb.mtime:
@@ -239,6 +712,55 @@ class NotebookManager(LoggingConfigurable):
         for backend in self.notebook_projects:
             nbs = backend.notebooks()
             self.all_mapping[backend] = nbs
+            self._evict_missing(backend, nbs)
+
+    def _evict_missing(self, project, nbs):
+        """
+            Drop the ids of the notebooks of a dir project that aren't in
+            its listing nbs anymore. Gists move between projects, their
+            ids stay, and so do those of a listing cut at max_entries.
+        """
+        if not isinstance(project, DirectoryProject) or project.truncated:
+            return
+        paths = set(nbo.path for nbo in nbs)
+        for record in self.registry.evict_missing(project.path, paths):
+            self._forget_notebook_id(record.notebook_id)
+
+    def load_gist_projects(self):
+        """
+            Initial gist load. Serve the projects from the local gist
+            mirror right away and relist from github in the background.
+        """
+        projects = self.ghub.get_gist_projects(cached=True)
+        if not projects:
+            self.refresh_notebooks(skip_github=False)
+            self._restore_ids()
+            return
+
+        self.gist_projects = projects
+        self._restore_ids()
+        self.refresh_notebooks()
+
+        loop = ioloop.IOLoop.instance()
+        def relist():
+            # only the network call happens off the IOLoop. The projects
+            # are patched on the IOLoop where they are read
+            try:
+                gists = self.ghub.list_gists()
+            except Exception as e:
+                self.log.error("Could not list gists: %s", e)
+                return
+            loop.add_callback(lambda: self._apply_gist_listing(gists))
+        t = threading.Thread(target=relist)
+        t.daemon = True
+        t.start()
+
+    def _apply_gist_listing(self, gists):
+        self.gist_projects = self.ghub.apply_gists(gists, full=True)
+        self._restore_ids()
+        self.refresh_notebooks()
+        for project in self.gist_projects:
+            self._search_async(self._reindex_project, project)
 
     def pathed_notebook_list(self):
         self.verify_pathed_files()
@@ -303,44 +825,37 @@ class NotebookManager(LoggingConfigurable):
         return notebook_id
 
     def set_notebook_path(self, notebook_id, nb):
-        filepath = nb.path
-        self.path_mapping[notebook_id] = filepath
-        self.mapping[notebook_id] = nb
-        self.rev_mapping[filepath] = notebook_id
+        self.registry.add(notebook_id, nb)
 
     def delete_notebook_id(self, notebook_id):
         """Delete a notebook's id only. This doesn't delete the actual notebook."""
-        path = self.path_mapping[notebook_id]
-        del self.mapping[notebook_id]
-        del self.path_mapping[notebook_id]
-        del self.rev_mapping[path]
+        if self.registry.remove(notebook_id) is None:
+            raise KeyError(notebook_id)
+        self._forget_notebook_id(notebook_id)
+
+    def _forget_notebook_id(self, notebook_id):
+        self.forget_hash(notebook_id)
+        with self.hash_lock:
+            self.save_timings.pop(notebook_id, None)
 
     def notebook_exists(self, notebook_id):
         """Does a notebook exist?"""
-        if notebook_id not in self.mapping:
+        record = self.registry.get(notebook_id)
+        if record is None:
             return False
-        nb = self.mapping[notebook_id]
-        return nb.backend.exists(notebook_id)
+        return record.nbo.backend.exists(notebook_id)
 
     def find_path(self, notebook_id):
         """Return a full path to a notebook given its notebook_id."""
-        # first try path mapping
-        try:
-            path = self.path_mapping[notebook_id]
-            return path
-        except:
-            pass
-
-        try:
-            name = self.mapping[notebook_id]
-        except KeyError:
+        record = self.registry.get(notebook_id)
+        if record is None:
             raise web.HTTPError(404, u'Notebook does not exist: %s' % notebook_id)
-        return self.get_path_by_name(name)
+        return record.path
 
     def get_path_by_name(self, name):
         """Return a full path to a notebook given its name."""
         # check if we are already a full path
-        if name in self.path_mapping.values():
+        if self.registry.by_path(name) is not None:
             return name
         filename = name + self.filename_ext
         path = os.path.join(self.notebook_dir, filename)
@@ -361,22 +876,78 @@ class NotebookManager(LoggingConfigurable):
         name = nb.get('name','notebook')
         return last_modified, name, data
 
+    def get_notebook_pages(self, notebook_id):
+        """
+            Returns (last_modified, pages) for paged reads, see nbpaging.
+            Backends that can index their files page from them, others
+            from the parsed notebook.
+        """
+        if notebook_id not in self.mapping:
+            raise web.HTTPError(404, u'Notebook does not exist: %s' % notebook_id)
+        nbo = self.mapping[notebook_id]
+        backend = nbo.backend
+        if hasattr(backend, 'notebook_pages'):
+            try:
+                return backend.notebook_pages(nbo.path)
+            except UnsupportedNotebook:
+                # older nbformat, page the converted notebook
+                pass
+        last_modified, nb = self.get_notebook_object(notebook_id)
+        return last_modified, NotebookPages(nb)
+
+    def get_notebook_skeleton(self, notebook_id):
+        """
+            The notebook with its outputs replaced by stubs, as json
+        """
+        last_modified, pages = self.get_notebook_pages(notebook_id)
+        nb = page_info(pages)
+        # Always use the filename as the notebook name.
+        path = self.mapping[notebook_id].path
+        name = notebook_name(path, self.filename_ext)
+        nb.metadata.name = name
+        data = current.writes(nb, u'json', split_lines=False)
+        return last_modified, name, data
+
+    def get_notebook_cells(self, notebook_id, start, stop):
+        """
+            Full cells start to stop of a notebook, as json
+        """
+        last_modified, pages = self.get_notebook_pages(notebook_id)
+        cells = pages.cells(start, stop)
+        data = json.dumps({'start': start, 'cells': cells}, cls=BytesEncoder)
+        return last_modified, data
+
     def get_notebook_object(self, notebook_id):
         """Get the NotebookNode representation of a notebook by notebook_id."""
         nb = self.mapping[notebook_id]
         backend = nb.backend
+        # before reading, a file changed meanwhile won't match it later
+        identity = self._file_identity(notebook_id, nb.path)
         try:
-            return backend.get_notebook_object(nb.path)
+            last_modified, nbo = backend.get_notebook_object(nb.path)
+        except web.HTTPError:
+            raise
         except Exception as e:
+            if GistUnavailable is not None and isinstance(e, GistUnavailable):
+                raise web.HTTPError(503, u'Notebook is unavailable: %s, Err:%s' % (notebook_id, str(e)))
             raise web.HTTPError(404, u'Notebook does not exist: %s, Err:%s' % (notebook_id, str(e)))
+        # what's stored is what we'd write back unchanged. Hashed by the
+        # next save, off the IOLoop. A view, so it shares the cells with
+        # the caller and the notebook cache, see NotebookCache.get
+        self._set_hash(notebook_id, nb.path, identity, notebook_view(nbo))
+        if not isinstance(backend, DirectoryProject):
+            # dirs are indexed from their listings, gists when read
+            self._index_read(nb, nbo, last_modified)
+        return last_modified, nbo
 
     def backend_by_path(self, path):
         """
             path is project path which is unique to each project
         """
-        for p in self.notebook_projects:
-            if p == path:
-                return p
+        project = self.notebook_dirs.get(path)
+        if project is None and self.ghub is not None:
+            project = self.ghub.project_by_path(path)
+        return project
 
     def backend_by_notebook_id(self, notebook_id):
         nbo = self.mapping[notebook_id]
@@ -412,64 +983,196 @@ class NotebookManager(LoggingConfigurable):
         self.save_notebook_object(notebook_id, nb)
         return notebook_id
 
-    def save_notebook(self, notebook_id, data, name=None, format=u'json'):
-        """Save an existing notebook by notebook_id."""
+    def _check_save(self, notebook_id, format):
         if format not in self.allowed_formats:
             raise web.HTTPError(415, u'Invalid notebook format: %s' % format)
+        if notebook_id not in self.mapping:
+            raise web.HTTPError(404, u'Notebook does not exist: %s' % notebook_id)
 
+    def _parse_notebook(self, data, format):
         try:
-            nb = current.reads(data.decode('utf-8'), format)
+            return current.reads(data.decode('utf-8'), format)
         except:
             raise web.HTTPError(400, u'Invalid JSON data')
 
-        if name is not None:
-            nb.metadata.name = name
-        self.save_notebook_object(notebook_id, nb)
+    def _coordinate_save(self, notebook_id, write, callback=None, flush=None):
+        """
+            Run write through the save coordinator. Without a callback we
+            block until the save is written. With one, callback(error)
+            is called on the IOLoop once it is. flush runs after the
+            write that covers this save, see SaveCoordinator.
+        """
+        if callback is None:
+            return self.save_coordinator.save(notebook_id, write, flush)
+
+        loop = ioloop.IOLoop.instance()
+        def done(error):
+            loop.add_callback(lambda: callback(error))
+        self.save_coordinator.submit(notebook_id, write, done, flush)
+
+    def save_stats(self):
+        stats = self.save_coordinator.stats()
+        stats['writes_performed'] = self.writes_performed
+        stats['writes_skipped'] = self.writes_skipped
+        with self.hash_lock:
+            timings = dict(self.save_timings)
+        for notebook_id, counts in stats['notebooks'].items():
+            if notebook_id in timings:
+                counts['timings'] = timings[notebook_id]
+        stats['notebook_cache'] = self.nbcache.stats()
+        return stats
+
+    def _record_timings(self, notebook_id, timings):
+        """
+            Keep the timings a backend returned for a save
+        """
+        if not timings:
+            return
+        with self.hash_lock:
+            self.save_timings[notebook_id] = timings
+        self.log.debug("saved %s: %d bytes, serialize %.1fms, write %.1fms, "
+                       "fsync %.1fms", notebook_id, timings['bytes'],
+                       timings['serialize'] * 1000, timings['write'] * 1000,
+                       timings['fsync'] * 1000)
+
+    def github_stats(self):
+        if not self.ghub:
+            return {}
+        return self.ghub.api_stats()
+
+    def _set_hash(self, notebook_id, path, identity, digest):
+        """
+            identity is _file_identity of path. digest can be the
+            notebook itself, hashed when it's needed
+        """
+        with self.hash_lock:
+            self.saved_hashes[notebook_id] = (path, identity, digest)
+
+    def _saved_hash(self, notebook_id):
+        """
+            (path, identity, digest) last read or written, or None
+        """
+        with self.hash_lock:
+            saved = self.saved_hashes.get(notebook_id)
+        if saved is None or isinstance(saved[2], basestring):
+            return saved
+        path, identity, digest = saved[0], saved[1], notebook_hash(saved[2])
+        with self.hash_lock:
+            # unless a save replaced it meanwhile
+            if self.saved_hashes.get(notebook_id) is saved:
+                self.saved_hashes[notebook_id] = (path, identity, digest)
+        return path, identity, digest
+
+    def _file_identity(self, notebook_id, path):
+        """
+            (st_ino, st_mtime, st_size) of a dir notebook's file, so a
+            file replaced or changed on disk isn't mistaken for what we
+            hashed. False when the file is gone, None for gists.
+        """
+        record = self.registry.get(notebook_id)
+        if record is None or not isinstance(record.nbo.backend, DirectoryProject):
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def forget_hash(self, notebook_id):
+        with self.hash_lock:
+            self.saved_hashes.pop(notebook_id, None)
+
+    def _write_notebook(self, notebook_id, nb, path, write):
+        """
+            Call write() unless nb is what we last persisted to path,
+            and the file is still the one we read or wrote.
+        """
+        digest = notebook_hash(nb)
+        identity = self._file_identity(notebook_id, path)
+        if identity is not False and \
+                self._saved_hash(notebook_id) == (path, identity, digest):
+            with self.hash_lock:
+                self.writes_skipped += 1
+            return False
+
+        # forget the old hash so a failed write isn't skipped next time
+        self.forget_hash(notebook_id)
+        write()
+        identity = self._file_identity(notebook_id, path)
+        with self.hash_lock:
+            self.saved_hashes[notebook_id] = (path, identity, digest)
+            self.writes_performed += 1
+        self._index_saved(notebook_id, nb)
+        return True
+
+    def save_notebook(self, notebook_id, data, name=None, format=u'json',
+                      callback=None):
+        """Save an existing notebook by notebook_id."""
+        self._check_save(notebook_id, format)
+
+        def write():
+            # only parsed if this save isn't replaced by a newer one
+            nb = self._parse_notebook(data, format)
+            if name is not None:
+                nb.metadata.name = name
+            self.save_notebook_object(notebook_id, nb)
+
+        def flush():
+            # an explicit save pushes anything an autosave left journaled,
+            # also when a later autosave replaced its write
+            backend = self.mapping[notebook_id].backend
+            if hasattr(backend, 'flush_notebook'):
+                backend.flush_notebook(self.find_path(notebook_id))
+        self._coordinate_save(notebook_id, write, callback, flush)
 
     def restore_notebook(self, notebook_id):
         pass
 
-    def autosave_notebook(self, notebook_id, data, client_id, name=None, format=u'json'):
+    def autosave_notebook(self, notebook_id, data, client_id, name=None,
+                          format=u'json', callback=None):
         """Save an existing notebook by notebook_id."""
-        if format not in self.allowed_formats:
-            raise web.HTTPError(415, u'Invalid notebook format: %s' % format)
-
-        try:
-            nb = current.reads(data.decode('utf-8'), format)
-        except:
-            raise web.HTTPError(400, u'Invalid JSON data')
+        self._check_save(notebook_id, format)
 
-        nbo = self.mapping[notebook_id]
-        backend = nbo.backend
-        backend.autosave_notebook(nb, nbo, client_id)
+        def write():
+            nb = self._parse_notebook(data, format)
+            nbo = self.mapping[notebook_id]
+            backend = nbo.backend
+            self._write_notebook(notebook_id, nb, nbo.path,
+                    lambda: self._record_timings(notebook_id,
+                        backend.autosave_notebook(nb, nbo, client_id)))
+        self._coordinate_save(notebook_id, write, callback)
 
     def rename_notebook(self, notebook_id, data, name=None, format=u'json'):
         """ Separate out rename """
-        if format not in self.allowed_formats:
-            raise web.HTTPError(415, u'Invalid notebook format: %s' % format)
-
-        try:
-            nb = current.reads(data.decode('utf-8'), format)
-        except:
-            raise web.HTTPError(400, u'Invalid JSON data')
-
-        if name is not None:
-            nb.metadata.name = name
-
+        self._check_save(notebook_id, format)
+
+        def write():
+            nb = self._parse_notebook(data, format)
+            if name is not None:
+                nb.metadata.name = name
+            self._rename_notebook(notebook_id, nb)
+        # renames replace any queued save, they carry the latest content
+        self._coordinate_save(notebook_id, write)
+
+    def _rename_notebook(self, notebook_id, nb):
+        self.forget_hash(notebook_id)
         old_path = self.find_path(notebook_id)
         nbo = self.mapping[notebook_id]
         backend = nbo.backend
 
         # shortcircuit
         if hasattr(backend, 'rename_notebook'):
-            return backend.rename_notebook(nb, old_path)
+            ret = backend.rename_notebook(nb, old_path)
+            self._index_saved(notebook_id, nb)
+            return ret
 
         # This is where the folder stuff lives
         # it's not under Folder.rename_notebook because
         # it interacts so much with NB Manager
         # Gist on other hand has a stable ID and not a path that 
         # can change
-        name = nb.metadata.name + self.filename_ext
+        # keeps its compression
+        name = nb.metadata.name + self.filename_ext + for_path(old_path).suffix
         new_path = os.path.join(backend.dir, name)
 
         nbo.path = new_path
@@ -480,6 +1183,7 @@ class NotebookManager(LoggingConfigurable):
         self.save_notebook_object(notebook_id, nb)
 
         backend.delete_notebook(old_path)
+        self._search_async(self._unindex, old_path)
 
     def save_notebook_object(self, notebook_id, nb, path=None):
         """Save an existing notebook object by notebook_id."""
@@ -492,16 +1196,50 @@ class NotebookManager(LoggingConfigurable):
             path = self.find_path(notebook_id)
 
         backend = nbo.backend
-        backend.save_notebook_object(nb, path)
+        self._write_notebook(notebook_id, nb, path,
+                lambda: self._record_timings(notebook_id,
+                    backend.save_notebook_object(nb, path)))
+
+    def save_status(self, notebook_id):
+        """
+            Status of queued background saves for a notebook. None for
+            backends that save synchronously.
+        """
+        if notebook_id not in self.mapping:
+            raise web.HTTPError(404, u'Notebook does not exist: %s' % notebook_id)
+        nbo = self.mapping[notebook_id]
+        backend = nbo.backend
+        if not hasattr(backend, 'save_status'):
+            return None
+        return backend.save_status(nbo.path)
+
+    def all_save_status(self):
+        """
+            Status of every notebook that went through a background save
+        """
+        if not self.ghub:
+            return {}
+        data = {}
+        for path, status in self.ghub.all_save_status().items():
+            notebook_id = self.rev_mapping.get(path)
+            if notebook_id is None:
+                continue
+            status['path'] = path
+            status['name'] = self.mapping[notebook_id].name
+            data[notebook_id] = status
+        return data
 
     def delete_notebook(self, notebook_id):
         """Delete notebook by notebook_id."""
         try:
             nbo = self.mapping[notebook_id]
             nbo.backend.delete_notebook(nbo.path)
-        except:
+        except Exception as e:
+            if GistUnavailable is not None and isinstance(e, GistUnavailable):
+                raise web.HTTPError(503, u'Notebook is unavailable: %s' % e)
             raise web.HTTPError(404, u'Notebook does not exist: ')
         self.delete_notebook_id(notebook_id)
+        self._search_async(self._unindex, nbo.path)
 
     def new_notebook_object(self, name):
         """
@@ -519,8 +1257,8 @@ class NotebookManager(LoggingConfigurable):
             path, name = backend.increment_filename(name)
 
         nb = self.new_notebook_object(name)
-        nbo = backend.new_notebook_object(path, public=public)
-        backend.save_notebook_object(nb, path=path)
+        # backends create the notebook with its content in one go
+        nbo = backend.new_notebook_object(path, public=public, nb=nb)
         notebook_id = self.new_notebook_id(nbo, backend=backend)
 
         return notebook_id
@@ -533,7 +1271,6 @@ class NotebookManager(LoggingConfigurable):
         name = nb.metadata.name + '-Copy'
         path, name = backend.increment_filename(name)
         nb.metadata.name = name
-        copy_nbo = backend.new_notebook_object(path)
+        copy_nbo = backend.new_notebook_object(path, nb=nb)
         notebook_id = self.new_notebook_id(copy_nbo)
-        self.save_notebook_object(notebook_id, nb)
         return notebook_id
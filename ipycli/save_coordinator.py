@@ -0,0 +1,126 @@
+"""
+    Per-notebook save coordination.
+
+    Several tabs and the autosave timer can send saves for the same
+    notebook back to back. Saves run on a few worker threads, one at a
+    time per notebook. Saves that queue up behind a running one collapse
+    to the latest (latest wins), and only that one is parsed and written.
+    Every caller is told when a save covering theirs has been written.
+    A save submitted with a flush has it run after the write that covers
+    it, even when a later save without one replaced its write.
+"""
+import threading
+import traceback
+from Queue import Queue
+
+class SaveJob(object):
+    def __init__(self, write, callback, flush=None):
+        self.write = write
+        self.callbacks = [callback]
+        self.flush = flush
+
+class SaveCoordinator(object):
+    def __init__(self, workers=2, log=None):
+        self.log = log
+        # key -> SaveJob waiting to run
+        self._jobs = {}
+        self._in_flight = set()
+        self._queue = Queue()
+        self._cond = threading.Condition()
+        self.performed = 0
+        self.elided = 0
+        # key -> {'performed': n, 'elided': n}, while key has saves
+        # queued or running
+        self.counts = {}
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name='nb-save-%d' % i)
+            t.daemon = True
+            t.start()
+
+    def submit(self, key, write, callback=None, flush=None):
+        """
+            Queue write() as the latest save for key. callback(error) is
+            called from a worker thread once write() or a later save for
+            key that replaced it has run. error is None on success.
+            flush() runs after that write succeeded.
+        """
+        with self._cond:
+            counts = self.counts.setdefault(key, {'performed': 0, 'elided': 0})
+            job = self._jobs.get(key)
+            if job is not None:
+                # not started yet, the new save replaces it
+                job.write = write
+                job.callbacks.append(callback)
+                # an explicit save's flush outlives its write
+                job.flush = flush or job.flush
+                self.elided += 1
+                counts['elided'] += 1
+                return
+            self._jobs[key] = SaveJob(write, callback, flush)
+            if key not in self._in_flight:
+                self._queue.put(key)
+
+    def save(self, key, write, flush=None):
+        """
+            Submit a save and block until it is written. Errors are
+            raised in the calling thread.
+        """
+        done = threading.Event()
+        result = []
+        def callback(error):
+            result.append(error)
+            done.set()
+        self.submit(key, write, callback, flush)
+        done.wait()
+        if result[0] is not None:
+            raise result[0]
+
+    def stats(self):
+        with self._cond:
+            return {'performed': self.performed, 'elided': self.elided,
+                    'notebooks': dict((k, dict(v)) for k, v in self.counts.items())}
+
+    def _worker(self):
+        while True:
+            key = self._queue.get()
+            with self._cond:
+                job = self._jobs.pop(key, None)
+                if job is None:
+                    continue
+                self._in_flight.add(key)
+
+            error = None
+            try:
+                job.write()
+                if job.flush is not None:
+                    job.flush()
+            except Exception as e:
+                error = e
+                if self.log:
+                    self.log.error("save failed for %s\n%s", key,
+                                   traceback.format_exc())
+
+            with self._cond:
+                if error is None:
+                    self.performed += 1
+                    self.counts[key]['performed'] += 1
+
+            # before the next save for key can start, so callers hear
+            # about saves in order
+            for callback in job.callbacks:
+                if callback is None:
+                    continue
+                try:
+                    callback(error)
+                except Exception:
+                    if self.log:
+                        self.log.error("save callback failed for %s\n%s", key,
+                                       traceback.format_exc())
+
+            with self._cond:
+                self._in_flight.discard(key)
+                # a newer save came in while we were writing
+                if key in self._jobs:
+                    self._queue.put(key)
+                else:
+                    self.counts.pop(key, None)
@@ -0,0 +1,149 @@
+"""
+    Full-text search over notebooks.
+
+    SearchIndex keeps notebook names, tags, markdown and code in an
+    sqlite FTS table, ranked with bm25 where sqlite has FTS5. Each
+    notebook is a row keyed by its path with the version it was indexed
+    at (its mtime, or updated_at for gists), so a rescan only reads the
+    notebooks that changed. NotebookManager updates the index from its
+    save, rename and delete paths and from dir watcher events.
+"""
+import re
+import sqlite3
+import threading
+
+# how much more a match counts in each column
+WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+TEXT_CELLS = ('markdown', 'heading', 'raw')
+
+def notebook_text(nb):
+    """
+        (markdown, code) of a notebook, the text of its cells joined
+    """
+    markdown, code = [], []
+    for ws in nb.get('worksheets', []):
+        for cell in ws.get('cells', []):
+            if cell.get('cell_type') == 'code':
+                code.append(cell.get('input') or u'')
+            elif cell.get('cell_type') in TEXT_CELLS:
+                markdown.append(cell.get('source') or u'')
+    return u'\n'.join(markdown), u'\n'.join(code)
+
+def fts_query(q):
+    """
+        FTS match expression for free text: every word has to match, the
+        last one as a prefix since it may still be being typed
+    """
+    words = re.findall(r'\w+', q.lower(), re.UNICODE)
+    if not words:
+        return None
+    words[-1] += '*'
+    return u' '.join(words)
+
+def _has_fts5(db):
+    try:
+        db.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(a)")
+    except sqlite3.OperationalError:
+        return False
+    db.execute("DROP TABLE temp.fts5_probe")
+    return True
+
+class SearchIndex(object):
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.fts5 = _has_fts5(self.db)
+        module = 'fts5' if self.fts5 else 'fts4'
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS docs ("
+                            "id INTEGER PRIMARY KEY, path TEXT UNIQUE, "
+                            "project TEXT, version TEXT)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS docs_project "
+                            "ON docs (project)")
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts "
+                            "USING %s(name, tags, markdown, code)" % module)
+
+    def version(self, path):
+        with self.lock:
+            row = self.db.execute("SELECT version FROM docs WHERE path = ?",
+                                  (path,)).fetchone()
+        return row[0] if row else None
+
+    def paths(self, project):
+        with self.lock:
+            rows = self.db.execute("SELECT path FROM docs WHERE project = ?",
+                                   (project,)).fetchall()
+        return set(row[0] for row in rows)
+
+    def update(self, path, project, name, tags, version, text=None):
+        """
+            Index a notebook. text is (markdown, code), None keeps what
+            was indexed before, for when only the name or tags are known.
+        """
+        tags = u' '.join(tags or [])
+        with self.lock:
+            with self.db:
+                row = self.db.execute("SELECT id FROM docs WHERE path = ?",
+                                      (path,)).fetchone()
+                if row is None:
+                    cursor = self.db.execute(
+                        "INSERT INTO docs (path, project, version) VALUES (?, ?, ?)",
+                        (path, project, version))
+                    doc_id = cursor.lastrowid
+                    if text is None:
+                        text = (u'', u'')
+                else:
+                    doc_id = row[0]
+                    if text is None:
+                        text = self.db.execute(
+                            "SELECT markdown, code FROM docs_fts WHERE rowid = ?",
+                            (doc_id,)).fetchone() or (u'', u'')
+                    self.db.execute("UPDATE docs SET project = ?, version = ? "
+                                    "WHERE id = ?", (project, version, doc_id))
+                    self.db.execute("DELETE FROM docs_fts WHERE rowid = ?",
+                                    (doc_id,))
+                self.db.execute("INSERT INTO docs_fts (rowid, name, tags, markdown, code) "
+                                "VALUES (?, ?, ?, ?, ?)",
+                                (doc_id, name, tags, text[0], text[1]))
+
+    def remove(self, path):
+        with self.lock:
+            with self.db:
+                row = self.db.execute("SELECT id FROM docs WHERE path = ?",
+                                      (path,)).fetchone()
+                if row is None:
+                    return
+                self.db.execute("DELETE FROM docs_fts WHERE rowid = ?", row)
+                self.db.execute("DELETE FROM docs WHERE id = ?", row)
+
+    def search(self, q, offset=0, limit=20):
+        """
+            Returns (total, [(path, project, name, snippet)]), best match
+            first
+        """
+        query = fts_query(q)
+        if query is None:
+            return 0, []
+        if self.fts5:
+            rank = "bm25(docs_fts, %s)" % ', '.join(str(w) for w in WEIGHTS)
+            snippet = "snippet(docs_fts, -1, '', '', '...', 12)"
+        else:
+            # no bm25, newest index updates first
+            rank = "docs.id DESC"
+            snippet = "snippet(docs_fts, '', '', '...', -1, 12)"
+        with self.lock:
+            total = self.db.execute("SELECT count(*) FROM docs_fts "
+                                    "WHERE docs_fts MATCH ?", (query,)).fetchone()[0]
+            rows = self.db.execute(
+                "SELECT docs.path, docs.project, docs_fts.name, %s "
+                "FROM docs_fts JOIN docs ON docs.id = docs_fts.rowid "
+                "WHERE docs_fts MATCH ? ORDER BY %s LIMIT ? OFFSET ?"
+                % (snippet, rank), (query, limit, offset)).fetchall()
+        return total, rows
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -50,6 +50,7 @@ var IPython = (function (IPython) {
             that.set_last_saved();
             that.update_notebook_name();
             that.update_document_title();
+            that.check_push_status();
         });
         $([IPython.events]).on('notebook_save_failed.Notebook', function () {
             that.set_save_status('Last Save Failed!');
@@ -142,6 +143,35 @@ var IPython = (function (IPython) {
     }
 
 
+    // gist saves are pushed in the background, poll until they land
+    SaveWidget.prototype.check_push_status = function () {
+        var that = this;
+        var notebook_id = IPython.notebook.get_notebook_id();
+        var url = $('body').data('baseProjectUrl') + 'save_status/' + notebook_id;
+        var settings = {
+            cache : false,
+            type : "GET",
+            dataType : "json",
+            success : function (data) {
+                if (!data) {
+                    return;
+                }
+                if (data.state == 'failed') {
+                    that.set_save_status('Push Failed!');
+                } else if (data.state == 'saved') {
+                    that.set_last_saved();
+                } else {
+                    that.set_save_status('Pushing...');
+                    setTimeout(function () {
+                        that.check_push_status();
+                    }, 2000);
+                }
+            }
+        };
+        $.ajax(url, settings);
+    };
+
+
     SaveWidget.prototype.set_last_saved = function () {
         var d = new Date();
         this.set_save_status('Last saved: '+d.format('mmm dd h:MM TT'));
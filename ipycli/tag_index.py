@@ -0,0 +1,86 @@
+"""
+    Tag index for gist notebooks.
+
+    Maps gist ids to the hashtags in their description and tags back to
+    gist ids. It is kept up to date from gist events (listing, create,
+    edit) so finding the gists for a tag never walks the gist list.
+"""
+
+def parse_tags(desc):
+    if not desc:
+        return frozenset()
+    return frozenset(tag for tag in desc.split(" ") if tag.startswith("#"))
+
+class TagIndex(object):
+    def __init__(self):
+        # id -> description the tags were parsed from
+        self._desc = {}
+        # id -> frozenset of tags
+        self._tags = {}
+        # tag -> set of ids
+        self._ids = {}
+
+    def __contains__(self, id):
+        return id in self._tags
+
+    def __len__(self):
+        return len(self._tags)
+
+    def update(self, id, desc):
+        """
+            Index a gist's description. Returns (old_tags, new_tags).
+        """
+        old = self._tags.get(id, frozenset())
+        if id in self._desc and self._desc[id] == desc:
+            return old, old
+
+        new = parse_tags(desc)
+        self._desc[id] = desc
+        self._tags[id] = new
+        for tag in old - new:
+            self._discard(tag, id)
+        for tag in new - old:
+            self._ids.setdefault(tag, set()).add(id)
+        return old, new
+
+    def remove(self, id):
+        """
+            Drop a gist. Returns the tags it had.
+        """
+        self._desc.pop(id, None)
+        old = self._tags.pop(id, frozenset())
+        for tag in old:
+            self._discard(tag, id)
+        return old
+
+    def _discard(self, tag, id):
+        ids = self._ids.get(tag)
+        if ids is None:
+            return
+        ids.discard(id)
+        if not ids:
+            del self._ids[tag]
+
+    def get_tags(self, id):
+        return self._tags.get(id, frozenset())
+
+    def tags(self):
+        return self._ids.keys()
+
+    def query(self, *tags, **kwargs):
+        """
+            Ids of the gists that have all of tags, minus those with any
+            of the tags in exclude.
+        """
+        exclude = kwargs.pop('exclude', ())
+        if not tags:
+            return set()
+        sets = sorted((self._ids.get(tag, set()) for tag in tags), key=len)
+        ids = set(sets[0])
+        for other in sets[1:]:
+            ids &= other
+            if not ids:
+                break
+        for tag in exclude:
+            ids -= self._ids.get(tag, set())
+        return ids
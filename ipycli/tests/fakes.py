@@ -0,0 +1,12 @@
+"""Fakes shared by the gist tests."""
+
+import datetime
+
+class FakeGist(object):
+    def __init__(self, id, description, day=1):
+        self.id = id
+        self.description = description
+        self.html_url = 'https://gist.github.com/' + id
+        self.public = False
+        self.updated_at = datetime.datetime(2013, 1, day)
+        self.files = {}
@@ -0,0 +1,89 @@
+"""Tests for the output blob store."""
+
+import json
+import os
+import time
+from unittest import TestCase
+
+from IPython.nbformat import current
+from IPython.utils.tempdir import TemporaryDirectory
+
+from ipycli.blobstore import BLOB_DIR, GC_GRACE, BlobStore, collect
+from ipycli.folder_backend import DirectoryProject
+
+def plot_notebook(png):
+    nb = current.new_notebook(name=u'plots')
+    ws = current.new_worksheet()
+    output = current.new_output('display_data', output_png=png,
+                                output_text=u'<Figure>')
+    ws.cells.append(current.new_code_cell(input=u'plot()', outputs=[output]))
+    nb.worksheets.append(ws)
+    return nb
+
+class TestBlobStore(TestCase):
+
+    def test_outputs_stored_once(self):
+        with TemporaryDirectory() as td:
+            project = DirectoryProject(td, '.ipynb')
+            project.blob_threshold = 100
+            path = os.path.join(td, 'plots.ipynb')
+            png = u'iVBORw0KGgo' * 100
+            nb = plot_notebook(png)
+            project.save_notebook_object(nb, path)
+            project.save_notebook_object(nb, os.path.join(td, 'copy.ipynb'))
+            # the saved notebook isn't touched
+            self.assertEquals(nb.worksheets[0].cells[0].outputs[0].png, png)
+
+            with open(path) as f:
+                output = json.load(f)['worksheets'][0]['cells'][0]['outputs'][0]
+            assert 'png' not in output
+            self.assertEquals(output['text'], [u'<Figure>'])
+            blobs = list(project.blobs.digests())
+            self.assertEquals(len(blobs), 1)
+
+            _, read = project.get_notebook_object(path)
+            output = read.worksheets[0].cells[0].outputs[0]
+            self.assertEquals(output.png, png)
+            assert 'blobs' not in output.metadata
+
+            _, pages = project.notebook_pages(path)
+            self.assertEquals(pages.cells(0, 1)[0].outputs[0].png, png)
+
+    def test_gc(self):
+        with TemporaryDirectory() as td:
+            project = DirectoryProject(td, '.ipynb')
+            project.blob_threshold = 10
+            path = os.path.join(td, 'plots.ipynb')
+            project.save_notebook_object(plot_notebook(u'a' * 20), path)
+            project.save_notebook_object(plot_notebook(u'b' * 20), path)
+
+            self.assertEquals(collect(td), [])
+            removed = collect(td, grace=-1)
+            self.assertEquals(len(removed), 1)
+            _, read = project.get_notebook_object(path)
+            self.assertEquals(read.worksheets[0].cells[0].outputs[0].png, u'b' * 20)
+            assert os.path.isdir(os.path.join(td, BLOB_DIR))
+
+    def test_gc_compressed(self):
+        with TemporaryDirectory() as td:
+            project = DirectoryProject(td, '.ipynb')
+            project.blob_threshold = 10
+            project.codec = 'gzip'
+            path = os.path.join(td, 'plots.ipynb.gz')
+            project.save_notebook_object(plot_notebook(u'a' * 20), path)
+            project.save_notebook_object(plot_notebook(u'b' * 20), path)
+
+            self.assertEquals(len(collect(td, grace=-1)), 1)
+            _, read = project.get_notebook_object(path)
+            self.assertEquals(read.worksheets[0].cells[0].outputs[0].png, u'b' * 20)
+
+    def test_put_again_renews_grace(self):
+        with TemporaryDirectory() as td:
+            store = BlobStore(os.path.join(td, BLOB_DIR))
+            digest = store.put(u'plot')
+            old = time.time() - 2 * GC_GRACE
+            os.utime(store.path(digest), (old, old))
+            # the plot is produced again before its notebook is written
+            self.assertEquals(store.put(u'plot'), digest)
+            self.assertEquals(store.gc(set()), [])
+            self.assertEquals(store.get(digest), u'plot')
@@ -0,0 +1,64 @@
+"""Tests for keeping dir listings up to date from watcher events."""
+
+import os
+from unittest import TestCase
+
+from IPython.utils.tempdir import TemporaryDirectory
+from zmq.eventloop import ioloop
+
+from ipycli.dir_watcher import PollingWatcher
+from ipycli.notebookmanager import NotebookManager
+
+class TestDirEvents(TestCase):
+
+    def test_events_update_listing(self):
+        with TemporaryDirectory() as td:
+            td = os.path.abspath(td)
+            open(os.path.join(td, 'a.ipynb'), 'w').close()
+            nbm = NotebookManager(notebook_dir=td)
+            project = nbm.notebook_dirs[td]
+            watcher = PollingWatcher(lambda *args: None, '.ipynb',
+                                     io_loop=ioloop.IOLoop())
+            watcher.watch(td)
+            nbm.watcher = watcher
+            nbm._watch(project)
+            watcher.stop()
+            a_id = nbm.list_notebooks()[0]['notebook_id']
+
+            b = os.path.join(td, 'b.ipynb')
+            open(b, 'w').close()
+            os.unlink(os.path.join(td, 'a.ipynb'))
+            events = watcher.changes()
+            self.assertEquals(sorted(events),
+                              [(td, 'create', b),
+                               (td, 'delete', os.path.join(td, 'a.ipynb'))])
+
+            for event in events:
+                nbm._on_dir_event(*event)
+            self.assertEquals([nb.path for nb in project.notebooks()], [b])
+            assert b in nbm.rev_mapping
+            assert os.path.join(td, 'a.ipynb') not in nbm.rev_mapping
+            assert a_id not in nbm.mapping
+
+    def test_unchanged_tree_is_not_listed(self):
+        with TemporaryDirectory() as td:
+            td = os.path.abspath(td)
+            a = os.path.join(td, 'a.ipynb')
+            open(a, 'w').close()
+            watcher = PollingWatcher(lambda *args: None, '.ipynb',
+                                     io_loop=ioloop.IOLoop())
+            watcher.stop()
+            watcher.watch(td)
+            files, dirs, started = watcher.snapshots[td]
+            # as if the dir had been listed a while ago
+            watcher.snapshots[td] = files, dirs, started + 10
+            listed = []
+            snapshot = watcher._snapshot
+            watcher._snapshot = lambda dir: listed.append(dir) or snapshot(dir)
+
+            os.utime(a, (0, 0))
+            self.assertEquals(watcher.changes(), [(td, 'modify', a)])
+            self.assertEquals(listed, [])
+            os.unlink(a)
+            self.assertEquals(watcher.changes(), [(td, 'delete', a)])
+            self.assertEquals(listed, [td])
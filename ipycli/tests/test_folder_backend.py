@@ -0,0 +1,98 @@
+"""Tests for the directory project index."""
+
+import os
+import stat
+from unittest import TestCase
+
+from IPython.utils.tempdir import TemporaryDirectory
+
+from ipycli.folder_backend import DirectoryProject, TreeWalk, atomic_write
+
+def touch(path, mtime):
+    open(path, 'w').close()
+    os.utime(path, (mtime, mtime))
+
+class TestDirectoryIndex(TestCase):
+
+    def test_cached_until_dir_changes(self):
+        with TemporaryDirectory() as td:
+            touch(os.path.join(td, 'a.ipynb'), 1000)
+            touch(os.path.join(td, 'b.ipynb'), 2000)
+            touch(os.path.join(td, '.hidden.ipynb'), 2000)
+            touch(os.path.join(td, 'c.py'), 2000)
+            os.utime(td, (1000, 1000))
+
+            project = DirectoryProject(td, '.ipynb')
+            nbs = project.notebooks()
+            self.assertEquals([nb.name for nb in nbs], ['b.ipynb', 'a.ipynb'])
+            again = project.notebooks()
+            assert again[0] is nbs[0]
+
+            # dir mtime unchanged, the cached listing is served
+            touch(os.path.join(td, 'd.ipynb'), 3000)
+            os.utime(td, (1000, 1000))
+            self.assertEquals(len(project.notebooks()), 2)
+
+            os.utime(td, (3000, 3000))
+            nbs = project.notebooks()
+            self.assertEquals([nb.name for nb in nbs],
+                              ['d.ipynb', 'b.ipynb', 'a.ipynb'])
+            assert nbs[1] is again[0]
+
+class TestTreeWalk(TestCase):
+
+    def test_recursive_prunes_ignored_dirs(self):
+        with TemporaryDirectory() as td:
+            for sub in ['a/b/c', '.git', 'node_modules/pkg', 'env2']:
+                os.makedirs(os.path.join(td, sub))
+            touch(os.path.join(td, 'top.ipynb'), 1000)
+            touch(os.path.join(td, 'a', 'one.ipynb'), 2000)
+            touch(os.path.join(td, 'a', 'b', 'c', 'deep.ipynb'), 3000)
+            touch(os.path.join(td, '.git', 'x.ipynb'), 3000)
+            touch(os.path.join(td, 'node_modules', 'pkg', 'y.ipynb'), 3000)
+            # a virtualenv under another name
+            touch(os.path.join(td, 'env2', 'pyvenv.cfg'), 1000)
+            touch(os.path.join(td, 'env2', 'z.ipynb'), 3000)
+
+            project = DirectoryProject(td, '.ipynb', recursive=True)
+            names = [nb.name for nb in project.notebooks()]
+            self.assertEquals(names, [os.path.join('a', 'b', 'c', 'deep.ipynb'),
+                                      os.path.join('a', 'one.ipynb'),
+                                      'top.ipynb'])
+
+            files, dirs = TreeWalk(td, '.ipynb', max_depth=1).walk()
+            self.assertEquals(sorted(os.path.basename(p) for p, _ in files),
+                              ['one.ipynb', 'top.ipynb'])
+            assert os.path.join(td, 'a', 'b') not in dirs
+
+            warnings = []
+            class Log(object):
+                def warn(self, *args):
+                    warnings.append(args)
+            project = DirectoryProject(td, '.ipynb', recursive=True,
+                                       max_entries=6, log=Log())
+            self.assertEquals([nb.name for nb in project.notebooks()],
+                              ['top.ipynb'])
+            assert project.truncated
+            self.assertEquals(warnings[0][1:], (td, 6))
+
+class TestAtomicWrite(TestCase):
+
+    def test_replaces_whole_file(self):
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, 'a.ipynb')
+            atomic_write(path, u'old')
+            os.chmod(path, 0640)
+            timings = atomic_write(path, u'new \xe9', fsync='always')
+            self.assertEquals(open(path).read(), 'new \xc3\xa9')
+            self.assertEquals(timings['bytes'], 6)
+            self.assertEquals(stat.S_IMODE(os.stat(path).st_mode), 0640)
+            self.assertEquals(os.listdir(td), ['a.ipynb'])
+
+    def test_failed_write_keeps_old_file(self):
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, 'a.ipynb')
+            atomic_write(path, 'old')
+            self.assertRaises(TypeError, atomic_write, path, object())
+            self.assertEquals(open(path).read(), 'old')
+            self.assertEquals(os.listdir(td), ['a.ipynb'])
@@ -0,0 +1,165 @@
+"""Tests for the gist backend that don't talk to github."""
+
+import datetime
+import threading
+import time
+from unittest import TestCase
+
+import github
+
+from IPython.nbformat import current
+from zmq.eventloop import ioloop
+
+from ipycli import gist_backend
+from ipycli.gist_backend import (GistHub, GistProject, GistUnavailable,
+                                 TaggedGistProject)
+from ipycli.tests.fakes import FakeGist
+
+class CreateHub(object):
+    def __init__(self):
+        self.created = []
+
+    def create_gist(self, public, files, desc):
+        self.created.append((public, files, desc))
+        return FakeGist(str(len(self.created)), desc)
+
+def make_hub():
+    return GistHub(github.Github(), save_workers=0)
+
+class TestGistListing(TestCase):
+
+    def test_apply_gists_patches_in_place(self):
+        hub = make_hub()
+        projects = hub.apply_gists([
+            FakeGist('1', 'one #notebook #quant'),
+            FakeGist('2', 'two #notebook #quant #test'),
+            FakeGist('3', 'three #notebook-project'),
+        ], full=True)
+        by_name = dict((p.name, p) for p in projects)
+        quant = by_name['#quant']
+        self.assertEquals(sorted(quant.gists), ['1', '2'])
+        self.assertEquals(sorted(by_name['#test'].gists), ['2'])
+
+        # gist 2 drops #test and #quant, gets #new
+        again = hub.apply_gists([FakeGist('2', 'two #notebook #new', day=2)])
+        assert again is projects
+        names = [p.name for p in projects]
+        assert '#test' not in names
+        assert '#new' in names
+        # same project object, patched
+        assert quant in projects
+        self.assertEquals(sorted(quant.gists), ['1'])
+
+    def test_full_listing_drops_missing(self):
+        hub = make_hub()
+        hub.apply_gists([FakeGist('1', 'one #notebook #quant'),
+                         FakeGist('2', 'two #notebook #test')], full=True)
+        projects = hub.apply_gists([FakeGist('1', 'one #notebook #quant')],
+                                   full=True)
+        self.assertEquals([p.name for p in projects], ['#quant'])
+        self.assertEquals(sorted(hub.gists), ['1'])
+
+    def test_tag_queries(self):
+        hub = make_hub()
+        hub.apply_gists([FakeGist('1', 'one #notebook #quant'),
+                         FakeGist('2', 'two #notebook #quant #test'),
+                         FakeGist('3', 'three #test')], full=True)
+        self.assertEquals(sorted(hub.tag_project('#quant').gists), ['1', '2'])
+        self.assertEquals(hub.tag_project('#missing'), None)
+        # gist 3 isn't a notebook
+        self.assertEquals(hub.tagged_gist_ids('#test'), set(['2']))
+        self.assertEquals(hub.tagged_gist_ids('#quant', '#test'), set(['2']))
+
+    def test_path_lookups(self):
+        hub = make_hub()
+        hub.apply_gists([FakeGist('1', 'one #notebook #quant'),
+                         FakeGist('2', 'two #notebook #quant')], full=True)
+        quant = hub.tag_project('#quant')
+        assert hub.project_by_path(quant.path) is quant
+        self.assertEquals(quant._get_gist_by_path(
+            'https://gist.github.com/2').id, '2')
+        self.assertEquals(quant._get_gist_by_path('nope'), None)
+
+        hub.apply_gists([FakeGist('2', 'two #notebook', day=2)])
+        self.assertEquals(quant._get_gist_by_path(
+            'https://gist.github.com/2'), None)
+
+class EditableGist(FakeGist):
+    def edit(self, desc, files):
+        self.description = desc
+        self.updated_at += datetime.timedelta(days=1)
+
+class TestPlacement(TestCase):
+
+    def test_edits_placed_on_the_ioloop(self):
+        hub = make_hub()
+        gist = EditableGist('1', 'one #notebook #quant')
+        hub.apply_gists([gist], full=True)
+        # renames finish on a save-queue thread
+        t = threading.Thread(target=hub.edit_gist,
+                             args=(gist, 'one #notebook #test', {}))
+        t.start()
+        t.join()
+        self.assertEquals([p.name for p in hub.projects], ['#quant'])
+
+        loop = ioloop.IOLoop.instance()
+        loop.add_callback(loop.stop)
+        loop.start()
+        self.assertEquals([p.name for p in hub.projects], ['#test'])
+
+class OfflineHub(object):
+    def wait_for_push(self, path, journaled=False):
+        pass
+
+    def get_gist(self, id):
+        raise GistUnavailable("github is unavailable")
+
+class TestOffline(TestCase):
+
+    def test_failed_refresh_keeps_gist(self):
+        gist = FakeGist('1', 'one #notebook-project')
+        gist.files = {'a.ipynb': None}
+        project = GistProject(gist, OfflineHub())
+        self.assertRaises(GistUnavailable, project.get_notebook_object,
+                          project.path + '/a.ipynb')
+        self.assertEquals(project.gists, {'1': gist})
+        self.assertEquals(len(project.notebooks()), 1)
+
+class TestQueuedPush(TestCase):
+
+    def setUp(self):
+        self.save_wait = gist_backend.SAVE_WAIT
+        gist_backend.SAVE_WAIT = 0.05
+
+    def tearDown(self):
+        gist_backend.SAVE_WAIT = self.save_wait
+
+    def test_wait_is_bounded(self):
+        hub = GistHub(github.Github(), save_workers=1)
+        pushed = threading.Event()
+        # a push held back, say by the rate limit
+        hub.save_queue.enqueue('path', pushed.wait)
+        start = time.time()
+        self.assertRaises(GistUnavailable, hub.wait_for_push, 'path')
+        self.assertRaises(GistUnavailable, hub.wait_for_push, 'path',
+                          journaled=True)
+        assert time.time() - start < 1
+        pushed.set()
+        hub.wait_for_push('path')
+
+class TestNewNotebook(TestCase):
+
+    def test_created_with_content(self):
+        hub = CreateHub()
+        project = TaggedGistProject('#quant', [], hub)
+        nb = current.new_notebook(metadata=current.new_metadata(name=u'Untitled0'))
+        nbo = project.new_notebook_object('gisttag:/#quant/Untitled0.ipynb',
+                                          public=True, nb=nb)
+
+        self.assertEquals(len(hub.created), 1)
+        public, files, desc = hub.created[0]
+        assert public
+        self.assertEquals(desc, 'Untitled0 #notebook #quant')
+        content = files['Untitled0.ipynb']._InputFileContent__content
+        self.assertEquals(current.reads(content, u'json'), nb)
+        self.assertEquals(nbo.path, 'https://gist.github.com/1')
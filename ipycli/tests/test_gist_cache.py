@@ -0,0 +1,61 @@
+"""Tests for the conditional gist cache."""
+
+import json
+from unittest import TestCase
+
+from ipycli.gist_cache import GistCache
+
+class FakeFile(object):
+    def __init__(self, content):
+        self.content = content
+
+class FakeGist(object):
+    def __init__(self, data):
+        self.id = data['id']
+        self.updated_at = data['updated_at']
+        self.files = dict((name, FakeFile(f['content']))
+                          for name, f in data['files'].items())
+
+class TestGistCache(TestCase):
+
+    def setUp(self):
+        self.data = {'id': '1', 'updated_at': 'then',
+                     'files': {'a.ipynb': {'content': '{"a": 1}'}}}
+        self.requests = []
+
+    def fetch(self, id, headers):
+        self.requests.append(headers)
+        if headers.get('If-None-Match') == 'v1':
+            return 304, {}, ''
+        return 200, {'etag': 'v1'}, json.dumps(self.data)
+
+    def test_not_modified(self):
+        cache = GistCache(self.fetch, FakeGist)
+        gist = cache.get_gist('1')
+        self.assertEquals(self.requests[-1], {})
+
+        again = cache.get_gist('1')
+        assert again is gist
+        self.assertEquals(self.requests[-1], {'If-None-Match': 'v1'})
+        self.assertEquals(cache.hits, 1)
+        self.assertEquals(cache.misses, 1)
+
+    def test_notebook_parsed_once(self):
+        cache = GistCache(self.fetch, FakeGist)
+        parsed = []
+        gist = cache.get_gist('1')
+        def load():
+            content = gist.files['a.ipynb'].content
+            parsed.append(content)
+            return json.loads(content)
+
+        nb = cache.get_notebook(gist, 'a.ipynb', load)
+        nb['a'] = 2
+        gist = cache.get_gist('1')
+        nb = cache.get_notebook(gist, 'a.ipynb', load)
+        self.assertEquals(nb, {'a': 1})
+        self.assertEquals(len(parsed), 1)
+
+        cache.invalidate('1')
+        gist = cache.get_gist('1')
+        self.assertEquals(self.requests[-1], {})
@@ -0,0 +1,53 @@
+"""Tests for the gist save journal."""
+
+import os
+from unittest import TestCase
+
+import github
+from IPython.nbformat import current
+from IPython.utils.tempdir import TemporaryDirectory
+
+from ipycli.gist_backend import GistHub
+from ipycli.gist_journal import SaveJournal
+from ipycli.tests.fakes import FakeGist
+
+class TestSaveJournal(TestCase):
+
+    def test_replay(self):
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, 'journal')
+            journal = SaveJournal(path)
+            journal.append('a', {'content': 1})
+            seq = journal.append('a', {'content': 2})
+            journal.append('b', {'content': 3})
+            journal.mark_pushed('b', journal.get('b')[0])
+            journal.close()
+            # crash in the middle of a write
+            with open(path, 'a') as f:
+                f.write('{"key": "c", "se')
+
+            journal = SaveJournal(path)
+            self.assertEquals(journal.pending(), ['a'])
+            self.assertEquals(journal.get('a'), (seq, {'content': 2}))
+            # compacted on load
+            self.assertEquals(len(open(path).readlines()), 1)
+
+            journal.mark_pushed('a', seq - 1)
+            self.assertEquals(journal.pending(), ['a'])
+            journal.mark_pushed('a', seq)
+            self.assertEquals(journal.pending(), [])
+
+class TestJournaledAutosave(TestCase):
+
+    def test_autosave_stays_local(self):
+        with TemporaryDirectory() as td:
+            hub = GistHub(github.Github(), save_workers=0,
+                          journal=os.path.join(td, 'journal'),
+                          push_interval=3600)
+            gist = FakeGist('1', 'test #notebook')
+            nb = current.new_notebook(metadata=current.new_metadata(name=u'test'))
+            hub.save_notebook(gist.html_url, gist, 'a.ipynb', nb, autosave=True)
+
+            self.assertEquals(hub.journal.pending(), [gist.html_url])
+            self.assertEquals(hub.journaled_notebook(gist.html_url), nb)
+            self.assertEquals(hub.journaled_notebook('other'), None)
@@ -0,0 +1,77 @@
+"""Tests for the local gist mirror."""
+
+import datetime
+from unittest import TestCase
+
+from IPython.utils.tempdir import TemporaryDirectory
+
+from ipycli.gist_mirror import GistMirror, CircuitBreaker
+
+class FakeFile(object):
+    def __init__(self, content):
+        self.content = content
+        self.raw_url = None
+        self.size = None if content is None else len(content)
+
+class FakeGist(object):
+    def __init__(self, id, content, updated_at):
+        self.id = id
+        self.url = 'https://api.github.com/gists/' + id
+        self.html_url = 'https://gist.github.com/' + id
+        self.description = 'test #notebook #quant'
+        self.public = False
+        self.updated_at = updated_at
+        self.files = {'a.ipynb': FakeFile(content)}
+
+class TestGistMirror(TestCase):
+
+    def test_roundtrip(self):
+        then = datetime.datetime(2013, 1, 1)
+        with TemporaryDirectory() as td:
+            mirror = GistMirror(td)
+            mirror.store(FakeGist('1', '{}', then))
+
+            # new mirror reads from disk
+            gist = GistMirror(td).get('1')
+            self.assertEquals(gist.updated_at, then)
+            self.assertEquals(gist.files['a.ipynb'].content, '{}')
+            self.assertEquals(gist.description, 'test #notebook #quant')
+
+    def test_listing_keeps_content(self):
+        then = datetime.datetime(2013, 1, 1)
+        later = datetime.datetime(2013, 1, 2)
+        with TemporaryDirectory() as td:
+            mirror = GistMirror(td)
+            mirror.store(FakeGist('1', '{}', then))
+            mirror.store(FakeGist('2', '{}', then))
+            live = mirror.get('1')
+
+            # listings don't carry file contents
+            mirror.store_listing([FakeGist('1', None, then)])
+            assert live.has_content()
+            self.assertEquals(mirror.get('2'), None)
+
+            mirror.store_listing([FakeGist('1', None, later)])
+            self.assertEquals(live.updated_at, later)
+            assert not live.has_content()
+
+            # an empty listing on a mirror that wasn't loaded yet
+            mirror = GistMirror(td)
+            mirror.store_listing([])
+            self.assertEquals(mirror.get('1'), None)
+
+class TestCircuitBreaker(TestCase):
+
+    def test_open_after_failures(self):
+        breaker = CircuitBreaker(max_failures=2, reset_timeout=60)
+        breaker.failure()
+        assert breaker.allow()
+        breaker.failure()
+        assert breaker.is_open
+        assert not breaker.allow()
+
+        breaker.reset_timeout = 0
+        # half open lets a probe through
+        assert breaker.allow()
+        breaker.success()
+        assert not breaker.is_open
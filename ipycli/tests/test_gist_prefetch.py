@@ -0,0 +1,35 @@
+"""Tests for the gist prefetcher."""
+
+import datetime
+from unittest import TestCase
+
+from ipycli.gist_prefetch import GistPrefetcher
+
+class FakeGist(object):
+    def __init__(self, id, day):
+        self.id = id
+        self.updated_at = datetime.datetime(2013, 1, day)
+
+class TestGistPrefetcher(TestCase):
+
+    def test_prefetch_newest(self):
+        gists = dict((str(i), FakeGist(str(i), i)) for i in range(1, 6))
+        warmed = []
+        def warm(id):
+            warmed.append(id)
+            return gists[id]
+
+        prefetcher = GistPrefetcher(warm, depth=2, workers=2)
+        prefetcher.prefetch(gists.values() + [None])
+        prefetcher.pool.close()
+        prefetcher.pool.join()
+        self.assertEquals(sorted(warmed), ['4', '5'])
+
+        prefetcher.record_open('5')
+        prefetcher.record_open('1')
+        # only the first open of a prefetched gist is a hit
+        prefetcher.record_open('5')
+        stats = prefetcher.stats()
+        self.assertEquals(stats['prefetched'], 2)
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['misses'], 2)
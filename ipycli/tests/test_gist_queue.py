@@ -0,0 +1,46 @@
+"""Tests for the gist write-behind queue."""
+
+import threading
+from unittest import TestCase
+
+from ipycli.gist_queue import GistSaveQueue
+
+class TestGistSaveQueue(TestCase):
+
+    def test_latest_wins(self):
+        q = GistSaveQueue(workers=1)
+        gate = threading.Event()
+        started = threading.Event()
+        pushed = []
+
+        def push(value):
+            started.set()
+            gate.wait()
+            pushed.append(value)
+
+        q.enqueue('nb', push, 1)
+        started.wait(5)
+        # these two queue up behind the in-flight push
+        q.enqueue('nb', push, 2)
+        q.enqueue('nb', push, 3)
+        gate.set()
+        assert q.wait('nb', timeout=5)
+
+        self.assertEquals(pushed, [1, 3])
+        status = q.get_status('nb')
+        self.assertEquals(status['state'], 'saved')
+        self.assertEquals(status['revision'], 3)
+        self.assertEquals(status['pushed_revision'], 3)
+
+    def test_failed_save(self):
+        q = GistSaveQueue(workers=1)
+
+        def push():
+            raise ValueError('no github')
+
+        q.enqueue('nb', push)
+        assert q.wait('nb', timeout=5)
+        status = q.get_status('nb')
+        self.assertEquals(status['state'], 'failed')
+        self.assertEquals(status['pushed_revision'], 0)
+        assert 'no github' in status['error']
@@ -0,0 +1,54 @@
+"""Tests for the github request scheduler."""
+
+import threading
+import time
+from unittest import TestCase
+
+import github
+
+from ipycli.gist_scheduler import (RequestScheduler, RateLimited, SAVE,
+                                   BACKGROUND)
+
+def quota(remaining, reset):
+    return [('X-RateLimit-Remaining', str(remaining)),
+            ('X-RateLimit-Limit', '5000'),
+            ('X-RateLimit-Reset', str(int(reset)))]
+
+class TestRequestScheduler(TestCase):
+
+    def test_low_quota_defers_low_priority(self):
+        sched = RequestScheduler(save_reserve=10, background_reserve=100)
+        sched.update_quota(200, quota(50, time.time() + 3600))
+
+        # interactive still goes out
+        self.assertEquals(sched.run(lambda: 1), 1)
+        with sched.priority(BACKGROUND):
+            self.assertRaises(RateLimited, sched.run, lambda: 1)
+        self.assertEquals(sched.stats()['deferred']['background'], 1)
+
+        # saves wait for the quota to come back
+        done = []
+        def save():
+            with sched.priority(SAVE):
+                sched.run(done.append, 1)
+        sched.update_quota(200, quota(5, time.time() + 3600))
+        t = threading.Thread(target=save)
+        t.start()
+        time.sleep(0.1)
+        self.assertEquals(done, [])
+        sched.update_quota(200, quota(5000, time.time() + 3600))
+        t.join(5)
+        self.assertEquals(done, [1])
+
+    def test_backoff(self):
+        sched = RequestScheduler(base_backoff=60)
+        def fail():
+            raise github.GithubException(502, None)
+        self.assertRaises(github.GithubException, sched.run, fail)
+        assert sched.stats()['backoff'] > 0
+        # interactive calls fail fast while backing off
+        self.assertRaises(RateLimited, sched.run, lambda: 1)
+
+        sched.backoff_until = 0
+        sched.run(lambda: 1)
+        self.assertEquals(sched.failures, 0)
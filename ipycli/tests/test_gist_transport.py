@@ -0,0 +1,156 @@
+"""Tests for the pooled github transport against a local stand-in server."""
+
+import errno
+import httplib
+import json
+import socket
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from unittest import TestCase
+
+import github
+
+from ipycli.gist_backend import GistHub
+from ipycli.gist_files import IncompleteFile
+from ipycli.gist_transport import ConnectionPool, Transport, ResponseTooLarge
+
+RAW = '{"cells": "' + 'x' * 1000 + '"}'
+
+class FakeFile(object):
+    def __init__(self, url, content, size):
+        self.filename = 'a.ipynb'
+        self.raw_url = url
+        self.content = content
+        self.size = size
+
+class FakeGist(object):
+    def __init__(self, file):
+        self.id = '1'
+        self.updated_at = None
+        self.files = {'a.ipynb': file}
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        # PyGithub sends a json body even with a GET
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.startswith('/raw/'):
+            return self.send_body(RAW)
+        body = json.dumps({'id': self.path.split('/')[-1],
+                           'description': 'test #notebook'})
+        self.send_body(body)
+
+    def send_body(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class DeadConnection(object):
+    """
+        A pooled connection failing with error, when sending or when
+        waiting for the response
+    """
+    def __init__(self, error, on_send=False):
+        self.error = error
+        self.on_send = on_send
+        self.sent = 0
+
+    def request(self, verb, url, body, headers):
+        if self.on_send:
+            raise self.error
+        self.sent += 1
+
+    def getresponse(self):
+        raise self.error
+
+    def close(self):
+        pass
+
+class TestRetries(TestCase):
+
+    def pool(self, cnx):
+        pool = ConnectionPool('http', '127.0.0.1')
+        pool._idle.append(cnx)
+        fresh = []
+        def new():
+            fresh.append(DeadConnection(socket.error(errno.ECONNREFUSED, 'refused')))
+            return fresh[-1]
+        pool._new = new
+        return pool, fresh
+
+    def test_timeouts_not_retried(self):
+        pool, fresh = self.pool(DeadConnection(socket.timeout('timed out')))
+        self.assertRaises(socket.timeout, pool.request, 'GET', '/gists')
+        self.assertEquals(fresh, [])
+
+    def test_sent_post_not_retried(self):
+        cnx = DeadConnection(socket.error(errno.ECONNRESET, 'reset'))
+        pool, fresh = self.pool(cnx)
+        self.assertRaises(socket.error, pool.request, 'POST', '/gists', '{}')
+        self.assertEquals((cnx.sent, fresh), (1, []))
+
+    def test_stale_connection_retried(self):
+        pool, fresh = self.pool(DeadConnection(httplib.BadStatusLine("''")))
+        self.assertRaises(socket.error, pool.request, 'GET', '/gists')
+        self.assertEquals(len(fresh), 1)
+        # a POST that never left is safe to send again
+        pool, fresh = self.pool(DeadConnection(
+            socket.error(errno.EPIPE, 'broken pipe'), on_send=True))
+        self.assertRaises(socket.error, pool.request, 'POST', '/gists', '{}')
+        self.assertEquals(len(fresh), 1)
+
+class TestTransport(TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StandInHandler)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def tearDown(self):
+        github.Requester.Requester.injectConnectionClasses(
+            httplib.HTTPConnection, httplib.HTTPSConnection)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_github_reuses_connection(self):
+        transport = Transport(size=2)
+        transport.install()
+        g = github.Github(base_url=self.base_url)
+        self.assertEquals(g.get_gist('1').description, 'test #notebook')
+        self.assertEquals(g.get_gist('2').id, '2')
+
+        pool = transport.get_pool('http', '127.0.0.1', self.server.server_port)
+        status, headers, body = pool.request('GET', '/gists/3')
+        self.assertEquals(status, 200)
+
+        stats = pool.stats()
+        self.assertEquals(stats['requests'], 3)
+        self.assertEquals(stats['created'], 1)
+        self.assertEquals(stats['reused'], 2)
+        transport.close()
+
+    def test_stream_truncated_file(self):
+        hub = GistHub(github.Github(), save_workers=0, max_file_size=2000)
+        url = self.base_url + '/raw/a.ipynb'
+
+        # inline content github cut short
+        gist = FakeGist(FakeFile(url, RAW[:100], len(RAW)))
+        self.assertEquals(hub.file_content(gist, 'a.ipynb'), RAW)
+        # small complete files are read inline
+        gist = FakeGist(FakeFile(url, u'{}', 2))
+        self.assertEquals(hub.file_content(gist, 'a.ipynb'), u'{}')
+
+        gist = FakeGist(FakeFile(url, None, len(RAW) + 1))
+        self.assertRaises(IncompleteFile, hub.file_content, gist, 'a.ipynb')
+
+        hub.max_file_size = 100
+        gist = FakeGist(FakeFile(url, None, len(RAW)))
+        self.assertRaises(ResponseTooLarge, hub.file_content, gist, 'a.ipynb')
@@ -0,0 +1,90 @@
+"""Tests for the parsed notebook cache."""
+
+import os
+from unittest import TestCase
+
+from IPython.nbformat import current
+from IPython.utils.tempdir import TemporaryDirectory
+
+from ipycli.folder_backend import DirectoryProject
+from ipycli.nbcache import NotebookCache
+
+class TestNotebookCache(TestCase):
+
+    def test_lru_limits(self):
+        cache = NotebookCache(max_entries=2, max_bytes=100)
+        loads = []
+        def load(value):
+            def load():
+                loads.append(value)
+                return {'v': value}
+            return load
+
+        cache.get('a', 10, load('a'))
+        cache.get('b', 10, load('b'))
+        nb = cache.get('a', 10, load('a'))
+        nb['v'] = 'changed'
+        self.assertEquals(cache.get('a', 10, load('a')), {'v': 'a'})
+        # b is the least recently used
+        cache.get('c', 10, load('c'))
+        cache.get('b', 10, load('b'))
+        self.assertEquals(loads, ['a', 'b', 'c', 'b'])
+
+        # over the byte limit, evicts down to fit
+        cache.get('d', 95, load('d'))
+        stats = cache.stats()
+        self.assertEquals(stats['entries'], 1)
+        self.assertEquals(stats['bytes'], 95)
+        self.assertEquals((stats['hits'], stats['misses'], stats['evictions']),
+                          (2, 5, 4))
+
+        # too big to keep at all
+        cache.get('e', 200, load('e'))
+        self.assertEquals(cache.stats()['entries'], 1)
+
+    def test_directory_reads(self):
+        with TemporaryDirectory() as td:
+            project = DirectoryProject(td, '.ipynb')
+            project.nbcache = cache = NotebookCache()
+            path = os.path.join(td, 'a.ipynb')
+            project.save_notebook_object(current.new_notebook(name=u'a'), path)
+
+            _, nb = project.get_notebook_object(path)
+            # views share the cells, everything above them is theirs
+            nb.worksheets.append(current.new_worksheet())
+            nb.metadata.changed = True
+            _, nb = project.get_notebook_object(path)
+            self.assertEquals(nb.worksheets, [])
+            assert 'changed' not in nb.metadata
+            self.assertEquals((cache.hits, cache.misses), (1, 1))
+
+            nb.worksheets.append(current.new_worksheet())
+            project.save_notebook_object(nb, path)
+            _, nb = project.get_notebook_object(path)
+            self.assertEquals(len(nb.worksheets), 1)
+            self.assertEquals(cache.misses, 2)
+
+    def test_hits_skip_parsing(self):
+        cells = [current.new_code_cell(input=u'plot(%d)' % i) for i in range(3)]
+        nb = current.new_notebook(name=u'big',
+                                  worksheets=[current.new_worksheet(cells=cells)])
+        with TemporaryDirectory() as td:
+            project = DirectoryProject(td, '.ipynb')
+            project.nbcache = NotebookCache()
+            path = os.path.join(td, 'big.ipynb')
+            project.save_notebook_object(nb, path)
+            reads = []
+            read = project._read_notebook
+            project._read_notebook = lambda path: reads.append(path) or read(path)
+
+            for i in range(10):
+                _, view = project.get_notebook_object(path)
+                # adding, dropping and replacing cells leaves the entry be
+                view_cells = view.worksheets[0].cells
+                view_cells.pop()
+                view_cells[0] = current.new_code_cell(input=u'changed')
+                view_cells.append(current.new_code_cell(input=u'added'))
+            self.assertEquals(reads, [path])
+            _, view = project.get_notebook_object(path)
+            self.assertEquals([cell.input for cell in view.worksheets[0].cells],
+                              [u'plot(0)', u'plot(1)', u'plot(2)'])
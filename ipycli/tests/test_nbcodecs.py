@@ -0,0 +1,56 @@
+"""Tests for the notebook storage codecs."""
+
+import os
+from StringIO import StringIO
+from unittest import TestCase
+
+from IPython.nbformat import current
+from IPython.utils.tempdir import TemporaryDirectory
+
+from ipycli import nbcodecs
+from ipycli.folder_backend import DirectoryProject
+
+def sample_notebook():
+    nb = current.new_notebook(name=u'sample')
+    ws = current.new_worksheet()
+    output = current.new_output('stream', output_text=u'caf\xe9\nline 2\n')
+    ws.cells.append(current.new_code_cell(input=u'x = 1\nx', outputs=[output]))
+    ws.cells.append(current.new_text_cell('markdown', source=u'# title'))
+    nb.worksheets.append(ws)
+    return nb
+
+class TestCodecs(TestCase):
+
+    def test_json_matches_ipython(self):
+        nb = sample_notebook()
+        f = StringIO()
+        nbcodecs.get_codec('json').dump(nb, f)
+        self.assertEquals(f.getvalue(), current.writes(nb, u'json'))
+
+    def test_round_trip(self):
+        nb = sample_notebook()
+        expected = current.reads(current.writes(nb, u'json'), u'json')
+        with TemporaryDirectory() as td:
+            for name, codec in nbcodecs.CODECS.items():
+                path = os.path.join(td, name + '.ipynb' + codec.suffix)
+                with open(path, 'wb') as f:
+                    codec.dump(nb, f)
+                # compact is plain json to a reader
+                self.assertEquals(nbcodecs.detect(path).suffix, codec.suffix)
+                self.assertEquals(nbcodecs.read_notebook(path), expected)
+
+    def test_directory_codec(self):
+        with TemporaryDirectory() as td:
+            project = DirectoryProject(td, '.ipynb')
+            project.codec = 'gzip'
+            path, name = project.increment_filename('Untitled')
+            self.assertEquals(name, 'Untitled0.ipynb.gz')
+            project.save_notebook_object(sample_notebook(), path)
+
+            _, nb = project.get_notebook_object(path)
+            self.assertEquals(nb.metadata.name, 'Untitled0')
+            self.assertEquals(nb.worksheets[0].cells[0].outputs[0].text,
+                              u'caf\xe9\nline 2\n')
+            self.assertEquals([n.name for n in project.notebooks()], [name])
+            self.assertEquals(project.increment_filename('Untitled')[1],
+                              'Untitled1.ipynb.gz')
@@ -0,0 +1,45 @@
+"""Tests for paged notebook reads."""
+
+import os
+from unittest import TestCase
+
+from IPython.nbformat import current
+from IPython.utils.tempdir import TemporaryDirectory
+
+from ipycli.nbpaging import FilePages, NotebookPages, page_info
+
+def make_notebook(cells):
+    nb = current.new_notebook(name=u'big')
+    ws = current.new_worksheet()
+    for i in range(cells):
+        # brackets and quotes in strings mustn't throw the scan off
+        output = current.new_output('stream', output_text=u'%d ]}\n"[{' % i)
+        ws.cells.append(current.new_code_cell(input=u'x = %d\nx' % i,
+                                              outputs=[output]))
+    ws.cells.append(current.new_text_cell('markdown', source=u'# "end" ]'))
+    nb.worksheets.append(ws)
+    return nb
+
+class TestPaging(TestCase):
+
+    def test_file_pages_match_parsed(self):
+        nb = make_notebook(20)
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, 'big.ipynb')
+            with open(path, 'w') as f:
+                current.write(nb, f, u'json')
+            pages = FilePages(path)
+            with open(path) as f:
+                parsed = NotebookPages(current.read(f, u'json'))
+
+            skeleton = page_info(pages)
+            self.assertEquals(skeleton, page_info(parsed))
+            self.assertEquals(skeleton['paged'], {'cells': 21})
+            output = skeleton.worksheets[0].cells[3].outputs[0]
+            self.assertEquals(output['stub'], True)
+            self.assertEquals(skeleton.worksheets[0].cells[3].input, u'x = 3\nx')
+
+            cells = pages.cells(18, 30)
+            self.assertEquals(cells, parsed.cells(18, 30))
+            self.assertEquals(len(cells), 3)
+            self.assertEquals(cells[0].outputs[0].text, u'18 ]}\n"[{')
@@ -0,0 +1,116 @@
+"""Tests for the notebook id registry."""
+
+import os
+import time
+from unittest import TestCase
+
+from IPython.utils.tempdir import TemporaryDirectory
+
+from ipycli.folder_backend import NBObject
+from ipycli.nbregistry import NotebookRegistry, id_view, rev_view
+from ipycli.notebookmanager import NotebookManager
+
+class Project(object):
+    path = '/proj'
+
+class TestNotebookRegistry(TestCase):
+
+    def test_lookups(self):
+        registry = NotebookRegistry()
+        nbo = NBObject(Project(), '/proj/a.ipynb')
+        registry.add('id-a', nbo)
+        self.assertEquals(registry.by_path('/proj/a.ipynb').notebook_id, 'id-a')
+        self.assertEquals([r.notebook_id for r in registry.by_name('a.ipynb')],
+                          ['id-a'])
+        # moving the id drops its old path
+        nbo.path = '/proj/b.ipynb'
+        registry.add('id-a', nbo)
+        self.assertEquals(registry.by_path('/proj/a.ipynb'), None)
+        self.assertEquals(registry.by_name('a.ipynb'), [])
+        self.assertEquals(rev_view(registry), {'/proj/b.ipynb': 'id-a'})
+        self.assertEquals(id_view(registry)['id-a'], nbo)
+
+        registry.add('id-c', NBObject(Project(), '/proj/c.ipynb'))
+        evicted = registry.evict_missing('/proj', set(['/proj/c.ipynb']))
+        self.assertEquals([r.notebook_id for r in evicted], ['id-a'])
+        self.assertEquals(len(registry), 1)
+
+    def test_manager_evicts_missing(self):
+        with TemporaryDirectory() as td:
+            td = os.path.abspath(td)
+            a = os.path.join(td, 'a.ipynb')
+            open(a, 'w').close()
+            nbm = NotebookManager(notebook_dir=td)
+            a_id = nbm.list_notebooks()[0]['notebook_id']
+            self.assertEquals(nbm.find_path(a_id), a)
+            self.assertEquals(nbm.list_notebooks()[0]['notebook_id'], a_id)
+
+            os.unlink(a)
+            nbm.notebook_dirs[td].invalidate()
+            self.assertEquals(nbm.list_notebooks(), [])
+            assert a_id not in nbm.mapping
+            assert a not in nbm.rev_mapping
+
+    def test_truncated_listing_keeps_ids(self):
+        with TemporaryDirectory() as td:
+            td = os.path.abspath(td)
+            tree = os.path.join(td, 'tree')
+            os.makedirs(os.path.join(tree, 'sub'))
+            b = os.path.join(tree, 'sub', 'b.ipynb')
+            open(os.path.join(tree, 'a.ipynb'), 'w').close()
+            open(b, 'w').close()
+            nbm = NotebookManager(notebook_dir=td)
+            project = nbm.add_notebook_dir(tree, recursive=True)
+            ids = dict((nb['path'], nb['notebook_id'])
+                       for nb in nbm.list_notebooks())
+            self.assertEquals(nbm.find_path(ids[b]), b)
+
+            # sub is past the cap now
+            project.max_entries = 2
+            project.invalidate()
+            nbm._evict_missing(project, project.notebooks())
+            assert project.truncated
+            self.assertEquals(nbm.find_path(ids[b]), b)
+
+    def test_restart(self):
+        with TemporaryDirectory() as td:
+            td = os.path.abspath(td)
+            other = os.path.join(td, 'other')
+            os.mkdir(other)
+            open(os.path.join(td, 'a.ipynb'), 'w').close()
+            open(os.path.join(other, 'b.ipynb'), 'w').close()
+            db = os.path.join(td, 'notebooks.sqlite')
+            nbm = NotebookManager(notebook_dir=td)
+            nbm.load_registry(db)
+            nbm.add_notebook_dir(other)
+            ids = sorted(nb['notebook_id'] for nb in nbm.list_notebooks())
+            mtimes = dict((nbo.path, nbo.mtime)
+                          for nbo in nbm.notebook_dirs[td].notebooks())
+            nbm.flush_registry()
+            nbm.registry_store.close()
+
+            c = os.path.join(td, 'c.ipynb')
+            open(c, 'w').close()
+            nbm = NotebookManager(notebook_dir=td)
+            nbm.load_registry(db)
+            # known before any listing, added dirs included
+            self.assertEquals(sorted(nbm.mapping), ids)
+            project = nbm.notebook_dirs[td]
+            assert other in nbm.notebook_dirs
+            assert c not in [nb['path'] for nb in nbm.list_notebooks()]
+            # seeded with the exact mtimes, search versions still match
+            self.assertEquals(dict((nbo.path, nbo.mtime)
+                                   for nbo in project.notebooks()), mtimes)
+
+            files, dirs = project.list_files()
+            nbm._apply_rescan(project, files, dirs, time.time())
+            assert not project.seeded
+            assert c in [nb['path'] for nb in nbm.list_notebooks()]
+            self.assertEquals(len(nbm.mapping), 3)
+
+            # a rescan that failed drops the restored listing
+            seeded = nbm.notebook_dirs[other]
+            assert seeded.seeded
+            open(os.path.join(other, 'd.ipynb'), 'w').close()
+            nbm._drop_seeded(seeded)
+            self.assertEquals(len(seeded.notebooks()), 2)
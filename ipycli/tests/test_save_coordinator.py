@@ -0,0 +1,67 @@
+"""Tests for per-notebook save coordination."""
+
+import threading
+import time
+from unittest import TestCase
+
+from ipycli.save_coordinator import SaveCoordinator
+
+class TestSaveCoordinator(TestCase):
+
+    def test_latest_wins(self):
+        coord = SaveCoordinator(workers=2)
+        started = threading.Event()
+        release = threading.Event()
+        written = []
+
+        def slow():
+            started.set()
+            release.wait()
+            written.append(1)
+
+        errors = []
+        coord.submit('nb', slow, errors.append)
+        started.wait()
+        # these queue up behind the running save and collapse
+        coord.submit('nb', lambda: written.append(2), errors.append)
+        coord.submit('nb', lambda: written.append(3), errors.append)
+        done = threading.Event()
+        coord.submit('nb', lambda: written.append(4), lambda e: done.set())
+        self.assertEquals(coord.stats()['notebooks']['nb']['elided'], 2)
+        release.set()
+        done.wait()
+
+        self.assertEquals(written, [1, 4])
+        self.assertEquals(errors, [None, None, None])
+        stats = coord.stats()
+        self.assertEquals(stats['performed'], 2)
+        self.assertEquals(stats['elided'], 2)
+        # idle notebooks are dropped from the counts
+        for i in range(100):
+            if not coord.stats()['notebooks']:
+                break
+            time.sleep(0.01)
+        self.assertEquals(coord.stats()['notebooks'], {})
+
+    def test_flush_survives_collapse(self):
+        coord = SaveCoordinator(workers=1)
+        started = threading.Event()
+        release = threading.Event()
+        done = threading.Event()
+        ran = []
+
+        coord.submit('nb', lambda: (started.set(), release.wait()))
+        started.wait()
+        # an explicit save, replaced by an autosave before it runs
+        coord.submit('nb', lambda: ran.append('save'), flush=lambda: ran.append('flush'))
+        coord.submit('nb', lambda: ran.append('autosave'), lambda e: done.set())
+        release.set()
+        done.wait()
+        self.assertEquals(ran, ['autosave', 'flush'])
+
+    def test_save_raises(self):
+        coord = SaveCoordinator(workers=1)
+        def bad():
+            raise ValueError('bad')
+        self.assertRaises(ValueError, coord.save, 'nb', bad)
+        self.assertEquals(coord.stats()['performed'], 0)
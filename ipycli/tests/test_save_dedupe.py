@@ -0,0 +1,53 @@
+"""Tests for skipping saves of unchanged notebooks."""
+
+import os
+from unittest import TestCase
+
+from IPython.nbformat import current
+from IPython.utils.tempdir import TemporaryDirectory
+
+from ipycli.notebookmanager import NotebookManager, notebook_hash
+
+class TestSaveDedupe(TestCase):
+
+    def test_unchanged_save_skipped(self):
+        with TemporaryDirectory() as td:
+            nbm = NotebookManager(notebook_dir=td)
+            backend = nbm.backend_by_path(td)
+            notebook_id = nbm.new_notebook(backend, name='test')
+            path = nbm.find_path(notebook_id)
+
+            last_mod, nb = nbm.get_notebook_object(notebook_id)
+            nbm.save_notebook_object(notebook_id, nb)
+            # same as what was loaded, nothing written
+            self.assertEquals(nbm.writes_skipped, 1)
+
+            nb.metadata.name = u'changed'
+            nbm.save_notebook_object(notebook_id, nb)
+            self.assertEquals(nbm.writes_performed, 1)
+            nbm.save_notebook_object(notebook_id, nb)
+            self.assertEquals(nbm.writes_skipped, 2)
+
+            # deleted behind our back, the save puts it back
+            os.unlink(path)
+            nbm.save_notebook_object(notebook_id, nb)
+            assert os.path.exists(path)
+            self.assertEquals(nbm.writes_performed, 2)
+
+            # changed by another editor
+            with open(path, 'w') as f:
+                f.write(current.writes(current.new_notebook(name=u'other'),
+                                       u'json'))
+            nbm.save_notebook_object(notebook_id, nb)
+            self.assertEquals(nbm.writes_performed, 3)
+            with open(path) as f:
+                self.assertEquals(current.reads(f.read(), u'json'), nb)
+
+    def test_hash_is_canonical(self):
+        a = current.new_notebook(name=u'a')
+        b = current.reads(current.writes(a, u'json'), u'json')
+        self.assertEquals(notebook_hash(a), notebook_hash(b))
+        self.assertEquals(notebook_hash({'x': 1, 'y': [2]}),
+                          notebook_hash({'y': [2], 'x': 1}))
+        self.assertNotEquals(notebook_hash({'x': 1}), notebook_hash([['x', 1]]))
+        self.assertNotEquals(notebook_hash({'x': 1}), notebook_hash({'x': 2}))
@@ -0,0 +1,114 @@
+"""Tests for the notebook search index."""
+
+import os
+from unittest import TestCase
+
+from IPython.nbformat import current
+from IPython.utils.tempdir import TemporaryDirectory
+
+from ipycli.notebookmanager import NotebookManager
+from ipycli.search import SearchIndex, notebook_text, fts_query
+
+def make_notebook(markdown, code):
+    cells = [current.new_text_cell(u'markdown', source=markdown),
+             current.new_code_cell(input=code)]
+    ws = current.new_worksheet(cells=cells)
+    return current.new_notebook(worksheets=[ws])
+
+class TestSearchIndex(TestCase):
+
+    def setUp(self):
+        self.index = SearchIndex()
+
+    def tearDown(self):
+        self.index.close()
+
+    def add(self, path, name, markdown=u'', code=u'', tags=()):
+        nb = make_notebook(markdown, code)
+        self.index.update(path, '/proj', name, list(tags), u'1',
+                          notebook_text(nb))
+
+    def test_query(self):
+        self.assertEquals(fts_query(u'Volatility surf'), u'volatility surf*')
+        self.assertEquals(fts_query(u'  "-*  '), None)
+
+    def test_ranking(self):
+        self.add('/proj/a.ipynb', u'prices', code=u'volatility = 1')
+        self.add('/proj/b.ipynb', u'volatility', markdown=u'notes')
+        self.add('/proj/c.ipynb', u'other', markdown=u'nothing here')
+        total, rows = self.index.search(u'volatility')
+        self.assertEquals(total, 2)
+        if self.index.fts5:
+            # a name match counts more than code
+            self.assertEquals([row[0] for row in rows],
+                              ['/proj/b.ipynb', '/proj/a.ipynb'])
+        # prefix of the last word
+        total, rows = self.index.search(u'volat')
+        self.assertEquals(total, 2)
+        total, rows = self.index.search(u'volatility', offset=1, limit=1)
+        self.assertEquals((total, len(rows)), (2, 1))
+
+    def test_update_remove(self):
+        self.add('/proj/a.ipynb', u'a', markdown=u'alpha', tags=[u'#quant'])
+        self.assertEquals(self.index.version('/proj/a.ipynb'), u'1')
+        self.assertEquals(self.index.paths('/proj'), set(['/proj/a.ipynb']))
+        # without text the content stays searchable
+        self.index.update('/proj/a.ipynb', '/proj', u'renamed', [], u'2')
+        self.assertEquals(self.index.search(u'alpha')[0], 1)
+        self.assertEquals(self.index.search(u'renamed')[0], 1)
+        self.assertEquals(self.index.search(u'quant')[0], 0)
+        self.add('/proj/a.ipynb', u'a', markdown=u'beta')
+        self.assertEquals(self.index.search(u'alpha')[0], 0)
+        self.index.remove('/proj/a.ipynb')
+        self.assertEquals(self.index.search(u'beta'), (0, []))
+        self.assertEquals(self.index.version('/proj/a.ipynb'), None)
+
+class TestManagerIndex(TestCase):
+
+    def setUp(self):
+        self.td = TemporaryDirectory()
+        self.dir = os.path.abspath(self.td.__enter__())
+        self.nbm = NotebookManager(notebook_dir=self.dir)
+        self.nbm.start_search()
+
+    def tearDown(self):
+        self.nbm.search_pool.close()
+        self.nbm.search_index.close()
+        self.td.__exit__(None, None, None)
+
+    def found(self, q):
+        # the pool has one thread, this runs after every queued update
+        self.nbm.search_pool.apply(lambda: None)
+        return [r['path'] for r in self.nbm.search_notebooks(q)['results']]
+
+    def test_save_rename_delete(self):
+        nbm = self.nbm
+        notebook_id = nbm.new_notebook(nbm.backend_by_path(self.dir),
+                                       name='alpha')
+        nb = make_notebook(u'volatility notes', u'x = 1')
+        nb.metadata.name = u'alpha'
+        nbm.save_notebook_object(notebook_id, nb)
+        self.assertEquals(self.found(u'volatility'), [nbm.find_path(notebook_id)])
+
+        nb.metadata.name = u'beta'
+        nbm._rename_notebook(notebook_id, nb)
+        beta = os.path.join(self.dir, 'beta.ipynb')
+        self.assertEquals(self.found(u'volatility'), [beta])
+        self.assertEquals(self.found(u'alpha'), [])
+
+        nbm.delete_notebook(notebook_id)
+        self.assertEquals(self.found(u'volatility'), [])
+        # a save finishing after the delete
+        nbm._index_saved(notebook_id, nb)
+
+    def test_dir_events(self):
+        nbm = self.nbm
+        path = os.path.join(self.dir, 'outside.ipynb')
+        with open(path, 'w') as f:
+            f.write(current.writes(make_notebook(u'', u'surface = 2'), u'json'))
+        nbm._on_dir_event(self.dir, 'create', path)
+        self.assertEquals(self.found(u'surface'), [path])
+
+        os.unlink(path)
+        nbm._on_dir_event(self.dir, 'delete', path)
+        self.assertEquals(self.found(u'surface'), [])
@@ -0,0 +1,30 @@
+"""Tests for the gist tag index."""
+
+from unittest import TestCase
+
+from ipycli.tag_index import TagIndex
+
+class TestTagIndex(TestCase):
+
+    def test_query(self):
+        index = TagIndex()
+        index.update('1', 'one #notebook #quant')
+        index.update('2', 'two #notebook #quant #test')
+        index.update('3', 'three #notebook #test #inactive')
+
+        self.assertEquals(index.query('#quant'), set(['1', '2']))
+        self.assertEquals(index.query('#quant', '#test'), set(['2']))
+        self.assertEquals(index.query('#test', exclude=['#inactive']), set(['2']))
+        self.assertEquals(index.query('#missing'), set())
+
+    def test_update_and_remove(self):
+        index = TagIndex()
+        index.update('1', 'one #notebook #quant')
+        old, new = index.update('1', 'one #notebook #test')
+        self.assertEquals(old, frozenset(['#notebook', '#quant']))
+        self.assertEquals(new, frozenset(['#notebook', '#test']))
+        assert '#quant' not in index.tags()
+
+        index.remove('1')
+        assert '1' not in index
+        self.assertEquals(index.tags(), [])